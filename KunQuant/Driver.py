@@ -1,13 +1,13 @@
 from KunQuant.passes import *
 from KunQuant.Stage import Function
-from KunQuant.Op import Input, Output, OpBase, CrossSectionalOp
-from typing import Dict, List, Union
+from KunQuant.Op import Input, Output, OpBase, NoStockSplitTrait
+from typing import Dict, List, Set, Union
 import typing
 from collections import OrderedDict
 from dataclasses import dataclass, field
 from KunQuant.passes import Util as PassUtil
 
-required_version = "0x64100003"
+required_version = "0x64100009"
 @dataclass
 class KunCompilerConfig:
     partition_factor : int = 3
@@ -16,6 +16,7 @@ class KunCompilerConfig:
     input_layout:str = "STs"
     output_layout:str = "STs"
     allow_unaligned: Union[bool, None] = None
+    split_source: int = 0
     options: dict = field(default_factory=dict)
 
 def optimize(f: Function, options: dict)->Dict[str, int]:
@@ -48,11 +49,13 @@ class _Buffer:
     name: str
     kind: str
     num_users: int = 0
+    # the slot in the arena of the temp buffers
+    slot: int = 0
 
     def to_str(self, unreliables: Dict[str, int], stream_windows: Dict[str, int]) -> str:
         unrel = unreliables.get(self.name, 0)
         swindow = stream_windows.get(self.name, 1)
-        return f'{{{self.idx}, "{self.name}", {self.num_users}, BufferKind::{self.kind}, {unrel}, {swindow}}}'
+        return f'{{{self.idx}, "{self.name}", {self.num_users}, BufferKind::{self.kind}, {unrel}, {swindow}, {self.slot}}}'
 
 @dataclass
 class _Partition:
@@ -63,18 +66,136 @@ class _Partition:
     outs: List['_Partition'] = None
     num_in_dep = 0
     is_cross_sectional = False
+    # if the stocks of the cross sectional stage can be split into parts in short runs
+    split_stocks = False
+    cost = 0
+    priority = 0
 
     def __post_init__(self):
         for buf in self.in_buf:
             buf.num_users += 1
 
+class _StageBufferIds:
+    '''
+    In split source mode, the generated code of a stage refers to the buffers via a per-stage table
+    of buffer ids instead of the global buffer indices. So the source code of a stage does not depend
+    on the other stages and its compiled object can be reused when other stages are changed.
+    '''
+    def __init__(self, stage_name: str, input_name_to_idx: Dict[str, int], query_temp_buf_id) -> None:
+        self.stage_name = stage_name
+        self.input_name_to_idx = input_name_to_idx
+        self.query = query_temp_buf_id
+        self.ids: List[int] = []
+
+    def table_name(self) -> str:
+        return f"stage_{self.stage_name}_buffer_ids"
+
+    def _ref(self, idx: int) -> str:
+        if idx not in self.ids:
+            self.ids.append(idx)
+        return f"{self.table_name()}[{self.ids.index(idx)}]"
+
+    def __getitem__(self, name: str) -> str:
+        return self._ref(self.input_name_to_idx[name])
+
+    def query_temp_buf_id(self, tempname: str, window: int) -> str:
+        return self._ref(self.query(tempname, window))
+
+def _group_stages(stage_src: Dict[str, str], split_source: int) -> List[List[str]]:
+    names = list(stage_src.keys())
+    if split_source == -1 or split_source >= len(names):
+        return [[name] for name in names]
+    # greedily assign the largest stages first to the group with least code, to balance
+    # the compile time of the translation units
+    loads = [0] * split_source
+    groups: List[List[str]] = [[] for _ in range(split_source)]
+    for name in sorted(names, key=lambda n: len(stage_src[n]), reverse=True):
+        idx = loads.index(min(loads))
+        loads[idx] += len(stage_src[name])
+        groups[idx].append(name)
+    order = dict([(name, idx) for idx, name in enumerate(names)])
+    return [sorted(g, key=lambda n: order[n]) for g in groups if g]
+
+# the estimated cost of a cross-sectional op for each time step, in the unit of an elementwise op.
+# It sorts or scans all stocks
+_cross_sectional_cost = 16
+
+def _estimate_stage_cost(func: Function, is_cross_sectional: bool) -> int:
+    '''
+    Estimate the relative execution time of a stage. An op in a ForeachBackWindow loop is
+    executed "window" times for each time step
+    '''
+    if is_cross_sectional:
+        return _cross_sectional_cost
+    cost = 0
+    for op in func.ops:
+        if isinstance(op, (Input, Output)):
+            continue
+        weight = 1
+        loop = op.get_parent()
+        while loop is not None:
+            weight *= loop.attrs["window"]
+            loop = loop.get_parent()
+        cost += weight
+    return cost
+
+def _plan_temp_slots(stages: List[_Partition]) -> int:
+    '''
+    Assign the TEMP buffers to the slots of an arena, which is allocated once for each run. All temp
+    buffers have the same size. The stages can run in any order allowed by the dependencies, or in
+    parallel. So a buffer can take the slot of another one only if all consumers of the latter are
+    ancestors of the producer of the former. Then the lifetimes of them never overlap in any schedule.
+    The stages should be in topological order. Returns the number of slots
+    '''
+    preds: Dict[int, List[_Partition]] = dict([(s.idx, []) for s in stages])
+    consumers: Dict[int, Set[int]] = dict()
+    for s in stages:
+        for out in s.outs:
+            preds[out.idx].append(s)
+        for buf in s.in_buf:
+            consumers.setdefault(buf.idx, set()).add(s.idx)
+    ancestors: Dict[int, Set[int]] = dict()
+    # the last buffer assigned to each slot. The consumers of the previous buffers in the slot are
+    # ancestors of the producer of the last one
+    slots: List[_Buffer] = []
+    for s in stages:
+        anc = set()
+        for pred in preds[s.idx]:
+            anc.add(pred.idx)
+            anc.update(ancestors[pred.idx])
+        ancestors[s.idx] = anc
+        for buf in s.out_buf:
+            if buf.kind != "TEMP":
+                continue
+            buf.slot = len(slots)
+            for slot_idx, last in enumerate(slots):
+                users = consumers.get(last.idx, None)
+                if users and users.issubset(anc):
+                    buf.slot = slot_idx
+                    break
+            if buf.slot == len(slots):
+                slots.append(buf)
+            else:
+                slots[buf.slot] = buf
+    return len(slots)
+
 def _deprecation_check(name: str, argname: str) -> str:
     if name == "ST8s":
         print(f"The layout name given in {argname} ST8s is depracated. Use STs and blocking_len=8 instead")
         return "STs"
     return name
 
-def compileit(f: Function, module_name: str, partition_factor = 3, dtype = "float", blocking_len = None, input_layout = "STs", output_layout = "STs", allow_unaligned: Union[bool, None] = None, options = {}):
+def compileit(f: Function, module_name: str, partition_factor = 3, dtype = "float", blocking_len = None, input_layout = "STs", output_layout = "STs", allow_unaligned: Union[bool, None] = None, split_source = 0, options = {}) -> Union[str, List[str]]:
+    '''
+    Compile the function to C++ source code. If split_source is 0, returns a single source.
+    Otherwise, the functions of the non-cross-sectional stages are generated in separated
+    translation units and a list of sources are returned. The first source contains the module
+    definition and the others contain the stages. split_source=-1 puts each stage in its own
+    translation unit. A positive split_source N groups the stages into at most N translation
+    units of similar code size, so that they can be compiled in parallel.
+    '''
+    if split_source < -1:
+        raise RuntimeError(f"Bad split_source value {split_source}")
     input_layout = _deprecation_check(input_layout, "input_layout")
     output_layout = _deprecation_check(output_layout, "input_layout")
     if dtype not in ["float", "double"]:
@@ -91,14 +212,8 @@ def compileit(f: Function, module_name: str, partition_factor = 3, dtype = "floa
         print("Ignoring input_layout because output_layout is stream mode")
         input_layout = "STREAM"
 
-    if stream_mode and options.get("opt_reduce", False):
-        raise RuntimeError("Currently opt_reduce in stream mode is not supported.")
-    if stream_mode and allow_unaligned is None:
-        allow_unaligned = False
-    elif allow_unaligned is None:
+    if allow_unaligned is None:
         allow_unaligned = True
-    if allow_unaligned and stream_mode:
-        raise RuntimeError("Currently allow_unaligned in stream mode is not supported.")
 
     input_name_to_idx: Dict[str, int] = dict()
     buffer_names: List[_Buffer] = []
@@ -134,27 +249,39 @@ def compileit(f: Function, module_name: str, partition_factor = 3, dtype = "floa
         elif isinstance(op, Output):
             insert_name(op, "OUTPUT")
 
+    unbounded_window = has_unbounded_window(f)
     required_windows = optimize(f, options)
     mainf, impl = do_partition(f, partition_factor, options)
     input_windows = post_optimize(impl, options)
 
-    impl_src = ['''#include <Kun/Context.hpp>
+    header_src = '''#include <Kun/Context.hpp>
 #include <Kun/Module.hpp>
 #include <Kun/Ops.hpp>
 #include <Kun/Rank.hpp>
 #include <Kun/Scale.hpp>
+#include <Kun/Normalize.hpp>
+#include <Kun/Group.hpp>
 #include <Kun/Ops/Quantile.hpp>
+#include <Kun/Ops/SortedWindow.hpp>
 
 
 using namespace kun;
 using namespace kun::ops;
-''']    
+'''
+    impl_src = [header_src]
+    # the namespace of the stage functions in split source mode, to avoid name conflicts between modules
+    stage_namespace = f"kun_stages_{module_name}"
+    stage_src: typing.OrderedDict[str, str] = OrderedDict()
+    stage_buffer_ids: List[_StageBufferIds] = []
     for func in impl:
         pins = []
         pouts = []
         ins = []
         outs = []
-        for op in func.ops:
+        cs_op = get_cross_sectional_op(func)
+        # the input buffers of a cross sectional stage are in the order of the inputs of the op
+        stage_ops = func.ops if cs_op is None else list(dict.fromkeys(cs_op.inputs)) + [op for op in func.ops if isinstance(op, Output)]
+        for op in stage_ops:
             if isinstance(op, Input):
                 buf = insert_name(op, "TEMP")
                 pins.append(buf)
@@ -168,19 +295,47 @@ using namespace kun::ops;
         def query_temp_buf_id(tempname: str, window: int) -> int:
             input_windows[tempname] = window
             return insert_name_str(tempname, "TEMP").idx
-        src = codegen_cpp(func, input_name_to_idx, ins, outs, options, stream_mode, query_temp_buf_id, input_windows, dtype, blocking_len, not allow_unaligned)
-        impl_src.append(src)
         newparti = _Partition(func.name, len(partitions), pins, pouts)
-        if len(func.ops) == 3 and isinstance(func.ops[1], CrossSectionalOp):
+        if cs_op is not None:
             newparti.is_cross_sectional = True
+            newparti.split_stocks = not isinstance(cs_op, NoStockSplitTrait)
+        newparti.cost = _estimate_stage_cost(func, newparti.is_cross_sectional)
+        if split_source != 0 and not newparti.is_cross_sectional:
+            ids = _StageBufferIds(func.name, input_name_to_idx, query_temp_buf_id)
+            src = codegen_cpp(func, ids, ins, outs, options, stream_mode, ids.query_temp_buf_id, input_windows, dtype, blocking_len, not allow_unaligned, False)
+            stage_src[func.name] = f"extern const size_t {ids.table_name()}[];\n{src}"
+            stage_buffer_ids.append(ids)
+        else:
+            src = codegen_cpp(func, input_name_to_idx, ins, outs, options, stream_mode, query_temp_buf_id, input_windows, dtype, blocking_len, not allow_unaligned)
+            impl_src.append(src)
         partitions[func.name] = newparti
     for p in mainf.ops:
         cur = partitions[p.attrs["name"]]
         cur.num_in_dep = len(p.inputs)
         cur.outs = [partitions[use.attrs["name"]] for use in mainf.op_to_id[p].uses]
+    # the priority of a stage is the cost of the longest path from it to a sink of the stage graph.
+    # The executors run the ready stages on the critical path first
+    for p in reversed(mainf.ops):
+        cur = partitions[p.attrs["name"]]
+        cur.priority = cur.cost + max([out.priority for out in cur.outs], default=0)
+    num_temp_slots = 0
+    if not stream_mode and options.get("memory_plan", True):
+        num_temp_slots = _plan_temp_slots([partitions[p.attrs["name"]] for p in mainf.ops])
 
     if PassUtil.debug_mode:
-        print("Num temp buffers: ", num_temp_buffer)
+        print("Num temp buffers: ", num_temp_buffer, "Num temp slots: ", num_temp_slots)
+
+    if stage_src:
+        decl_src = []
+        for ids in stage_buffer_ids:
+            decl_src.append(f"void stage_{ids.stage_name}(Context* __ctx, size_t __stock_idx, size_t __total_time, size_t __start, size_t __length);")
+            id_lines = ", ".join([str(v) for v in ids.ids]) if ids.ids else "0"
+            decl_src.append(f"extern const size_t {ids.table_name()}[] = {{{id_lines}}};")
+        decl_src2 = "\n".join(decl_src)
+        impl_src.append(f'''namespace {stage_namespace} {{
+{decl_src2}
+}}
+using namespace {stage_namespace};''')
 
     buffer_src = ",\n".join(["    "+ v.to_str(required_windows, input_windows) for v in buffer_names])
     impl_src.append(f"static BufferInfo __buffers[]{{\n{buffer_src}\n}};")
@@ -203,7 +358,8 @@ using namespace kun::ops;
     parti_info_src = ",\n".join([f'''    {{/*f*/ stage_{parti.name}, /*dependers*/ stage_{parti.name}_dep, /*num_dependers*/ {len(parti.outs)},
      /*in_buffers*/ stage_{parti.name}_in_buf, /*num_in_buffers*/ {len(parti.in_buf)},
      /*out_buffers*/ stage_{parti.name}_out_buf, /*num_out_buffers*/ {len(parti.out_buf)}, /*pending_out*/ {parti.num_in_dep},
-     /*num_tasks*/ TaskExecKind::{"SLICE_BY_TIME" if parti.is_cross_sectional else "SLICE_BY_STOCK"}, /*id*/ {parti.idx}}}''' for parti in partitions.values()])
+     /*num_tasks*/ TaskExecKind::{"SLICE_BY_TIME" if parti.is_cross_sectional else "SLICE_BY_STOCK"}, /*id*/ {parti.idx},
+     /*priority*/ {parti.priority}, /*split_stocks*/ {"true" if parti.split_stocks else "false"}}}''' for parti in partitions.values()])
     impl_src.append(f'''static Stage __stages[] = {{
 {parti_info_src}
 }};''')
@@ -229,6 +385,17 @@ using namespace kun::ops;
     MemoryLayout::{output_layout},
     {blocking_len},
     Datatype::{dty},
-    {"0" if allow_unaligned else "1"}
+    {"0" if allow_unaligned else "1"},
+    {num_temp_slots},
+    {"1" if unbounded_window else "0"}
 }};''')
-    return "\n\n".join(impl_src)
+    if split_source == 0:
+        return "\n\n".join(impl_src)
+    ret = ["\n\n".join(impl_src)]
+    for group in _group_stages(stage_src, split_source):
+        group_src = "\n\n".join([stage_src[name] for name in group])
+        ret.append(f'''{header_src}
+namespace {stage_namespace} {{
+{group_src}
+}}''')
+    return ret
@@ -388,8 +388,15 @@ class ReductionOp(OpBase, StatefulOpTrait):
 
 
 class CrossSectionalOp(OpBase):
-    def __init__(self, v: OpBase) -> None:
-        super().__init__([v], None)
+    def __init__(self, v: OpBase, attrs: Union[List[Tuple[str, object]], OrderedDict, None] = None) -> None:
+        super().__init__([v], attrs)
+
+class NoStockSplitTrait:
+    '''
+    The cross sectional ops whose kernels compute all stocks of a time step in one task. Their stages are not split by
+    stocks in short runs
+    '''
+    pass
 
 class Rank(CrossSectionalOp):
     '''
@@ -405,6 +412,59 @@ class Scale(CrossSectionalOp):
     '''
     pass
 
+class ZScore(CrossSectionalOp):
+    '''
+    the cross sectional z-score among different stocks, with the sample standard deviation
+    Similar to df.sub(df.mean(axis=1), axis=0).div(df.std(axis=1), axis=0)
+    '''
+    pass
+
+class Demean(CrossSectionalOp):
+    '''
+    subtract the cross sectional mean among different stocks
+    Similar to df.sub(df.mean(axis=1), axis=0)
+    '''
+    pass
+
+class Winsorize(CrossSectionalOp):
+    '''
+    clip the values into [mean - sigma * std, mean + sigma * std] of the stocks at the same time, with the
+    sample standard deviation. The values are unchanged when there are fewer than 2 valid stocks
+    Similar to df.clip(df.mean(axis=1) - sigma * df.std(axis=1), df.mean(axis=1) + sigma * df.std(axis=1), axis=0)
+    '''
+    def __init__(self, v: OpBase, sigma: float = 3.0) -> None:
+        super().__init__(v, [("sigma", sigma)])
+
+class GroupCrossSectionalOp(CrossSectionalOp, NoStockSplitTrait):
+    '''
+    The cross sectional ops among the stocks in the same group, e.g. the industry. The group ids of the stocks
+    are given by the input "group" of non-negative integers, which may change over time. The outputs of the
+    stocks with NaN or negative group ids are NaN
+    '''
+    def __init__(self, v: OpBase, group: OpBase) -> None:
+        OpBase.__init__(self, [v, group], None)
+
+class GroupRank(GroupCrossSectionalOp):
+    '''
+    the cross sectional rank among the stocks in the same group. Between [0, 1]
+    Similar to df.groupby(group, axis=1).rank(pct=True, method="average") at each time
+    '''
+    pass
+
+class GroupScale(GroupCrossSectionalOp):
+    '''
+    scale the stocks in the same group, to make the sum of the absolute values of the group 1
+    Similar to df.div(df.abs().groupby(group, axis=1).transform("sum")) at each time
+    '''
+    pass
+
+class GroupDemean(GroupCrossSectionalOp):
+    '''
+    subtract the mean of the stocks in the same group, i.e. neutralize the factor by the groups
+    Similar to df.sub(df.groupby(group, axis=1).transform("mean")) at each time
+    '''
+    pass
+
 # if __name__ == "__main__":
 #     inp1 = Input("a")
 #     inp2 = Input("b")
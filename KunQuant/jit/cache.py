@@ -0,0 +1,218 @@
+import os
+import hashlib
+import subprocess
+import threading
+import time
+import uuid
+import shutil
+from typing import Dict, List, Optional
+from KunQuant.passes import Util
+
+def _default_cache_dir() -> str:
+    env = os.environ.get("KUN_JIT_CACHE_DIR", None)
+    if env:
+        return env
+    return os.path.join(os.path.expanduser("~"), ".cache", "KunQuant", "jit")
+
+_compiler_id_lock = threading.Lock()
+_compiler_ids: Dict[str, str] = {}
+
+def get_compiler_identity(compiler: str, env: Optional[dict] = None) -> str:
+    '''
+    Get the identity string of the C++ compiler. The result is memoized per compiler.
+    The "--version" output of GCC/clang contains the vendor and the version. MSVC prints
+    its banner to stderr when no input file is given.
+    '''
+    with _compiler_id_lock:
+        ret = _compiler_ids.get(compiler, None)
+        if ret is not None:
+            return ret
+    args = [compiler] if os.path.basename(compiler).lower().startswith("cl") else [compiler, "--version"]
+    try:
+        out = subprocess.run(args, shell=False, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True).stdout
+    except OSError:
+        out = ""
+    ret = compiler + "\n" + out
+    with _compiler_id_lock:
+        _compiler_ids[compiler] = ret
+    return ret
+
+def get_headers_digest(include_dirs: List[str]) -> str:
+    '''
+    Compute a digest over all C++ headers in the include dirs. Generated code depends on the headers
+    in cpp/Kun and cpp/KunSIMD, so a change of them should invalidate the cached objects.
+    '''
+    h = hashlib.sha256()
+    for d in include_dirs:
+        for root, dirs, files in os.walk(d):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith((".h", ".hpp")):
+                    continue
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, d).replace("\\", "/").encode())
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+class JitCache:
+    '''
+    On-disk content-addressed cache of the compiled objects and libraries. The files are stored
+    in a flat directory named by the hash key of their inputs, e.g. "<sha256>.o". Several processes can
+    share the same directory: files are written to a unique temp file and atomically renamed into
+    place, and a file evicted by another process is treated as a cache miss.
+
+    directory: the cache directory. If None, use env var KUN_JIT_CACHE_DIR or ~/.cache/KunQuant/jit
+    max_size: the max total size of the cached files in bytes. The least recently used files are evicted
+        when the cache grows larger than it. None for no limit
+    max_age: the max time in seconds since a cached file is last used. None for no limit
+    '''
+    def __init__(self, directory: Optional[str] = None, max_size: Optional[int] = 2 * 1024 * 1024 * 1024,
+                 max_age: Optional[float] = 30 * 24 * 3600) -> None:
+        self.directory = os.path.abspath(directory if directory else _default_cache_dir())
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        h = hashlib.sha256()
+        for p in parts:
+            data = p.encode()
+            # length-prefixed to make the concatenation unambiguous
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def pch_directory(self) -> str:
+        '''
+        The directory of the precompiled headers. Each precompiled header has a sub-directory named by its key
+        '''
+        return os.path.join(self.directory, "pch")
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def fetch(self, key: str, ext: str, outpath: str) -> bool:
+        '''
+        Copy the cached file of the key to outpath. Returns true if the cache is hit
+        '''
+        path = self._path(key, ext)
+        try:
+            shutil.copyfile(path, outpath)
+        except OSError:
+            self._count(False)
+            return False
+        try:
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(True)
+        if Util.jit_debug_mode:
+            print("[KUN_JIT] cache hit:", path)
+        return True
+
+    def store(self, key: str, ext: str, inpath: str) -> None:
+        path = self._path(key, ext)
+        tmppath = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copyfile(inpath, tmppath)
+            os.replace(tmppath, path)
+        except OSError:
+            # another process may be replacing or reading the same key (on Windows). The
+            # content is the same, so it is safe to give up
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+
+    def size(self) -> int:
+        total = 0
+        for entry in self._entries():
+            total += entry[2]
+        return total
+
+    def _entries(self):
+        '''
+        Returns a list of (path, last used time, size, is temp file) of the cached files and
+        precompiled header directories
+        '''
+        ret = []
+        try:
+            it = os.scandir(self.directory)
+        except OSError:
+            return ret
+        with it:
+            for e in it:
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                if e.is_file():
+                    ret.append((e.path, st.st_mtime, st.st_size, e.name.endswith(".tmp")))
+        try:
+            it = os.scandir(self.pch_directory())
+        except OSError:
+            return ret
+        with it:
+            for e in it:
+                try:
+                    if not e.is_dir():
+                        continue
+                    size = 0
+                    for f in os.scandir(e.path):
+                        size += f.stat().st_size
+                    ret.append((e.path, e.stat().st_mtime, size, False))
+                except OSError:
+                    continue
+        return ret
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        '''
+        Remove the files that are too old and then remove the least recently used files until
+        the total size is under max_size
+        '''
+        now = time.time()
+        live = []
+        for path, mtime, size, is_tmp in self._entries():
+            # a temp file should be renamed within seconds. It is leaked by a crashed process
+            expired = (now - mtime > 3600) if is_tmp else (self.max_age is not None and now - mtime > self.max_age)
+            if expired:
+                self._remove(path)
+            elif not is_tmp:
+                live.append((mtime, size, path))
+        if self.max_size is None:
+            return
+        total = sum(e[1] for e in live)
+        live.sort()
+        for mtime, size, path in live:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self) -> None:
+        for path, _, _, _ in self._entries():
+            self._remove(path)
@@ -2,7 +2,7 @@ import os
 import platform
 import subprocess
 import tempfile
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 import sys
 if sys.version_info[1] < 9:
     from typing import Callable
@@ -10,15 +10,19 @@ else:
     from collections.abc import Callable
 import KunQuant.runner.KunRunner as KunRunner
 from KunQuant.Driver import compileit as driver_compileit
-from KunQuant.Driver import KunCompilerConfig
+from KunQuant.Driver import KunCompilerConfig, required_version
 from KunQuant.Stage import Function
 from KunQuant.passes import Util
 from KunQuant.jit.env import get_compiler_env, get_msvc_compiler_dir
+from KunQuant.jit.cache import JitCache, get_compiler_identity, get_headers_digest
 import timeit
 import dataclasses
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
 import shutil
+import threading
+import atexit
+import uuid
 
 _cpp_root = os.path.join(os.path.dirname(__file__), "..", "..", "cpp")
 _include_path = [_cpp_root]
@@ -58,9 +62,11 @@ class NativeCPUFlags:
     pass
 
 class MSVCCommandLineBuilder:
+    supports_pch = False
+
     @staticmethod
     def build_compile_options(cfg: 'CppCompilerConfig', srcpath: str, outpath: str) -> List[str]:
-        cmd = [cfg.compiler, "/nologo", "/c", "/EHsc", f"/O{min(cfg.opt_level, 2)}", "/wd4251", "/wd4200", "/wd4305", srcpath] + [f"/I{v}" for v in _include_path]
+        cmd = [cfg.compiler, "/nologo", "/c", "/EHsc", f"/O{min(cfg.opt_level, 2)}", "/wd4251", "/wd4200", "/wd4305", srcpath] + [f"/I{v}" for v in _include_path] + list(cfg.other_flags)
         if isinstance(cfg.machine, NativeCPUFlags):
             # todo: should use native cpu flags
             cmd.append("/arch:AVX2")
@@ -80,6 +86,8 @@ class MSVCCommandLineBuilder:
         return cmd
 
 class GCCCommandLineBuilder:
+    supports_pch = True
+
     @staticmethod
     def build_compile_options(cfg: 'CppCompilerConfig', srcpath: str, outpath: str) -> List[str]:
         cmd = [cfg.compiler, "-std=c++11", f"-O{cfg.opt_level}", "-c", "-fPIC", "-fvisibility=hidden", "-fvisibility-inlines-hidden"]
@@ -94,9 +102,21 @@ class GCCCommandLineBuilder:
             if cfg.machine.avx512vl:
                 cmd.append("-mavx512vl")
         cmd += [f"-I{v}" for v in _include_path]
+        cmd += list(cfg.other_flags)
         cmd += [srcpath, "-o", outpath]
         return cmd
 
+    @staticmethod
+    def build_pch_options(cfg: 'CppCompilerConfig', srcpath: str, outpath: str) -> List[str]:
+        # the PCH can only be used by the compilation with the same flags
+        cmd = GCCCommandLineBuilder.build_compile_options(cfg, srcpath, outpath)
+        idx = cmd.index(srcpath)
+        return cmd[:idx] + ["-x", "c++-header"] + cmd[idx:]
+
+    @staticmethod
+    def use_pch_options(pchpath: str) -> List[str]:
+        return ["-include", pchpath, "-Winvalid-pch"]
+
     @staticmethod
     def build_link_options(cfg: 'CppCompilerConfig', paths: List[str], outpath: str) -> List[str]:
         return [cfg.compiler] + paths + ["-l", "KunRuntime", "-shared", "-L", _runtime_path, "-o", outpath]
@@ -115,25 +135,116 @@ class CppCompilerConfig:
     obj_ext: str = _config[_os_name][1]
     dll_ext: str = _config[_os_name][2]
     builder = _config[_os_name][3]
+    # generate the code in a way that is faster to compile, at the cost of slower generated code
+    fast_compile: bool = False
+    # use the precompiled header of the KunQuant runtime headers. Ignored if the compiler does not support it
+    pch: bool = False
+    # the persistent cache of the compiled objects and libraries. None to disable the cache
+    cache: Optional[JitCache] = None
+
+def fast_compile_config(**kwargs) -> CppCompilerConfig:
+    '''
+    The compiler config for developing and iterating on the factors. It trades the performance of
+    the generated code for a shorter compile time.
+    '''
+    kwargs.setdefault("pch", True)
+    return CppCompilerConfig(opt_level=1, fast_compile=True, **kwargs)
 
+_headers_digest: str = None
+def _cache_key_prefix(compiler: CppCompilerConfig) -> List[str]:
+    global _headers_digest
+    if _headers_digest is None:
+        _headers_digest = get_headers_digest(_include_path)
+    return [required_version, get_compiler_identity(compiler.compiler, get_compiler_env()), _headers_digest]
 
+def _object_cache_key(source: str, compiler: CppCompilerConfig) -> str:
+    # the paths are not a part of the key. The object is the same with or without the PCH
+    cmd = compiler.builder.build_compile_options(compiler, "<src>", "<out>")
+    return JitCache.make_key("obj", *_cache_key_prefix(compiler), *cmd, source)
+
+def _library_cache_key(object_keys: List[str], compiler: CppCompilerConfig) -> str:
+    cmd = compiler.builder.build_link_options(compiler, ["<obj>"], "<out>")
+    return JitCache.make_key("lib", *_cache_key_prefix(compiler), *cmd, *object_keys)
 
 def call_cpp_compiler(cmd: List[str], outpath: str) -> str:
     if Util.jit_debug_mode:
         print("[KUN_JIT] temp jit files:", outpath)
     if Util.jit_debug_mode:
         print("[KUN_JIT] cmd:", cmd)
-    subprocess.check_call(cmd, shell=False, env=get_compiler_env(), stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            creationflags=(subprocess.CREATE_NO_WINDOW if _win32 else 0))
+    def run():
+        subprocess.check_call(cmd, shell=False, env=get_compiler_env(), stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                creationflags=(subprocess.CREATE_NO_WINDOW if _win32 else 0))
+    if Util.jit_debug_mode:
+        print("[KUN_JIT] Compiling", os.path.basename(outpath), "takes", timeit.timeit(run, number=1), "s")
+    else:
+        run()
     return outpath
 
+# the headers included by all generated sources
+_pch_headers = ["Kun/Context.hpp", "Kun/Module.hpp", "Kun/Ops.hpp", "Kun/Rank.hpp", "Kun/Scale.hpp", "Kun/Normalize.hpp", "Kun/Group.hpp", "Kun/Ops/Quantile.hpp", "Kun/Ops/SortedWindow.hpp"]
+_pch_lock = threading.Lock()
+_pch_tempdir: str = None
+
+def _get_pch(compiler: CppCompilerConfig) -> str:
+    '''
+    Build the precompiled header for the compiler flags, or reuse the existing one. Returns the path
+    of the header to be included. The precompiled headers are stored in the JIT cache directory if
+    the cache is enabled. Otherwise, they are stored in a temp dir and are reused in this process.
+    '''
+    global _pch_tempdir
+    builder = compiler.builder
+    key = JitCache.make_key("pch", *_cache_key_prefix(compiler), *builder.build_pch_options(compiler, "<src>", "<out>"))
+    with _pch_lock:
+        if compiler.cache is not None:
+            base = compiler.cache.pch_directory()
+        else:
+            if _pch_tempdir is None:
+                _pch_tempdir = tempfile.mkdtemp()
+                atexit.register(shutil.rmtree, _pch_tempdir, True)
+            base = _pch_tempdir
+        pchdir = os.path.join(base, key)
+        header = os.path.join(pchdir, "kun_pch.hpp")
+        outpath = f"{header}.gch"
+        if os.path.exists(outpath):
+            # mark as recently used
+            os.utime(pchdir)
+            return header
+        os.makedirs(pchdir, exist_ok=True)
+        # the files are shared by multiple processes. Write them atomically
+        tmpheader = f"{header}.{uuid.uuid4().hex}.tmp"
+        with open(tmpheader, 'w') as f:
+            f.write("\n".join([f"#include <{v}>" for v in _pch_headers]) + "\n")
+        os.replace(tmpheader, header)
+        tmpout = f"{outpath}.{uuid.uuid4().hex}.tmp"
+        def build():
+            call_cpp_compiler(builder.build_pch_options(compiler, header, tmpout), tmpout)
+            os.replace(tmpout, outpath)
+        if Util.jit_debug_mode:
+            print("[KUN_JIT] Precompiled header takes ", timeit.timeit(build, number=1), "s")
+        else:
+            build()
+        return header
+
+def _build_compile_options(compiler: CppCompilerConfig, inpath: str, outpath: str) -> List[str]:
+    cmd = compiler.builder.build_compile_options(compiler, inpath, outpath)
+    if compiler.pch and compiler.builder.supports_pch:
+        cmd += compiler.builder.use_pch_options(_get_pch(compiler))
+    return cmd
+
 def call_cpp_compiler_src(source: str, module_name: str, compiler: CppCompilerConfig, tempdir: str) -> str:
     inpath = os.path.join(tempdir, f"{module_name}.cpp")
     outpath = os.path.join(tempdir, f"{module_name}.{compiler.obj_ext}")
     with open(inpath, 'w') as f:
         f.write(source)
-    return call_cpp_compiler( compiler.builder.build_compile_options(compiler, inpath, outpath), outpath)
+    if compiler.cache is None:
+        return call_cpp_compiler(_build_compile_options(compiler, inpath, outpath), outpath)
+    key = _object_cache_key(source, compiler)
+    if compiler.cache.fetch(key, compiler.obj_ext, outpath):
+        return outpath
+    call_cpp_compiler(_build_compile_options(compiler, inpath, outpath), outpath)
+    compiler.cache.store(key, compiler.obj_ext, outpath)
+    return outpath
 
 class _fake_temp:
     def __init__(self, dir: str, module_name: str, keep_files: bool) -> None:
@@ -158,7 +269,15 @@ def compileit(func: List[Tuple[str, Function, KunCompilerConfig]], libname: str,
         raise RuntimeError("if keep_files=True, tempdir should not be empty")
     def kuncompile():
         for name, f, cfg in func:
-            src.append((name, driver_compileit(f, name, **dataclasses.asdict(cfg))))
+            args = dataclasses.asdict(cfg)
+            if compiler_config.fast_compile:
+                args["options"]["fast_compile"] = True
+            code = driver_compileit(f, name, **args)
+            if isinstance(code, str):
+                src.append((name, code))
+            else:
+                # split source mode, each translation unit is compiled into an object
+                src.extend([(name if idx == 0 else f"{name}_{idx}", s) for idx, s in enumerate(code)])
     def dowork():
         nonlocal lib
         with _fake_temp(tempdir, libname, keep_files) as tmpdirname:
@@ -166,9 +285,16 @@ def compileit(func: List[Tuple[str, Function, KunCompilerConfig]], libname: str,
                 name, src = named_src
                 return call_cpp_compiler_src(src, name, compiler_config, tmpdirname)
   
-            libs = compiler_config.for_each(src, foreach_func)
+            cache = compiler_config.cache
             finallib = os.path.join(tmpdirname, f"{libname}.{compiler_config.dll_ext}")
-            finallib = call_cpp_compiler(compiler_config.builder.build_link_options(compiler_config, libs, finallib), finallib)
+            if cache is not None:
+                lib_key = _library_cache_key([_object_cache_key(s, compiler_config) for _, s in src], compiler_config)
+            if cache is None or not cache.fetch(lib_key, compiler_config.dll_ext, finallib):
+                libs = compiler_config.for_each(src, foreach_func)
+                finallib = call_cpp_compiler(compiler_config.builder.build_link_options(compiler_config, libs, finallib), finallib)
+                if cache is not None:
+                    cache.store(lib_key, compiler_config.dll_ext, finallib)
+                    cache.evict()
             if load:
                 lib = KunRunner.Library.load(finallib)
                 if _win32 and not keep_files:
@@ -40,6 +40,100 @@ class ExpMovingAvg(OpBase, GloablStatefulOpTrait):
     def __init__(self, v: OpBase, window: int) -> None:
         super().__init__([v], [("window", window)])
 
+class FastWindowedMinMaxBase(OpBase, GloablStatefulOpTrait):
+    '''
+    Base class of the fast min/max of a rolling look back window without reduction loop. It keeps a monotonic deque
+    for each SIMD lane as the state, so that each time step costs amortized O(1) instead of O(window). The output is
+    NaN if the window has NaN or is not full
+    '''
+    def __init__(self, v: OpBase, window: int) -> None:
+        super().__init__([v], [("window", window)])
+
+class FastWindowedMin(FastWindowedMinMaxBase):
+    '''
+    Fast min of a rolling look back window, including the current newest data. The same as ReduceMin in a loop
+    Similar to pandas.DataFrame.rolling(window).min()
+    '''
+    pass
+
+class FastWindowedMax(FastWindowedMinMaxBase):
+    '''
+    Fast max of a rolling look back window, including the current newest data. The same as ReduceMax in a loop
+    Similar to pandas.DataFrame.rolling(window).max()
+    '''
+    pass
+
+class FastWindowedArgMin(FastWindowedMinMaxBase):
+    '''
+    The number of time steps from the oldest min of a rolling look back window to the current newest data. The same
+    as ReduceArgMin in a loop
+    '''
+    pass
+
+class FastWindowedArgMax(FastWindowedMinMaxBase):
+    '''
+    The number of time steps from the oldest max of a rolling look back window to the current newest data. The same
+    as ReduceArgMax in a loop
+    '''
+    pass
+
+class FastWindowedRank(OpBase, WindowedTrait, GloablStatefulOpTrait):
+    '''
+    Fast time series rank of the newest data in a rolling look back window without reduction loop. The same as
+    ReduceRank in a loop. It keeps the sorted values of the window for each SIMD lane as the state, so that each time
+    step costs O(log window) comparisons instead of O(window)
+    '''
+    def __init__(self, v: OpBase, window: int) -> None:
+        super().__init__([v], [("window", window)])
+
+    def required_input_window(self) -> int:
+        return self.attrs["window"] + 1
+
+class FastWindowedQuantile(OpBase, WindowedTrait, GloablStatefulOpTrait):
+    '''
+    Fast quantile of a rolling look back window. The same as WindowedQuantile, but it keeps the sorted values of the
+    window for each SIMD lane as the state instead of sorting the window in each time step
+    '''
+    def __init__(self, v: OpBase, window: int, q: float) -> None:
+        super().__init__([v], [("window", window), ("q", q)])
+
+    def required_input_window(self) -> int:
+        return self.attrs["window"] + 1
+
+class FastWindowedStddev(OpBase, WindowedTrait, GloablStatefulOpTrait):
+    '''
+    Fast unbiased standard deviation of a rolling look back window without reduction loop. The same as
+    WindowedStddev, but it keeps the running sums of the values and the squared values of the window as the state,
+    which are updated with the Kahan compensation in each time step
+    '''
+    def __init__(self, v: OpBase, window: int) -> None:
+        super().__init__([v], [("window", window)])
+
+    def required_input_window(self) -> int:
+        return self.attrs["window"] + 1
+
+class FastWindowedCovariance(OpBase, WindowedTrait, GloablStatefulOpTrait):
+    '''
+    Fast unbiased estimated covariance of a rolling look back window of two inputs without reduction loop. The same
+    as WindowedCovariance, but it keeps the running moments of the window as the state
+    '''
+    def __init__(self, v: OpBase, window: int, v2: OpBase) -> None:
+        super().__init__([v, v2], [("window", window)])
+
+    def required_input_window(self) -> int:
+        return self.attrs["window"] + 1
+
+class FastWindowedCorrelation(OpBase, WindowedTrait, GloablStatefulOpTrait):
+    '''
+    Fast correlation of a rolling look back window of two inputs without reduction loop. The same as
+    WindowedCorrelation, but it keeps the running moments of the window as the state
+    '''
+    def __init__(self, v: OpBase, window: int, v2: OpBase) -> None:
+        super().__init__([v, v2], [("window", window)])
+
+    def required_input_window(self) -> int:
+        return self.attrs["window"] + 1
+
 class WindowedLinearRegression(OpBase, WindowedTrait, GloablStatefulOpTrait):
     '''
     Compute states of Windowed Linear Regression
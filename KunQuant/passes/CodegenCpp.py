@@ -70,10 +70,68 @@ def _value_to_float(op: OpBase, dtype: str) -> str:
 
 vector_len = 8
 
-def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tuple[Input, bool]], outputs: List[Tuple[Output, bool]], options: dict, stream_mode: bool, query_temp_buffer_id, stream_window_size: Dict[str, int], elem_type: str, simd_lanes: int, aligned: bool) -> str:
-    if len(f.ops) == 3 and isinstance(f.ops[1], CrossSectionalOp):
-        return f'''static auto stage_{f.name} = {f.ops[1].__class__.__name__}Stocks<Mapper{f.ops[0].attrs["layout"]}<{elem_type}, {simd_lanes}>, Mapper{f.ops[2].attrs["layout"]}<{elem_type}, {simd_lanes}>>;'''
-    header = f'''static void stage_{f.name}(Context* __ctx, size_t __stock_idx, size_t __total_time, size_t __start, size_t __length) '''
+# the number of SIMD vectors in the state of the stateful ops in Ops.hpp
+_stream_state_vectors = {
+    "FastWindowedSum": 4,
+    "ExpMovingAvg": 1,
+    "WindowedLinearRegression": 7,
+    "FastWindowedStddev": 9,
+    "FastWindowedCovariance": 18,
+    "FastWindowedCorrelation": 18,
+}
+
+def _monotonic_deque_state_vectors(window: int, elem_type: str, simd_lanes: int) -> int:
+    '''
+    the number of SIMD vectors in the state of MonotonicDeque in Ops.hpp: the values and the uint32 steps of
+    the deques, 3 uint32 arrays for the lanes and the uint32 step count
+    '''
+    elem_size = 4 if elem_type == "float" else 8
+    state_bytes = simd_lanes * window * (elem_size + 4) + simd_lanes * 12 + 4
+    vector_bytes = elem_size * simd_lanes
+    return (state_bytes + vector_bytes - 1) // vector_bytes
+
+def _sorted_window_state_vectors(window: int, elem_type: str, simd_lanes: int) -> int:
+    '''
+    the number of SIMD vectors in the state of SortedWindow in Ops/SortedWindow.hpp: the sorted values and the uint32
+    count of the lanes
+    '''
+    elem_size = 4 if elem_type == "float" else 8
+    state_bytes = simd_lanes * window * elem_size + simd_lanes * 4
+    vector_bytes = elem_size * simd_lanes
+    return (state_bytes + vector_bytes - 1) // vector_bytes
+
+def _round_up_pow2(v: int) -> int:
+    ret = 1
+    while ret < v:
+        ret *= 2
+    return ret
+
+def get_cross_sectional_op(f: Function) -> CrossSectionalOp:
+    '''
+    Get the CrossSectionalOp of a cross sectional stage, which has only the Input ops of the CrossSectionalOp,
+    the CrossSectionalOp and an Output op. Returns None if f is not a cross sectional stage
+    '''
+    ops = [op for op in f.ops if not isinstance(op, (Input, Output))]
+    if len(ops) == 1 and isinstance(ops[0], CrossSectionalOp) and len(f.ops) == len(set(ops[0].inputs)) + 2:
+        return ops[0]
+    return None
+
+def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tuple[Input, bool]], outputs: List[Tuple[Output, bool]], options: dict, stream_mode: bool, query_temp_buffer_id, stream_window_size: Dict[str, int], elem_type: str, simd_lanes: int, aligned: bool, is_static: bool = True) -> str:
+    cs_op = get_cross_sectional_op(f)
+    if cs_op is not None:
+        # the mappers of the inputs of the op and the output
+        buffers = list(cs_op.inputs) + [op for op in f.ops if isinstance(op, Output)]
+        mappers = ", ".join([f'Mapper{op.attrs["layout"]}<{elem_type}, {simd_lanes}>' for op in buffers])
+        kernel = f'''{cs_op.__class__.__name__}Stocks<{mappers}>'''
+        if not cs_op.attrs:
+            return f'''static auto stage_{f.name} = {kernel};'''
+        # pass the attributes of the op as the extra arguments of the kernel
+        args = "".join([", " + _float_value_to_float(v, elem_type) for v in cs_op.attrs.values()])
+        return f'''static void stage_{f.name}(RuntimeStage *stage, size_t __time_idx, size_t __total_time, size_t __start, size_t __length) {{
+    {kernel}(stage, __time_idx, __total_time, __start, __length{args});
+}}'''
+    linkage = "static " if is_static else ""
+    header = f'''{linkage}void stage_{f.name}(Context* __ctx, size_t __stock_idx, size_t __total_time, size_t __start, size_t __length) '''
     toplevel = _CppScope(None)
     buffer_type: Dict[OpBase, str] = dict()
     ptrname = "" if elem_type == "float" else "D"
@@ -87,12 +145,13 @@ def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tup
         if stream_mode:
             window_size = stream_window_size.get(name, 1)
             buffer_type[inp] = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}>"
-            code = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].stream_buf, __stock_idx, __ctx->stock_count}};"
+            code = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].stream_buf{ptrname}, __stock_idx, __ctx->stock_count}};"
         else:
             buffer_type[inp] = f"Input{layout}<{elem_type}, {simd_lanes}>"
             code = f"Input{layout}<{elem_type}, {simd_lanes}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].ptr{ptrname}, __stock_idx, __ctx->stock_count, {total_str}, {start_str}}};"
         toplevel.scope.append(_CppSingleLine(toplevel, code))
-    if not aligned:
+    # in stream mode, the rows of the stream buffers are padded to whole SIMD vectors, so no masks are needed
+    if not aligned and not stream_mode:
         toplevel.scope.append(_CppSingleLine(toplevel, f'''auto todo_count = __ctx->stock_count - __stock_idx  * {simd_lanes};'''))
         toplevel.scope.append(_CppSingleLine(toplevel, f'''auto mask = kun_simd::vec<{elem_type}, {simd_lanes}>::make_mask(todo_count > {simd_lanes} ? {simd_lanes} : todo_count);'''))
     for idx, (outp, is_tmp) in enumerate(outputs):
@@ -103,7 +162,7 @@ def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tup
         if stream_mode:
             window_size = stream_window_size.get(name, 1)
             buffer_type[inp] = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}>"
-            code = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].stream_buf, __stock_idx, __ctx->stock_count}};"
+            code = f"StreamWindow<{elem_type}, {simd_lanes}, {window_size}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].stream_buf{ptrname}, __stock_idx, __ctx->stock_count}};"
         else:
             buffer_type[inp] = f"Output{layout}<{elem_type}, {simd_lanes}>"
             code = f"Output{layout}<{elem_type}, {simd_lanes}> buf_{name}{{__ctx->buffers[{idx_in_ctx}].ptr{ptrname}, __stock_idx, __ctx->stock_count, __length, 0}};"
@@ -115,12 +174,25 @@ def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tup
             if stream_mode:
                 buffer_type[op] = f"StreamWindow<{elem_type}, {simd_lanes}, {window}>"
                 bufname = f"{f.name}_{idx}"
-                code = f"StreamWindow<{elem_type}, {simd_lanes}, {window}> temp_{idx}{{__ctx->buffers[{query_temp_buffer_id(bufname, window)}].stream_buf, __stock_idx, __ctx->stock_count}};"
+                code = f"StreamWindow<{elem_type}, {simd_lanes}, {window}> temp_{idx}{{__ctx->buffers[{query_temp_buffer_id(bufname, window)}].stream_buf{ptrname}, __stock_idx, __ctx->stock_count}};"
             else:
+                if options.get("fast_compile", False):
+                    # a larger ring buffer is still correct. Reduce the number of template instances
+                    window = _round_up_pow2(window)
                 buffer_type[op] = f"OutputWindow<{elem_type}, {simd_lanes}, {window}>"
                 code = f"OutputWindow<{elem_type}, {simd_lanes}, {window}> temp_{idx}{{}};"
             toplevel.scope.append(_CppSingleLine(toplevel, code))
 
+    def declare_state(typename: str, varname: str, idx: int, num_vectors: int = None) -> str:
+        if not stream_mode:
+            return f"{typename} {varname};"
+        # in stream mode, the state of the op is kept in a stream buffer across the ticks. The window of
+        # the buffer is the number of SIMD vectors in the state
+        if num_vectors is None:
+            num_vectors = _stream_state_vectors[typename[:typename.index("<")]]
+        bufidx = query_temp_buffer_id(f"{f.name}_{idx}_state", num_vectors)
+        return f"auto& {varname} = getStreamState<{typename}, {simd_lanes}, {num_vectors}>(__ctx->buffers[{bufidx}].stream_buf{ptrname}, __stock_idx, __ctx->stock_count);"
+
     top_for = _CppFor(toplevel, "for(size_t i = 0;i < __length;i++) ")
     toplevel.scope.append(top_for)
     top_body = top_for.body
@@ -214,24 +286,48 @@ def codegen_cpp(f: Function, input_name_to_idx: Dict[str, int], inputs: List[Tup
             funcname = "windowedQuantile"
             scope.scope.append(_CppSingleLine(scope, f'auto v{idx} = {funcname}<{elem_type}, {simd_lanes}, {op.attrs["window"]}>({buf_name}, i, {_float_value_to_float(op.attrs["q"], elem_type)});'))
         elif isinstance(op, FastWindowedSum):
-            if stream_mode: raise RuntimeError(f"Stream Mode does not support {op.__class__.__name__}")
             assert(op.get_parent() is None)
             buf_name = _get_buffer_name(op.inputs[0], inp[0])
             window = op.attrs["window"]
-            toplevel.scope.insert(-1, _CppSingleLine(toplevel, f"FastWindowedSum<{elem_type}, {simd_lanes}, {window}> sum_{idx};"))
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"FastWindowedSum<{elem_type}, {simd_lanes}, {window}>", f"sum_{idx}", idx)))
             scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = sum_{idx}.step({buf_name}, v{inp[0]}, i);"))
         elif isinstance(op, ExpMovingAvg):
-            if stream_mode: raise RuntimeError(f"Stream Mode does not support {op.__class__.__name__}")
             assert(op.get_parent() is None)
             window = op.attrs["window"]
-            toplevel.scope.insert(-1, _CppSingleLine(toplevel, f"ExpMovingAvg<{elem_type}, {simd_lanes}, {window}> ema_{idx};"))
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"ExpMovingAvg<{elem_type}, {simd_lanes}, {window}>", f"ema_{idx}", idx)))
             scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = ema_{idx}.step(v{inp[0]}, i);"))
+        elif isinstance(op, FastWindowedMinMaxBase):
+            assert(op.get_parent() is None)
+            window = op.attrs["window"]
+            num_vectors = _monotonic_deque_state_vectors(window, elem_type, simd_lanes)
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"{op.__class__.__name__}<{elem_type}, {simd_lanes}, {window}>", f"deque_{idx}", idx, num_vectors)))
+            scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = deque_{idx}.step(v{inp[0]}, i);"))
+        elif isinstance(op, (FastWindowedRank, FastWindowedQuantile)):
+            assert(op.get_parent() is None)
+            buf_name = _get_buffer_name(op.inputs[0], inp[0])
+            window = op.attrs["window"]
+            num_vectors = _sorted_window_state_vectors(window, elem_type, simd_lanes)
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"{op.__class__.__name__}<{elem_type}, {simd_lanes}, {window}>", f"sorted_{idx}", idx, num_vectors)))
+            q = f', {_float_value_to_float(op.attrs["q"], elem_type)}' if isinstance(op, FastWindowedQuantile) else ""
+            scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = sorted_{idx}.step({buf_name}, v{inp[0]}, i{q});"))
+        elif isinstance(op, FastWindowedStddev):
+            assert(op.get_parent() is None)
+            buf_name = _get_buffer_name(op.inputs[0], inp[0])
+            window = op.attrs["window"]
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"FastWindowedStddev<{elem_type}, {simd_lanes}, {window}>", f"moments_{idx}", idx)))
+            scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = moments_{idx}.step({buf_name}, v{inp[0]}, i);"))
+        elif isinstance(op, (FastWindowedCovariance, FastWindowedCorrelation)):
+            assert(op.get_parent() is None)
+            buf_name = _get_buffer_name(op.inputs[0], inp[0])
+            buf_name2 = _get_buffer_name(op.inputs[1], inp[1])
+            window = op.attrs["window"]
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"{op.__class__.__name__}<{elem_type}, {simd_lanes}, {window}>", f"moments_{idx}", idx)))
+            scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = moments_{idx}.step({buf_name}, {buf_name2}, v{inp[0]}, v{inp[1]}, i);"))
         elif isinstance(op, WindowedLinearRegression):
-            if stream_mode: raise RuntimeError(f"Stream Mode does not support {op.__class__.__name__}")
             assert(op.get_parent() is None)
             buf_name = _get_buffer_name(op.inputs[0], inp[0])
             window = op.attrs["window"]
-            toplevel.scope.insert(-1, _CppSingleLine(toplevel, f"WindowedLinearRegression<{elem_type}, {simd_lanes}, {window}> linear_{idx};"))
+            toplevel.scope.insert(-1, _CppSingleLine(toplevel, declare_state(f"WindowedLinearRegression<{elem_type}, {simd_lanes}, {window}>", f"linear_{idx}", idx)))
             scope.scope.append(_CppSingleLine(scope, f"const auto& v{idx} = linear_{idx}.step({buf_name}, v{inp[0]}, i);"))
         elif isinstance(op, Select):
             scope.scope.append(_CppSingleLine(scope, f"auto v{idx} = Select(v{inp[0]}, v{inp[1]}, v{inp[2]});"))
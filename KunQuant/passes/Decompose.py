@@ -41,12 +41,12 @@ def decompose_rank_impl(ops: List[OpBase]) -> List[OpBase]:
     for op in ops:
         op.replace_inputs(replace_map)
         if isinstance(op, CrossSectionalOp):
-            inp = op.inputs[0]
-            if not isinstance(inp, Input):
-                changed = True
-                newin = Output(inp, inp.hash_hex())
-                op.inputs[0] = newin
-                out.append(newin)
+            for idx, inp in enumerate(op.inputs):
+                if not isinstance(inp, Input):
+                    changed = True
+                    newin = Output(inp, inp.hash_hex())
+                    op.inputs[idx] = newin
+                    out.append(newin)
             out.append(op)
         else:
             out.append(op)
@@ -1,4 +1,5 @@
-from KunQuant.Op import OpBase, Output, WindowedTrait, Input
+from KunQuant.Op import OpBase, Output, WindowedTrait, Input, GloablStatefulOpTrait
+from KunQuant.ops.MiscOp import FastWindowedMinMaxBase
 from KunQuant.Stage import Function
 from typing import Dict, List
 from .Util import kun_pass
@@ -22,6 +23,16 @@ def infer_window(f: Function, options: dict = {}) -> Dict[str, int]:
             ret[op.attrs["name"]] = _impl(op, result)
     return ret
 
+def has_unbounded_window(f: Function) -> bool:
+    '''
+    If any op of the function depends on the whole history of the inputs, i.e. it has a state carried between the
+    time steps without a bounded window, like ExpMovingAvg
+    '''
+    for op in f.ops:
+        if isinstance(op, GloablStatefulOpTrait) and not isinstance(op, (WindowedTrait, FastWindowedMinMaxBase)):
+            return True
+    return False
+
 def infer_input_window(f: Function, result: Dict[str, int]) -> None:
     for op in f.ops:
         if isinstance(op, Input) or isinstance(op, Output):
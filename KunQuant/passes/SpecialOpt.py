@@ -1,6 +1,6 @@
 from KunQuant.ops import *
 from KunQuant.passes.Util import kun_pass
-from KunQuant.Op import Builder, OpBase, ForeachBackWindow, Rank, WindowedTempOutput, Output, IterValue, ConstantOp, Scale
+from KunQuant.Op import Builder, OpBase, ForeachBackWindow, Rank, WindowedTempOutput, Output, IterValue, ConstantOp, Scale, Demean, GroupRank
 from KunQuant.Stage import Function
 from typing import List, Dict, Tuple
 from dataclasses import dataclass
@@ -23,7 +23,7 @@ class _ValueRangeManager:
     def _infer_range(self, op: OpBase) -> _ValueRange:
         if op in self.values:
             return self.values[op]
-        if isinstance(op, Rank):
+        if isinstance(op, (Rank, GroupRank)):
             return _ValueRange(0.0, 1.0, True, True)
         if isinstance(op, TsRank):
             return _ValueRange(0.0, op.attrs["window"]-1, True, True)
@@ -57,6 +57,87 @@ def _is_ok_for_reduce_opt(op: OpBase, enabled: bool) -> Tuple[OpBase, int]:
     window = loop.attrs["window"]
     return window_data, window
 
+_fast_minmax_ops = {
+    ReduceMin: FastWindowedMin,
+    ReduceMax: FastWindowedMax,
+    ReduceArgMin: FastWindowedArgMin,
+    ReduceArgMax: FastWindowedArgMax,
+}
+# the deque visits the lanes one by one, which is slower than the SIMD reduction of the small windows
+_fast_minmax_min_window = 64
+# the sorted window is faster than the SIMD counting of the rank for the very large windows only
+_fast_rank_min_window = 256
+
+def _is_ok_for_minmax_opt(op: OpBase, enabled: bool) -> OpBase:
+    '''
+    if the op is the min/max/argmin/argmax reduction of a window in non-loop context, returns the op with the
+    monotonic deque, which does not need the window of the input
+    '''
+    if not enabled:
+        return None
+    fast_op = _fast_minmax_ops.get(op.__class__, None)
+    if fast_op is None or op.get_parent() is not None or len(op.inputs) != 1:
+        return None
+    itr = op.inputs[0]
+    if not isinstance(itr, IterValue):
+        return None
+    loop = itr.inputs[0]
+    window_data = itr.inputs[1]
+    if not isinstance(loop, ForeachBackWindow) or loop.attrs["window"] < _fast_minmax_min_window:
+        return None
+    if isinstance(window_data, WindowedTempOutput):
+        window_data = window_data.inputs[0]
+    return fast_op(window_data, loop.attrs["window"])
+
+def _is_ok_for_sorted_window_opt(op: OpBase, enabled: bool) -> OpBase:
+    '''
+    if the op is the rank of the current data in a window or the quantile of a window in non-loop context, returns the
+    op keeping the sorted window, which updates the sorted values incrementally instead of visiting the whole window
+    '''
+    if not enabled or op.get_parent() is not None:
+        return None
+    if isinstance(op, WindowedQuantile):
+        return FastWindowedQuantile(op.inputs[0], op.attrs["window"], op.attrs["q"])
+    if not isinstance(op, ReduceRank):
+        return None
+    itr = op.inputs[0]
+    if not isinstance(itr, IterValue):
+        return None
+    loop = itr.inputs[0]
+    window_data = itr.inputs[1]
+    if not isinstance(loop, ForeachBackWindow):
+        return None
+    window = loop.attrs["window"]
+    if window < _fast_rank_min_window:
+        return None
+    if isinstance(window_data, WindowedTempOutput):
+        if window_data.inputs[0] is not op.inputs[1]:
+            return None
+        # FastWindowedRank needs an additional window size to remove the oldest data
+        if window_data.attrs["window"] < window + 1:
+            window_data.attrs["window"] = window + 1
+    elif window_data is not op.inputs[1]:
+        return None
+    return FastWindowedRank(window_data, window)
+
+_fast_moments_ops = {
+    WindowedStddev: FastWindowedStddev,
+    WindowedCovariance: FastWindowedCovariance,
+    WindowedCorrelation: FastWindowedCorrelation,
+}
+
+def _is_ok_for_moments_opt(op: OpBase, enabled: bool) -> OpBase:
+    '''
+    if the op is the stddev/covariance/correlation of a window in non-loop context, returns the op with the running
+    moments, which does not need the two passes over the window
+    '''
+    if not enabled or op.get_parent() is not None:
+        return None
+    fast_op = _fast_moments_ops.get(op.__class__, None)
+    if fast_op is None:
+        return None
+    return fast_op(op.inputs[0], op.attrs["window"], *op.inputs[1:])
+
 def _is_abs_positive(ranges: _ValueRangeManager, op: OpBase) -> OpBase:
     '''
     if the op matches abs(X), where X>=0
@@ -122,7 +203,7 @@ def _is_div_cmp_1(ranges: _ValueRangeManager, op: OpBase) -> OpBase:
                 return op.__class__(lhs * inner_rhs, inner_lhs)
     return None
 
-_monotonic_ops = {Sqrt, Log, Scale, Rank}
+_monotonic_ops = {Sqrt, Log, Scale, Rank, Demean}
 _monotonic_add = {AddConst, MulConst}
 _monotonic_sub = {SubConst, DivConst}
 def _is_rank_monotonic_inc(ranges: _ValueRangeManager, op: OpBase) -> OpBase:
@@ -197,6 +278,16 @@ def special_impl(ops: List[OpBase], options: dict = {}) -> List[OpBase]:
         if _transform(_is_abs_positive, op):
             continue
         
+        newop = _is_ok_for_minmax_opt(op, options.get("opt_reduce", True))
+        if newop is None:
+            newop = _is_ok_for_sorted_window_opt(op, options.get("opt_reduce", True))
+        if newop is None:
+            newop = _is_ok_for_moments_opt(op, options.get("opt_reduce", True))
+        if newop is not None:
+            out.append(newop)
+            changed = True
+            replace_map[op] = newop
+            continue
         # if it is reduce-sum in non-loop context
         result = _is_ok_for_reduce_opt(op, options.get("opt_reduce", True))
         if result is None:
@@ -227,6 +318,9 @@ def special_optimize(f: Function, options: dict = {}):
     =======================
     Into
     x3 = FastWindowedSum(y)
+    Similarly, ReduceMin/ReduceMax/ReduceArgMin/ReduceArgMax in the loop of a large window => FastWindowedMin/Max/ArgMin/ArgMax(y)
+    ReduceRank in the loop of a large window => FastWindowedRank(y), WindowedQuantile => FastWindowedQuantile
+    WindowedStddev/WindowedCovariance/WindowedCorrelation => FastWindowedStddev/Covariance/Correlation
 
     And Mul(-1) => Sub(0, X)
     Rank(T(x)) where T is monotonicly increasing => Rank(x)
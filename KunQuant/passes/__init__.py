@@ -3,7 +3,7 @@ from .ExprFold import expr_fold
 from .TempWindowElim import temp_window_elim
 from .SpecialOpt import special_optimize
 from .Partitioner import do_partition
-from .CodegenCpp import codegen_cpp
-from .InferWindow import infer_window
+from .CodegenCpp import codegen_cpp, get_cross_sectional_op
+from .InferWindow import infer_window, has_unbounded_window
 from .InferWindow import infer_input_window
 from .MergeLoops import merge_loops
\ No newline at end of file
@@ -4,7 +4,8 @@
 #ifdef __cplusplus
 namespace kun {
 struct Context;
-static constexpr size_t time_stride = 8;
+// the default number of time steps in a task of a cross-sectional stage
+static constexpr size_t default_time_stride = 8;
 } // namespace kun
 #endif
 
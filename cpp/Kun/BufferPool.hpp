@@ -0,0 +1,51 @@
+#pragma once
+
+#include "Base.hpp"
+#include <mutex>
+#include <stddef.h>
+#include <unordered_map>
+#include <vector>
+
+namespace kun {
+
+struct BufferPoolStats {
+    // the max total size of the blocks in use
+    size_t peak_bytes;
+    // the total size of the blocks in use
+    size_t in_use_bytes;
+    // the total size of the free blocks kept in the pool
+    size_t cached_bytes;
+    // the number of allocations served by the free blocks in the pool
+    size_t reuse_hits;
+    // the number of allocations from the system allocator
+    size_t allocations;
+};
+
+// The pool of 64-byte aligned memory blocks for the temp buffers. The sizes
+// are rounded up to size classes (4 classes between two powers of 2). A freed
+// block is kept in the pool and is reused by the next allocation of the same
+// size class, across the stages and across the runs. The pool is thread-safe.
+struct KUN_API BufferPool {
+    void *alloc(size_t size);
+    // return the block allocated by alloc() to the pool
+    void dealloc(void *ptr);
+    // release all free blocks to the system
+    void trim();
+    BufferPoolStats getStats();
+    static size_t roundSize(size_t size);
+
+    BufferPool() = default;
+    BufferPool(const BufferPool &) = delete;
+    BufferPool &operator=(const BufferPool &) = delete;
+    ~BufferPool();
+
+  private:
+    std::mutex lock;
+    // rounded size => free blocks
+    std::unordered_map<size_t, std::vector<void *>> free_blocks;
+    // block => rounded size of the blocks in use
+    std::unordered_map<void *, size_t> in_use;
+    BufferPoolStats stats{};
+};
+
+} // namespace kun
@@ -1,6 +1,7 @@
 #include "CApi.h"
 #include "Module.hpp"
 #include "RunGraph.hpp"
+#include <stdexcept>
 #include <string>
 #include <unordered_map>
 
@@ -16,6 +17,41 @@ KUN_API KunExecutorHandle kunCreateMultiThreadExecutor(int numthreads) {
         kun::createMultiThreadExecutor(numthreads)};
 }
 
+KUN_API KunExecutorHandle kunCreateWorkStealingExecutor(int numthreads) {
+    return new std::shared_ptr<Executor>{
+        kun::createWorkStealingExecutor(numthreads)};
+}
+
+KUN_API KunExecutorHandle kunCreateMultiThreadExecutorWithOptions(
+    int numthreads, int work_stealing, int caller_participates) {
+    if (work_stealing) {
+        return new std::shared_ptr<Executor>{kun::createWorkStealingExecutor(
+            numthreads, caller_participates != 0)};
+    }
+    return new std::shared_ptr<Executor>{
+        kun::createMultiThreadExecutor(numthreads, caller_participates != 0)};
+}
+
+KUN_API KunExecutorHandle kunCreateMultiThreadExecutorWithAffinity(
+    int numthreads, int work_stealing, int caller_participates, const int *cpus,
+    size_t num_cpus, const int *numa_nodes, size_t num_numa_nodes) {
+    ThreadAffinity affinity;
+    if (num_numa_nodes) {
+        affinity = ThreadAffinity::fromNumaNodes(
+            std::vector<int>(numa_nodes, numa_nodes + num_numa_nodes),
+            numthreads);
+    } else if (num_cpus) {
+        affinity =
+            ThreadAffinity::fromCpus(std::vector<int>(cpus, cpus + num_cpus));
+    }
+    if (work_stealing) {
+        return new std::shared_ptr<Executor>{kun::createWorkStealingExecutor(
+            numthreads, caller_participates != 0, affinity)};
+    }
+    return new std::shared_ptr<Executor>{kun::createMultiThreadExecutor(
+        numthreads, caller_participates != 0, affinity)};
+}
+
 static std::shared_ptr<Executor> *unwrapExecutor(KunExecutorHandle ptr) {
     return reinterpret_cast<std::shared_ptr<Executor> *>(ptr);
 }
@@ -24,6 +60,39 @@ KUN_API void kunDestoryExecutor(KunExecutorHandle ptr) {
     delete unwrapExecutor(ptr);
 }
 
+KUN_API void kunGetBufferPoolStats(KunExecutorHandle ptr, size_t *peak_bytes,
+                                   size_t *cached_bytes, size_t *reuse_hits) {
+    auto &pool = (*unwrapExecutor(ptr))->buffer_pool;
+    BufferPoolStats stats{};
+    if (pool) {
+        stats = pool->getStats();
+    }
+    if (peak_bytes) {
+        *peak_bytes = stats.peak_bytes;
+    }
+    if (cached_bytes) {
+        *cached_bytes = stats.cached_bytes;
+    }
+    if (reuse_hits) {
+        *reuse_hits = stats.reuse_hits;
+    }
+}
+
+KUN_API void kunTrimBufferPool(KunExecutorHandle ptr) {
+    auto &pool = (*unwrapExecutor(ptr))->buffer_pool;
+    if (pool) {
+        pool->trim();
+    }
+}
+
+KUN_API void kunSetCrossSectionalOptions(KunExecutorHandle ptr,
+                                         size_t time_stride,
+                                         size_t parallel_min_stocks) {
+    auto &exec = *unwrapExecutor(ptr);
+    exec->time_stride = time_stride ? time_stride : kun::default_time_stride;
+    exec->parallel_cs_min_stocks = parallel_min_stocks;
+}
+
 KUN_API KunLibraryHandle kunLoadLibrary(const char *path_or_name) {
     return new std::shared_ptr<Library>{Library::load(path_or_name)};
 }
@@ -76,6 +145,18 @@ KUN_API void kunRunGraph(KunExecutorHandle exec, KunModuleHandle m,
     runGraph(pexec, modu, *map, num_stocks, total_time, cur_time, length);
 }
 
+KUN_API void kunRunGraphChunked(KunExecutorHandle exec, KunModuleHandle m,
+                                KunBufferNameMapHandle buffers,
+                                size_t num_stocks, size_t total_time,
+                                size_t cur_time, size_t length,
+                                size_t chunk_size) {
+    auto &pexec = *unwrapExecutor(exec);
+    auto modu = reinterpret_cast<Module *>(m);
+    auto map = unwrapMap(buffers);
+    runGraphChunked(pexec, modu, *map, num_stocks, total_time, cur_time, length,
+                    chunk_size);
+}
+
 KUN_API KunStreamContextHandle kunCreateStream(KunExecutorHandle exec,
                                                KunModuleHandle m,
                                                size_t num_stocks) {
@@ -101,11 +182,81 @@ KUN_API void kunStreamPushData(KunStreamContextHandle context, size_t handle,
     reinterpret_cast<kun::StreamContext *>(context)->pushData(handle, buffer);
 }
 
+KUN_API float *kunStreamGetNextBuffer(KunStreamContextHandle context,
+                                      size_t handle) {
+    return reinterpret_cast<kun::StreamContext *>(context)->getNextBufferPtr(
+        handle);
+}
+
+KUN_API void kunStreamCommitData(KunStreamContextHandle context,
+                                 size_t handle) {
+    reinterpret_cast<kun::StreamContext *>(context)->commitData(handle);
+}
+
 KUN_API void kunStreamRun(KunStreamContextHandle context) {
     reinterpret_cast<kun::StreamContext *>(context)->run();
 }
 
+KUN_API void kunStreamRunTicks(KunStreamContextHandle context,
+                               KunBufferNameMapHandle buffers,
+                               size_t num_ticks) {
+    reinterpret_cast<kun::StreamContext *>(context)->runTicks(
+        *unwrapMap(buffers), num_ticks);
+}
+
+KUN_API int kunStreamSaveState(KunStreamContextHandle context,
+                               const char *path) {
+    try {
+        reinterpret_cast<kun::StreamContext *>(context)->saveState(path);
+    } catch (const std::exception &) {
+        return 1;
+    }
+    return 0;
+}
+
+KUN_API int kunStreamLoadState(KunStreamContextHandle context,
+                               const char *path) {
+    try {
+        reinterpret_cast<kun::StreamContext *>(context)->loadState(path);
+    } catch (const std::exception &) {
+        return 1;
+    }
+    return 0;
+}
+
 KUN_API void kunDestoryStream(KunStreamContextHandle context) {
     delete reinterpret_cast<kun::StreamContext *>(context);
 }
-}
\ No newline at end of file
+
+KUN_API KunPlanHandle kunCreatePlan(KunExecutorHandle exec, KunModuleHandle m,
+                                    KunBufferNameMapHandle buffers,
+                                    size_t num_stocks, size_t total_time,
+                                    size_t cur_time, size_t length) {
+    auto &pexec = *unwrapExecutor(exec);
+    auto modu = reinterpret_cast<Module *>(m);
+    auto map = unwrapMap(buffers);
+    return new kun::Plan{pexec,      modu,     *map,  num_stocks,
+                         total_time, cur_time, length};
+}
+
+KUN_API size_t kunPlanQueryBufferHandle(KunPlanHandle plan, const char *name) {
+    return reinterpret_cast<kun::Plan *>(plan)->queryBufferHandle(name);
+}
+
+KUN_API void kunPlanSetBuffer(KunPlanHandle plan, size_t handle,
+                              float *buffer) {
+    reinterpret_cast<kun::Plan *>(plan)->setBuffer(handle, buffer);
+}
+
+KUN_API void kunPlanSetStart(KunPlanHandle plan, size_t cur_time) {
+    reinterpret_cast<kun::Plan *>(plan)->setStart(cur_time);
+}
+
+KUN_API void kunPlanRun(KunPlanHandle plan) {
+    reinterpret_cast<kun::Plan *>(plan)->run();
+}
+
+KUN_API void kunDestoryPlan(KunPlanHandle plan) {
+    delete reinterpret_cast<kun::Plan *>(plan);
+}
+}
@@ -7,6 +7,7 @@ typedef void *KunLibraryHandle;
 typedef void *KunModuleHandle;
 typedef void *KunBufferNameMapHandle;
 typedef void *KunStreamContextHandle;
+typedef void *KunPlanHandle;
 
 #ifdef __cplusplus
 extern "C" {
@@ -29,6 +30,53 @@ KUN_API KunExecutorHandle kunCreateSingleThreadExecutor();
  */
 KUN_API KunExecutorHandle kunCreateMultiThreadExecutor(int numthreads);
 
+/**
+ * @brief Create an multi-thread executor with a work-stealing stage queue for
+ * each thread. It has less lock contention than kunCreateMultiThreadExecutor
+ * on large graphs and many threads
+ * @param numthreads the number of threads in the thread pool
+ *
+ * @return KunExecutorHandle It needs to be manually released by
+ * kunDestoryExecutor
+ */
+KUN_API KunExecutorHandle kunCreateWorkStealingExecutor(int numthreads);
+
+/**
+ * @brief Create an multi-thread executor with options
+ * @param numthreads the number of threads in the thread pool
+ * @param work_stealing non-zero to create the executor of
+ * kunCreateWorkStealingExecutor. Otherwise, create the executor of
+ * kunCreateMultiThreadExecutor
+ * @param caller_participates non-zero to let the thread calling kunRunGraph or
+ * kunStreamRun execute the tasks together with the thread pool. Otherwise, the
+ * calling thread only waits for the thread pool
+ *
+ * @return KunExecutorHandle It needs to be manually released by
+ * kunDestoryExecutor
+ */
+KUN_API KunExecutorHandle kunCreateMultiThreadExecutorWithOptions(
+    int numthreads, int work_stealing, int caller_participates);
+
+/**
+ * @brief Create an multi-thread executor with the threads pinned to CPUs or
+ * NUMA nodes. The other parameters are the same as
+ * kunCreateMultiThreadExecutorWithOptions
+ * @param cpus the CPU ids. The i-th thread is pinned to cpus[i % num_cpus].
+ * Ignored if numa_nodes is given
+ * @param num_cpus the length of cpus. 0 for not pinning by CPU ids
+ * @param numa_nodes the NUMA node ids. The threads are evenly distributed
+ * among the nodes and each of them is pinned to the CPUs of its node. The
+ * stock-sliced tasks and the temp buffers are placed on the node processing
+ * them
+ * @param num_numa_nodes the length of numa_nodes. 0 for not pinning by nodes
+ *
+ * @return KunExecutorHandle It needs to be manually released by
+ * kunDestoryExecutor
+ */
+KUN_API KunExecutorHandle kunCreateMultiThreadExecutorWithAffinity(
+    int numthreads, int work_stealing, int caller_participates, const int *cpus,
+    size_t num_cpus, const int *numa_nodes, size_t num_numa_nodes);
+
 /**
  * @brief Release the executor
  *
@@ -37,6 +85,44 @@ KUN_API KunExecutorHandle kunCreateMultiThreadExecutor(int numthreads);
  */
 KUN_API void kunDestoryExecutor(KunExecutorHandle ptr);
 
+/**
+ * @brief Get the statistics of the pool of the temp buffers of the executor.
+ * The temp buffers are recycled across the stages and the runs
+ *
+ * @param ptr the executor
+ * @param peak_bytes the max total size of the temp buffers in use. Can be null
+ * @param cached_bytes the total size of the free blocks kept in the pool. Can
+ * be null
+ * @param reuse_hits the number of allocations served by the free blocks in the
+ * pool. Can be null
+ */
+KUN_API void kunGetBufferPoolStats(KunExecutorHandle ptr, size_t *peak_bytes,
+                                   size_t *cached_bytes, size_t *reuse_hits);
+
+/**
+ * @brief Release the free blocks in the pool of the temp buffers of the
+ * executor to the system
+ *
+ * @param ptr the executor
+ */
+KUN_API void kunTrimBufferPool(KunExecutorHandle ptr);
+
+/**
+ * @brief Set the options of the cross-sectional stages (e.g. Rank) run by the
+ * executor
+ *
+ * @param ptr the executor
+ * @param time_stride the number of time steps in a task. Should be positive.
+ * The default value is 8
+ * @param parallel_min_stocks if a stage has fewer tasks of time steps than the
+ * threads, the stocks are also split into parts of at least
+ * parallel_min_stocks stocks, for the threads to work on the same time step. 0
+ * for never splitting the stocks. The default value is 2048
+ */
+KUN_API void kunSetCrossSectionalOptions(KunExecutorHandle ptr,
+                                         size_t time_stride,
+                                         size_t parallel_min_stocks);
+
 /**
  * @brief Load the payload library compiled by KunQuant
  *
@@ -116,6 +202,24 @@ KUN_API void kunEraseBufferNameMap(KunBufferNameMapHandle ptr,
 KUN_API void kunRunGraph(KunExecutorHandle exec, KunModuleHandle m,
                          KunBufferNameMapHandle buffers, size_t num_stocks,
                          size_t total_time, size_t cur_time, size_t length);
+
+/**
+ * @brief Run the graph in batch mode like kunRunGraph, but walk the time range
+ * in chunks of chunk_size time steps. The temp buffers only hold O(chunk_size)
+ * time steps, to bound the memory for long histories. Each chunk is started
+ * earlier by the max unreliable count of the outputs to refill the windows of
+ * the windowed ops, so that the results equal those of kunRunGraph up to
+ * rounding. The modules with ops depending on the whole history like
+ * ExpMovingAvg cannot be run in chunks
+ *
+ * @param chunk_size the number of time steps in a chunk. 0 to run the whole
+ * range at once. The other parameters are the same as kunRunGraph
+ */
+KUN_API void kunRunGraphChunked(KunExecutorHandle exec, KunModuleHandle m,
+                                KunBufferNameMapHandle buffers,
+                                size_t num_stocks, size_t total_time,
+                                size_t cur_time, size_t length,
+                                size_t chunk_size);
 /**
  * @brief Create the Stream computing context.
  *
@@ -146,8 +250,9 @@ KUN_API size_t kunQueryBufferHandle(KunStreamContextHandle context,
  * @param context the stream context
  * @param handle the named buffer handle. @see kunQueryBufferHandle
  * @return the pointer to the named buffer. The length the buffer
- * should be `num_stocks` elements of floats. Note that the pointer is valid
- * before calling kunStreamPushData or kunStreamRun
+ * should be `num_stocks` elements of floats, or doubles if the dtype of the
+ * module is double. Note that the pointer is valid before calling
+ * kunStreamPushData or kunStreamRun
  */
 KUN_API const float *kunStreamGetCurrentBuffer(KunStreamContextHandle context,
                                                size_t handle);
@@ -159,11 +264,36 @@ KUN_API const float *kunStreamGetCurrentBuffer(KunStreamContextHandle context,
  * @param context the stream context
  * @param handle the named buffer handle. @see kunQueryBufferHandle
  * @param buffer the named buffer handle. The length the buffer should be
- * `num_stocks` elements of floats.
+ * `num_stocks` elements of floats, or doubles if the dtype of the module is
+ * double.
  */
 KUN_API void kunStreamPushData(KunStreamContextHandle context, size_t handle,
                                const float *buffer);
 
+/**
+ * @brief Get the memory address of the slot for the next data of a named
+ * buffer, to write the data in place instead of copying it by
+ * kunStreamPushData. After the data is written, call kunStreamCommitData to
+ * push it
+ * @param context the stream context
+ * @param handle the named buffer handle. @see kunQueryBufferHandle
+ * @return the pointer to the slot. The length the buffer should be
+ * `num_stocks` elements of floats, or doubles if the dtype of the module is
+ * double. Note that the pointer is valid before calling kunStreamPushData,
+ * kunStreamCommitData or kunStreamRun
+ */
+KUN_API float *kunStreamGetNextBuffer(KunStreamContextHandle context,
+                                      size_t handle);
+
+/**
+ * @brief Push the data written in the slot returned by kunStreamGetNextBuffer.
+ * It replaces the call of kunStreamPushData on the named buffer before calling
+ * kunStreamRun
+ * @param context the stream context
+ * @param handle the named buffer handle. @see kunQueryBufferHandle
+ */
+KUN_API void kunStreamCommitData(KunStreamContextHandle context, size_t handle);
+
 /**
  * @brief Let the stream compute on the pushed data. All input data should be
  * updated via `kunStreamPushData` before calling this function. After this
@@ -172,12 +302,102 @@ KUN_API void kunStreamPushData(KunStreamContextHandle context, size_t handle,
  */
 KUN_API void kunStreamRun(KunStreamContextHandle context);
 
+/**
+ * @brief Run multiple ticks of the stream one after another in one call,
+ * instead of calling kunStreamPushData, kunStreamRun and
+ * kunStreamGetCurrentBuffer for each tick, e.g. to catch up after a reconnect
+ * or to replay a day. Each tick is still a separate run of the stages on the
+ * executor. Only the per-tick calls of the caller are saved
+ * @param context the stream context
+ * @param buffers the map of all input names to the buffers of
+ * `num_ticks * num_stocks` elements to push, and the output names to the
+ * buffers of `num_ticks * num_stocks` elements to fill. The elements are
+ * doubles if the dtype of the module is double. The outputs not in the map are
+ * skipped
+ * @param num_ticks the number of ticks to run
+ */
+KUN_API void kunStreamRunTicks(KunStreamContextHandle context,
+                               KunBufferNameMapHandle buffers,
+                               size_t num_ticks);
+
+/**
+ * @brief Save the state of the stream, i.e. the windows of all buffers, to a
+ * binary file, to restart the stream later without replaying the history
+ * @param context the stream context
+ * @param path the path of the file
+ * @return 0 on success. Non-zero if the file cannot be written
+ */
+KUN_API int kunStreamSaveState(KunStreamContextHandle context,
+                               const char *path);
+
+/**
+ * @brief Load the state saved by kunStreamSaveState. The stream should be
+ * created with the same module and the same number of stocks as the saved one
+ * @param context the stream context
+ * @param path the path of the file
+ * @return 0 on success. Non-zero if the file cannot be read or does not match
+ * the stream. The state of the stream is unchanged on failure
+ */
+KUN_API int kunStreamLoadState(KunStreamContextHandle context,
+                               const char *path);
+
 /**
  * @brief Release the stream
  * @param context the stream context
  */
 KUN_API void kunDestoryStream(KunStreamContextHandle context);
 
+/**
+ * @brief Create a prepared execution plan of the batch mode computation graph,
+ * to run the same module many times with the same shapes at a low cost. The
+ * parameters are the same as kunRunGraph. The buffer pointers in the map are
+ * bound to the plan. The temp buffers are allocated once and kept until the
+ * plan is released
+ *
+ * @return KunPlanHandle It needs to be released by kunDestoryPlan
+ */
+KUN_API KunPlanHandle kunCreatePlan(KunExecutorHandle exec, KunModuleHandle m,
+                                    KunBufferNameMapHandle buffers,
+                                    size_t num_stocks, size_t total_time,
+                                    size_t cur_time, size_t length);
+
+/**
+ * @brief Query the handle of a named input/output buffer of the plan
+ * @param plan the plan
+ * @param name the name of the input/output buffer
+ * @return the handle to the buffer, to be used in kunPlanSetBuffer
+ */
+KUN_API size_t kunPlanQueryBufferHandle(KunPlanHandle plan, const char *name);
+
+/**
+ * @brief Bind another memory buffer of the same size to a named buffer for the
+ * next runs
+ * @param plan the plan
+ * @param handle the named buffer handle. @see kunPlanQueryBufferHandle
+ * @param buffer the memory buffer
+ */
+KUN_API void kunPlanSetBuffer(KunPlanHandle plan, size_t handle, float *buffer);
+
+/**
+ * @brief Set the start time (cur_time of kunCreatePlan) of the next runs. The
+ * length is unchanged. cur_time + length should not be greater than total_time
+ * @param plan the plan
+ * @param cur_time the start time
+ */
+KUN_API void kunPlanSetStart(KunPlanHandle plan, size_t cur_time);
+
+/**
+ * @brief Execute the computation graph with the bound buffers
+ * @param plan the plan
+ */
+KUN_API void kunPlanRun(KunPlanHandle plan);
+
+/**
+ * @brief Release the plan
+ * @param plan the plan
+ */
+KUN_API void kunDestoryPlan(KunPlanHandle plan);
+
 #ifdef __cplusplus
 }
 #endif
\ No newline at end of file
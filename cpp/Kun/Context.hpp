@@ -1,11 +1,13 @@
 #pragma once
 
+#include "BufferPool.hpp"
 #include "Stage.hpp"
 #include "StreamBuffer.hpp"
 #include <atomic>
 #include <memory>
 #include <stdlib.h>
 #include <stddef.h>
+#include <vector>
 
 namespace kun {
 
@@ -17,6 +19,30 @@ struct KUN_API RuntimeStage {
     std::atomic<size_t> doing_index;
     std::atomic<size_t> done_count;
 
+    // The tasks of a SLICE_BY_STOCK stage are divided into num_slices
+    // contiguous slices, one for each NUMA node of the executor. slice_index[i]
+    // is the next task to claim in the i-th slice
+    static constexpr size_t max_slices = 8;
+    std::atomic<size_t> slice_index[max_slices];
+    size_t num_slices;
+
+    // the number of time steps in a task of a SLICE_BY_TIME stage
+    size_t time_stride;
+    // A SLICE_BY_TIME stage of a short run may be also split into num_parts
+    // contiguous parts of stocks, see Stage::split_stocks and
+    // Executor::parallel_cs_min_stocks. The task index is time_idx * num_parts
+    // + part. Such a stage runs in two phases. The next phase starts after all
+    // tasks of the previous phase are done. The tasks of both phases share the
+    // scratch memory of scratch_per_stock bytes for each stock and time step,
+    // which also holds scratch_per_part bytes for each part and time step
+    size_t num_parts;
+    size_t num_phases;
+    size_t phase;
+    static constexpr size_t max_parts = 64;
+    static constexpr size_t scratch_per_stock = 16;
+    static constexpr size_t scratch_per_part = 64;
+    std::vector<char> scratch;
+
     RuntimeStage(Stage *stage, Context *ctx) : stage{stage}, ctx{ctx} {
         reset(ctx);
     }
@@ -27,9 +53,21 @@ struct KUN_API RuntimeStage {
         pending = other.pending.load(std::memory_order_relaxed);
         doing_index = other.doing_index.load(std::memory_order_relaxed);
         done_count = other.done_count.load(std::memory_order_relaxed);
+        num_slices = other.num_slices;
+        for (size_t i = 0; i < num_slices; i++) {
+            slice_index[i] =
+                other.slice_index[i].load(std::memory_order_relaxed);
+        }
+        time_stride = other.time_stride;
+        num_parts = other.num_parts;
+        num_phases = other.num_phases;
+        phase = other.phase;
+        scratch = std::move(other.scratch);
     }
 
-    bool doJob();
+    // claim and run the tasks of the stage. slice_hint is the preferred
+    // slice, i.e. the NUMA node index of the calling thread
+    bool doJob(size_t slice_hint = 0);
 
     bool hasJobToDo() const {
         auto cur_idx = doing_index.load();
@@ -38,15 +76,19 @@ struct KUN_API RuntimeStage {
     }
     size_t getNumTasks() const;
 
-    void reset(Context *ctx) {
-        pending = stage->orig_pending;
-        doing_index = 0;
-        done_count = getNumTasks();
-    }
+    void reset(Context *ctx);
 
     void enqueue();
     // returns true if there may be more tasks in the job
     bool onDone(size_t cnt);
+
+  private:
+    void runTask(size_t idx);
+    // start the next phase after the tasks of the current phase are done
+    bool nextPhase();
+    size_t sliceEnd(size_t slice) const {
+        return (slice + 1) * getNumTasks() / num_slices;
+    }
 };
 
 struct KUN_API Executor {
@@ -54,6 +96,24 @@ struct KUN_API Executor {
     virtual void dequeue(RuntimeStage *stage) = 0;
     // virtual bool takeSingleJob() = 0;
     virtual void runUntilDone() = 0;
+    // the number of NUMA nodes that the stock-sliced tasks are divided for
+    virtual size_t numSlices() const { return 1; }
+    // the pool of the temp buffers of the graphs running on the executor.
+    // Null for allocating and freeing the temp buffers via the system
+    // allocator in each run
+    std::shared_ptr<BufferPool> buffer_pool = std::make_shared<BufferPool>();
+    // the number of time steps in a task of a cross-sectional stage. A larger
+    // stride has less scheduling overhead and a smaller one has more tasks for
+    // the threads
+    size_t time_stride = default_time_stride;
+    // If a cross-sectional stage (e.g. Rank) has fewer tasks of time steps
+    // than the threads, e.g. in streaming or in daily runs of a few time
+    // steps, the stocks are also split into parts of at least
+    // parallel_cs_min_stocks stocks, for the threads to work on the same time
+    // step. 0 for never splitting the stocks
+    size_t parallel_cs_min_stocks = 2048;
+    // the number of threads running the tasks
+    virtual size_t numThreads() const { return 1; }
     virtual ~Executor() = default;
 };
 
@@ -64,6 +124,7 @@ struct Buffer {
         float *__restrict ptr;
         double *__restrict ptrD;
         StreamBuffer<float> *stream_buf;
+        StreamBuffer<double> *stream_bufD;
     };
     
     template <typename T>
@@ -71,16 +132,21 @@ struct Buffer {
         return reinterpret_cast<T*>(raw);
     }
     size_t num_time; // the dimension in time
+    // the pool which the buffer is allocated from. Null for the system
+    // allocator
+    BufferPool *pool;
 #if CHECKED_PTR
     size_t size; // size in bytes
 #endif
     std::atomic<int> refcount;
 
-    KUN_API void alloc(size_t count, size_t use_count, size_t elem_size);
+    KUN_API void alloc(size_t count, size_t use_count, size_t elem_size,
+                       BufferPool *pool = nullptr);
 
     Buffer(size_t num_time) {
         ptr = nullptr;
         this->num_time = num_time;
+        pool = nullptr;
         refcount = 0;
     }
 
@@ -88,6 +154,7 @@ struct Buffer {
     Buffer(Buffer &&other) noexcept {
         ptr = other.ptr;
         num_time = other.num_time;
+        pool = other.pool;
         refcount = other.refcount.load();
         other.ptr = nullptr;
     }
@@ -95,6 +162,7 @@ struct Buffer {
     Buffer(float *inptr, size_t num_time) {
         ptr = inptr;
         this->num_time = num_time;
+        pool = nullptr;
         refcount = -1000;
     }
 
@@ -122,7 +190,38 @@ struct Context {
     bool is_stream;
 };
 
+// The placement of the worker threads of a multi-thread executor
+struct KUN_API ThreadAffinity {
+    // the allowed CPUs of each worker thread. The i-th thread uses
+    // cpus[i % cpus.size()]. Empty for not pinning the threads
+    std::vector<std::vector<int>> cpus;
+    // the NUMA node index in [0, num_nodes) of each worker thread, in the same
+    // way as cpus. If num_nodes > 1, the tasks of a SLICE_BY_STOCK stage are
+    // divided into num_nodes contiguous ranges of stocks and a thread first
+    // takes the tasks in the range of its node. The rows of a temp buffer are
+    // first written by the thread computing them, so the OS places the memory
+    // pages on that node by the first-touch policy
+    std::vector<int> nodes;
+    size_t num_nodes = 1;
+
+    // pin the i-th thread to the single CPU cpus[i % cpus.size()]
+    static ThreadAffinity fromCpus(const std::vector<int> &cpus);
+    // distribute the threads evenly among the NUMA nodes (the system node ids)
+    // and pin each thread to the CPUs of its node
+    static ThreadAffinity fromNumaNodes(const std::vector<int> &numa_nodes,
+                                        int num_threads);
+};
+
 KUN_API std::shared_ptr<Executor> createSingleThreadExecutor();
-KUN_API std::shared_ptr<Executor> createMultiThreadExecutor(int num_threads);
+// If caller_participates is true, the thread calling runUntilDone executes the
+// tasks with the worker threads. Otherwise, it only waits for the workers.
+// Either way, the waiting thread first spins for a short time and then blocks.
+// The caller thread is not pinned and takes the tasks as node 0
+KUN_API std::shared_ptr<Executor>
+createMultiThreadExecutor(int num_threads, bool caller_participates = true,
+                          const ThreadAffinity &affinity = ThreadAffinity{});
+KUN_API std::shared_ptr<Executor>
+createWorkStealingExecutor(int num_threads, bool caller_participates = true,
+                           const ThreadAffinity &affinity = ThreadAffinity{});
 
 } // namespace kun
\ No newline at end of file
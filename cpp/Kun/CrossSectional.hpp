@@ -0,0 +1,146 @@
+#pragma once
+
+#include <Kun/Context.hpp>
+#include <Kun/LayoutMappers.hpp>
+#include <Kun/Module.hpp>
+#include <Kun/Ops.hpp>
+#include <algorithm>
+#include <cmath>
+#include <string.h>
+
+namespace kun {
+namespace ops {
+
+// The stocks of a buffer at a time step, accessed by the stock indices or by
+// SIMD blocks of MAPPER::lanes stocks. The stocks of a block are contiguous in
+// all layouts. The lanes of the last partial block beyond the stocks are loaded
+// as NaN and are not stored
+template <typename MAPPER, typename PTR>
+struct CrossSectionalRow {
+    using Mapper = MAPPER;
+    using T = typename MAPPER::value_type;
+    using simd_t = kun_simd::vec<T, MAPPER::lanes>;
+    PTR buf;
+    size_t t;
+    size_t num_time;
+    size_t num_stocks;
+
+    auto operator[](size_t stock) const -> decltype(*buf) {
+        return buf[MAPPER::call(stock, t, num_time, num_stocks, MAPPER::lanes)];
+    }
+    PTR getBlock(size_t block) const {
+        return buf + MAPPER::call(block * MAPPER::lanes, t, num_time,
+                                  num_stocks, MAPPER::lanes);
+    }
+    simd_t load(size_t block) const {
+        auto rest = num_stocks - block * MAPPER::lanes;
+        if (rest >= MAPPER::lanes) {
+            return simd_t::load(getBlock(block));
+        }
+        auto mask = simd_t::make_mask(rest);
+        return kun_simd::sc_select(
+            mask, simd_t::masked_load(getBlock(block), mask), simd_t(NAN));
+    }
+    void store(size_t block, simd_t v) const {
+        auto rest = num_stocks - block * MAPPER::lanes;
+        if (rest >= MAPPER::lanes) {
+            simd_t::store(v, getBlock(block));
+            return;
+        }
+        simd_t::masked_store(v, getBlock(block), simd_t::make_mask(rest));
+    }
+};
+
+template <typename T, int lanes>
+INLINE T horizontalSum(kun_simd::vec<T, lanes> v) {
+    T ret = 0;
+    for (int i = 0; i < lanes; i++) {
+        ret += v.raw[i];
+    }
+    return ret;
+}
+
+// Runs a cross-sectional KERNEL on the time steps of a task. The KERNEL
+// provides:
+//  - Stats: the trivially copyable statistics of a range of stocks
+//  - Stats reduce(in, begin, end): the statistics of the blocks of stocks in
+//    [begin, end) of the input row
+//  - merge(Stats &a, const Stats &b): combines the statistics of the next
+//    range of stocks b into a
+//  - map(in, out, begin, end, stats): writes the output row of the blocks in
+//    [begin, end) with the statistics of all stocks
+// In the stock-parallel mode (see RuntimeStage::num_parts), each task reduces
+// its part of blocks into the scratch memory in phase 0. In phase 1, each task
+// merges the statistics of all parts in order and maps its part
+template <typename INPUT, typename OUTPUT, typename KERNEL>
+void crossSectionalStocks(RuntimeStage *stage, size_t task_idx,
+                          size_t __total_time, size_t __start, size_t __length,
+                          const KERNEL &kernel) {
+    using T = typename INPUT::value_type;
+    using Stats = typename KERNEL::Stats;
+    static_assert(sizeof(Stats) <= RuntimeStage::scratch_per_part,
+                  "The Stats of the kernel is too large");
+    auto num_stocks = stage->ctx->stock_count;
+    auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
+    auto in_num_time = inbuf.num_time;
+    auto in_base_time = (in_num_time == __total_time) ? 0 : __start;
+    const T *input =
+        INPUT::getInput(&inbuf, stage->stage->in_buffers[0], num_stocks);
+    auto outinfo = stage->stage->out_buffers[0];
+    auto &outbuf = stage->ctx->buffers[outinfo->id];
+    auto simd_len = stage->ctx->simd_len;
+    auto num_parts = stage->num_parts;
+    auto time_idx = task_idx / num_parts;
+    auto part = task_idx % num_parts;
+    auto time_stride = stage->time_stride;
+    auto time_end =
+        std::min(__start + (time_idx + 1) * time_stride, __start + __length);
+    auto num_blocks = (num_stocks + INPUT::lanes - 1) / INPUT::lanes;
+    auto block_start = part * num_blocks / num_parts;
+    auto block_end = (part + 1) * num_blocks / num_parts;
+    T *output;
+    if (num_parts == 1) {
+        output = OUTPUT::getOutput(&outbuf, outinfo, num_stocks, simd_len);
+    } else {
+        if (stage->phase == 0 && task_idx == 0) {
+            // push the output slot in stream mode once
+            OUTPUT::getOutput(&outbuf, outinfo, num_stocks, simd_len);
+        }
+        output = stage->phase == 0
+                     ? nullptr
+                     : OUTPUT::getWrittenOutput(&outbuf, outinfo, num_stocks);
+    }
+    for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
+        CrossSectionalRow<INPUT, const T *> in{input, t - in_base_time,
+                                               in_num_time, num_stocks};
+        CrossSectionalRow<OUTPUT, T *> out{output, t - __start, __length,
+                                           num_stocks};
+        if (num_parts == 1) {
+            kernel.map(in, out, 0, num_blocks,
+                       kernel.reduce(in, 0, num_blocks));
+            continue;
+        }
+        // the statistics of the parts at time t
+        char *part_stats =
+            stage->scratch.data() +
+            (t - __start) * num_parts * RuntimeStage::scratch_per_part;
+        if (stage->phase == 0) {
+            Stats stats = kernel.reduce(in, block_start, block_end);
+            memcpy(part_stats + part * RuntimeStage::scratch_per_part, &stats,
+                   sizeof(Stats));
+            continue;
+        }
+        Stats stats;
+        memcpy(&stats, part_stats, sizeof(Stats));
+        for (size_t p = 1; p < num_parts; p++) {
+            Stats next;
+            memcpy(&next, part_stats + p * RuntimeStage::scratch_per_part,
+                   sizeof(Stats));
+            kernel.merge(stats, next);
+        }
+        kernel.map(in, out, block_start, block_end, stats);
+    }
+}
+
+} // namespace ops
+} // namespace kun
@@ -5,15 +5,247 @@
 #include <assert.h>
 #include <condition_variable>
 #include <cstdio>
+#include <deque>
 #include <list>
 #include <mutex>
+#include <stdexcept>
+#include <string>
 #include <thread>
+#if defined(__x86_64__) || defined(_M_X64)
+#include <immintrin.h>
+#endif
+#ifdef _WIN32
+#ifndef NOMINMAX
+#define NOMINMAX
+#endif
+#ifndef WIN32_LEAN_AND_MEAN
+#define WIN32_LEAN_AND_MEAN
+#endif
+#include <Windows.h>
+#elif defined(__linux__)
+#include <pthread.h>
+#include <sched.h>
+#endif
 
 namespace kun {
 
+static inline void cpuRelax() {
+#if defined(__x86_64__) || defined(_M_X64)
+    _mm_pause();
+#else
+    std::this_thread::yield();
+#endif
+}
+
+// Blocks the thread calling runUntilDone until a condition is met. It first
+// spins for a bounded number of iterations, for low latency of small graphs
+// (e.g. a tick of streaming), and then waits on a condition variable, so that
+// it does not burn a core when the graph takes long.
+struct CompletionWaiter {
+    static constexpr int spin_count = 4096;
+    std::mutex lock;
+    std::condition_variable cv;
+    std::atomic<bool> waiting{false};
+
+    // should be called after the state checked by the condition is changed
+    void notify() {
+        if (waiting.load()) {
+            std::lock_guard<std::mutex> guard{lock};
+            cv.notify_all();
+        }
+    }
+
+    template <typename TPred>
+    void wait(TPred pred) {
+        for (int i = 0; i < spin_count; i++) {
+            if (pred()) {
+                return;
+            }
+            cpuRelax();
+        }
+        std::unique_lock<std::mutex> lk{lock};
+        waiting = true;
+        cv.wait(lk, pred);
+        waiting = false;
+    }
+};
+
+#ifdef __linux__
+// parse the CPU list format of Linux sysfs, e.g. "0-3,8-11"
+static std::vector<int> parseCpuList(const std::string &str) {
+    std::vector<int> ret;
+    size_t pos = 0;
+    while (pos < str.size()) {
+        auto end = str.find(',', pos);
+        if (end == std::string::npos) {
+            end = str.size();
+        }
+        auto item = str.substr(pos, end - pos);
+        auto dash = item.find('-');
+        if (!item.empty() && item[0] != '\n') {
+            int first = std::stoi(item.substr(0, dash));
+            int last = dash == std::string::npos
+                           ? first
+                           : std::stoi(item.substr(dash + 1));
+            for (int i = first; i <= last; i++) {
+                ret.push_back(i);
+            }
+        }
+        pos = end + 1;
+    }
+    return ret;
+}
+#endif
+
+static std::vector<int> getNumaNodeCpus(int node) {
+    std::vector<int> ret;
+#ifdef _WIN32
+    ULONGLONG mask = 0;
+    if (node >= 0 && GetNumaNodeProcessorMask((UCHAR)node, &mask)) {
+        for (int i = 0; i < 64; i++) {
+            if (mask & (1ULL << i)) {
+                ret.push_back(i);
+            }
+        }
+    }
+#elif defined(__linux__)
+    std::string path =
+        "/sys/devices/system/node/node" + std::to_string(node) + "/cpulist";
+    if (FILE *f = fopen(path.c_str(), "r")) {
+        char buf[4096];
+        auto len = fread(buf, 1, sizeof(buf) - 1, f);
+        fclose(f);
+        buf[len] = 0;
+        ret = parseCpuList(buf);
+    }
+#endif
+    if (ret.empty()) {
+        throw std::runtime_error("Cannot get the CPUs of NUMA node " +
+                                 std::to_string(node));
+    }
+    return ret;
+}
+
+static void checkCpuId(int cpu) {
+#ifdef _WIN32
+    int max_cpu = 64;
+#elif defined(__linux__)
+    int max_cpu = CPU_SETSIZE;
+#else
+    int max_cpu = 0;
+#endif
+    if (cpu < 0 || cpu >= max_cpu) {
+        throw std::runtime_error("Bad CPU id for thread affinity: " +
+                                 std::to_string(cpu));
+    }
+}
+
+// pin the current thread to the CPUs. Failures are ignored, since the
+// affinity only affects the performance
+static void pinCurrentThread(const std::vector<int> &cpus) {
+    if (cpus.empty()) {
+        return;
+    }
+#ifdef _WIN32
+    DWORD_PTR mask = 0;
+    for (int c : cpus) {
+        mask |= DWORD_PTR(1) << c;
+    }
+    SetThreadAffinityMask(GetCurrentThread(), mask);
+#elif defined(__linux__)
+    cpu_set_t set;
+    CPU_ZERO(&set);
+    for (int c : cpus) {
+        CPU_SET(c, &set);
+    }
+    pthread_setaffinity_np(pthread_self(), sizeof(set), &set);
+#endif
+}
+
+ThreadAffinity ThreadAffinity::fromCpus(const std::vector<int> &cpus) {
+    ThreadAffinity ret;
+    for (int c : cpus) {
+        checkCpuId(c);
+        ret.cpus.push_back({c});
+    }
+    return ret;
+}
+
+ThreadAffinity ThreadAffinity::fromNumaNodes(const std::vector<int> &numa_nodes,
+                                             int num_threads) {
+    ThreadAffinity ret;
+    if (numa_nodes.empty()) {
+        return ret;
+    }
+    if (numa_nodes.size() > RuntimeStage::max_slices) {
+        throw std::runtime_error("Too many NUMA nodes for thread affinity");
+    }
+    std::vector<std::vector<int>> node_cpus;
+    for (int node : numa_nodes) {
+        node_cpus.push_back(getNumaNodeCpus(node));
+        for (int c : node_cpus.back()) {
+            checkCpuId(c);
+        }
+    }
+    // the consecutive threads are on the same node
+    size_t n = std::max(num_threads, 1);
+    for (size_t i = 0; i < n; i++) {
+        size_t node = i * numa_nodes.size() / n;
+        ret.cpus.push_back(node_cpus[node]);
+        ret.nodes.push_back((int)node);
+    }
+    ret.num_nodes = numa_nodes.size();
+    return ret;
+}
+
+// the per-thread placement derived from ThreadAffinity
+struct ThreadPlacement {
+    ThreadAffinity affinity;
+
+    ThreadPlacement(const ThreadAffinity &affinity) : affinity{affinity} {
+        if (affinity.num_nodes == 0 ||
+            affinity.num_nodes > RuntimeStage::max_slices) {
+            throw std::runtime_error("Bad number of NUMA nodes");
+        }
+        for (int node : affinity.nodes) {
+            if (node < 0 || (size_t)node >= affinity.num_nodes) {
+                throw std::runtime_error("Bad NUMA node index of thread");
+            }
+        }
+        for (auto &cpus : affinity.cpus) {
+            for (int c : cpus) {
+                checkCpuId(c);
+            }
+        }
+    }
+
+    // called at the start of the worker thread. Returns the node index
+    size_t enter(size_t tid) const {
+        if (!affinity.cpus.empty()) {
+            pinCurrentThread(affinity.cpus[tid % affinity.cpus.size()]);
+        }
+        if (affinity.nodes.empty()) {
+            return 0;
+        }
+        return affinity.nodes[tid % affinity.nodes.size()];
+    }
+};
+
+// returns true if stage a should be run before b. b can be null
+static bool isHigherPriority(const RuntimeStage *a, const RuntimeStage *b) {
+    return !b || a->stage->priority > b->stage->priority;
+}
+
 struct SingleThreadExecutor : Executor {
+    // sorted by the priority in descending order. The stages of the same
+    // priority are in LIFO order
     std::list<RuntimeStage *> q;
-    virtual void enqueue(RuntimeStage *stage) override { q.push_front(stage); }
+    virtual void enqueue(RuntimeStage *stage) override {
+        auto itr = std::find_if(q.begin(), q.end(), [stage](RuntimeStage *s) {
+            return !isHigherPriority(s, stage);
+        });
+        q.insert(itr, stage);
+    }
 
     virtual void dequeue(RuntimeStage *stage) override {
         q.erase(std::find(q.begin(), q.end(), stage));
@@ -45,28 +277,51 @@ struct MultiThreadExecutor : Executor {
     std::mutex qlock;
     std::vector<std::thread> threads;
     std::vector<RuntimeStage *> q;
+    // the size of q, to skip locking qlock when q is empty
+    std::atomic<size_t> num_queued{0};
     std::array<std::atomic<RuntimeStage *>, 4> fast_slots;
     std::atomic<size_t> num_stages{0};
+    // increased on each enqueue, to wake up the parked threads
+    std::atomic<size_t> epoch{0};
 
     std::condition_variable cv;
     std::mutex cv_lock;
     std::atomic<size_t> idle_count{0};
-    bool closing = false;
+    std::atomic<bool> closing{false};
+    CompletionWaiter waiter;
+    bool caller_participates;
+    ThreadPlacement placement;
 
-    void notifyAwaiters() { cv.notify_all(); }
+    void notifyAwaiters() {
+        ++epoch;
+        if (idle_count.load() != 0) {
+            std::lock_guard<std::mutex> guard{cv_lock};
+            cv.notify_all();
+        }
+        waiter.notify();
+    }
 
-    void park(int &count) {
+    void park(int &count, size_t cur_epoch) {
         count++;
         if (count > 20 || num_stages.load() == 0) {
-            ++idle_count;
             count = 0;
-            std::unique_lock<std::mutex> lk{cv_lock};
-            cv.wait(lk);
+            if (++idle_count == threads.size()) {
+                waiter.notify();
+            }
+            {
+                std::unique_lock<std::mutex> lk{cv_lock};
+                cv.wait(lk, [&]() {
+                    return closing.load() || epoch.load() != cur_epoch;
+                });
+            }
             --idle_count;
         }
     }
 
-    MultiThreadExecutor(int num_threads) {
+    MultiThreadExecutor(int num_threads, bool caller_participates,
+                        const ThreadAffinity &affinity)
+        : caller_participates{caller_participates || num_threads <= 0},
+          placement{affinity} {
         for (auto &slot : fast_slots) {
             slot.store(nullptr);
         }
@@ -91,6 +346,7 @@ struct MultiThreadExecutor : Executor {
         {
             std::lock_guard<std::mutex> guard{qlock};
             q.push_back(stage);
+            ++num_queued;
         }
         notifyAwaiters();
     }
@@ -103,35 +359,47 @@ struct MultiThreadExecutor : Executor {
             auto curstage = slot.load();
             if (curstage == stage) {
                 slot.store(nullptr);
-                --num_stages;
+                onStageDone();
                 return;
             }
         }
-        std::lock_guard<std::mutex> guard{qlock};
-        auto itr = std::find(q.begin(), q.end(), stage);
-        assert(itr != q.end());
-        q.erase(itr);
-        --num_stages;
+        {
+            std::lock_guard<std::mutex> guard{qlock};
+            auto itr = std::find(q.begin(), q.end(), stage);
+            assert(itr != q.end());
+            q.erase(itr);
+            --num_queued;
+        }
+        onStageDone();
     }
 
+    void onStageDone() {
+        if (--num_stages == 0) {
+            waiter.notify();
+        }
+    }
+
+    // find the stage of the highest priority with tasks to do. The fast
+    // slots and then the recently enqueued stages are preferred among the
+    // stages of the same priority
     RuntimeStage *takeSingleJob() {
+        RuntimeStage *stage = nullptr;
         for (auto &slot : fast_slots) {
             auto curstage = slot.load();
-            if (curstage && curstage->hasJobToDo()) {
-                return curstage;
+            if (curstage && curstage->hasJobToDo() &&
+                isHigherPriority(curstage, stage)) {
+                stage = curstage;
             }
         }
-        RuntimeStage *stage = nullptr;
+        if (num_queued.load() == 0) {
+            return stage;
+        }
         {
             std::lock_guard<std::mutex> guard{qlock};
-            if (q.empty()) {
-                return nullptr;
-            }
             for (auto itr = q.rbegin(); itr != q.rend(); ++itr) {
                 auto cur = *itr;
-                if (cur->hasJobToDo()) {
+                if (cur->hasJobToDo() && isHigherPriority(cur, stage)) {
                     stage = cur;
-                    break;
                 }
             }
         }
@@ -148,16 +416,25 @@ struct MultiThreadExecutor : Executor {
         return takeSingleJob();
     }
 
+    size_t numSlices() const override { return placement.affinity.num_nodes; }
+
+    size_t numThreads() const override {
+        return threads.size() + (caller_participates ? 1 : 0);
+    }
+
     void workerMain(int tid) {
+        auto node = placement.enter(tid);
         int parkcount = 0;
         for (;;) {
+            auto cur_epoch = epoch.load();
             auto job = workerTakeJob();
             while (job) {
-                job->doJob();
+                job->doJob(node);
+                cur_epoch = epoch.load();
                 job = workerTakeJob();
             }
             // printf("PARK %d\n", tid);
-            park(parkcount);
+            park(parkcount, cur_epoch);
             if (closing) {
                 return;
             }
@@ -166,15 +443,26 @@ struct MultiThreadExecutor : Executor {
 
     void runUntilDone() override {
         std::lock_guard<std::mutex> guard{main_lock};
-        while (num_stages.load() > 0) {
-            auto job = takeSingleJob();
-            if (!job) {
-                continue;
+        if (caller_participates) {
+            while (num_stages.load() > 0) {
+                auto cur_epoch = epoch.load();
+                auto job = takeSingleJob();
+                if (!job) {
+                    // the remaining tasks are taken by the workers. Wait for
+                    // new stages or the end of the graph
+                    waiter.wait([&]() {
+                        return num_stages.load() == 0 ||
+                               epoch.load() != cur_epoch;
+                    });
+                    continue;
+                }
+                job->doJob();
             }
-            job->doJob();
-        }
-        while (idle_count != threads.size()) {
+        } else {
+            waiter.wait([&]() { return num_stages.load() == 0; });
         }
+        // wait until no worker holds a pointer to the stages
+        waiter.wait([&]() { return idle_count.load() == threads.size(); });
     }
 
     ~MultiThreadExecutor() {
@@ -182,15 +470,219 @@ struct MultiThreadExecutor : Executor {
             std::unique_lock<std::mutex> lk{cv_lock};
             closing = true;
         }
-        notifyAwaiters();
+        cv.notify_all();
+        for (auto &t : threads) {
+            t.join();
+        }
+    }
+};
+
+std::shared_ptr<Executor>
+createMultiThreadExecutor(int num_threads, bool caller_participates,
+                          const ThreadAffinity &affinity) {
+    return std::make_shared<MultiThreadExecutor>(num_threads,
+                                                 caller_participates, affinity);
+}
+
+// The executor with a stage deque for each worker thread. Each deque is sorted
+// by the priority of the stages. A worker first looks for jobs in its own
+// deque from the back (the stages of the highest priority, and then the most
+// recently ready ones, whose inputs are likely in the cache), and then steals
+// the stage of the highest priority from the deques of other threads. A stage
+// stays in the deque until all of its tasks are claimed, so several threads can
+// work on the tasks of the same stage. The tasks are claimed lock-free by
+// RuntimeStage::doJob. The locks of the deques are only held for a short scan
+// and are not shared by all threads.
+struct WorkStealingExecutor : Executor {
+    struct alignas(64) StageDeque {
+        std::mutex lock;
+        std::deque<RuntimeStage *> q;
+
+        void push(RuntimeStage *stage) {
+            std::lock_guard<std::mutex> guard{lock};
+            auto itr = q.end();
+            while (itr != q.begin() && isHigherPriority(*(itr - 1), stage)) {
+                --itr;
+            }
+            q.insert(itr, stage);
+        }
+
+        // find a stage with tasks to do. The stages without remaining tasks on
+        // the searching end are removed
+        RuntimeStage *pop(bool from_back) {
+            std::lock_guard<std::mutex> guard{lock};
+            while (!q.empty()) {
+                auto stage = from_back ? q.back() : q.front();
+                if (stage->hasJobToDo()) {
+                    return stage;
+                }
+                if (from_back) {
+                    q.pop_back();
+                } else {
+                    q.pop_front();
+                }
+            }
+            return nullptr;
+        }
+
+        RuntimeStage *steal() {
+            std::unique_lock<std::mutex> guard{lock, std::try_to_lock};
+            if (!guard.owns_lock()) {
+                return nullptr;
+            }
+            for (auto itr = q.rbegin(); itr != q.rend(); ++itr) {
+                if ((*itr)->hasJobToDo()) {
+                    return *itr;
+                }
+            }
+            return nullptr;
+        }
+    };
+    static thread_local WorkStealingExecutor *tls_executor;
+    static thread_local size_t tls_index;
+
+    std::mutex main_lock;
+    std::vector<std::thread> threads;
+    // the deques of the worker threads. The last one is for the external
+    // threads, e.g. the thread calling runUntilDone
+    std::unique_ptr<StageDeque[]> deques;
+    size_t num_deques;
+    std::atomic<size_t> num_stages{0};
+    std::atomic<size_t> epoch{0};
+
+    std::condition_variable cv;
+    std::mutex cv_lock;
+    std::atomic<size_t> idle_count{0};
+    std::atomic<bool> closing{false};
+    CompletionWaiter waiter;
+    bool caller_participates;
+    ThreadPlacement placement;
+
+    WorkStealingExecutor(int num_threads, bool caller_participates,
+                         const ThreadAffinity &affinity)
+        : deques{new StageDeque[num_threads + 1]}, num_deques(num_threads + 1),
+          caller_participates{caller_participates || num_threads <= 0},
+          placement{affinity} {
+        threads.reserve(num_threads);
+        for (int i = 0; i < num_threads; i++) {
+            threads.emplace_back([this, i]() { workerMain(i); });
+        }
+    }
+
+    size_t currentIndex() const {
+        return tls_executor == this ? tls_index : num_deques - 1;
+    }
+
+    virtual void enqueue(RuntimeStage *stage) override {
+        ++num_stages;
+        deques[currentIndex()].push(stage);
+        ++epoch;
+        if (idle_count.load() != 0) {
+            std::lock_guard<std::mutex> guard{cv_lock};
+            cv.notify_all();
+        }
+        waiter.notify();
+    }
+
+    virtual void dequeue(RuntimeStage *stage) override {
+        // the stage has no remaining tasks and is lazily removed from the
+        // deques. Do not read the RuntimeStage after --num_stages
+        if (--num_stages == 0) {
+            waiter.notify();
+        }
+    }
+
+    RuntimeStage *takeSingleJob(size_t self) {
+        if (auto stage = deques[self].pop(true)) {
+            return stage;
+        }
+        for (size_t i = 1; i < num_deques; i++) {
+            if (auto stage = deques[(self + i) % num_deques].steal()) {
+                return stage;
+            }
+        }
+        return nullptr;
+    }
+
+    size_t numSlices() const override { return placement.affinity.num_nodes; }
+
+    size_t numThreads() const override {
+        return threads.size() + (caller_participates ? 1 : 0);
+    }
+
+    void workerMain(size_t tid) {
+        tls_executor = this;
+        tls_index = tid;
+        auto node = placement.enter(tid);
+        while (!closing.load()) {
+            auto cur_epoch = epoch.load();
+            if (num_stages.load() != 0) {
+                if (auto job = takeSingleJob(tid)) {
+                    job->doJob(node);
+                    continue;
+                }
+            }
+            if (++idle_count == threads.size()) {
+                waiter.notify();
+            }
+            {
+                std::unique_lock<std::mutex> lk{cv_lock};
+                cv.wait(lk, [&]() {
+                    return closing.load() || epoch.load() != cur_epoch;
+                });
+            }
+            --idle_count;
+        }
+    }
+
+    void runUntilDone() override {
+        std::lock_guard<std::mutex> guard{main_lock};
+        auto self = num_deques - 1;
+        if (caller_participates) {
+            while (num_stages.load() > 0) {
+                auto cur_epoch = epoch.load();
+                auto job = takeSingleJob(self);
+                if (!job) {
+                    waiter.wait([&]() {
+                        return num_stages.load() == 0 ||
+                               epoch.load() != cur_epoch;
+                    });
+                    continue;
+                }
+                job->doJob();
+            }
+        } else {
+            waiter.wait([&]() { return num_stages.load() == 0; });
+        }
+        // wait until no worker holds a pointer to the stages
+        waiter.wait([&]() { return idle_count.load() == threads.size(); });
+        // all stages are done. Remove the remaining stale stages
+        for (size_t i = 0; i < num_deques; i++) {
+            std::lock_guard<std::mutex> guard{deques[i].lock};
+            deques[i].q.clear();
+        }
+    }
+
+    ~WorkStealingExecutor() {
+        {
+            std::lock_guard<std::mutex> guard{cv_lock};
+            closing = true;
+        }
+        cv.notify_all();
         for (auto &t : threads) {
             t.join();
         }
     }
 };
 
-std::shared_ptr<Executor> createMultiThreadExecutor(int num_threads) {
-    return std::make_shared<MultiThreadExecutor>(num_threads);
+thread_local WorkStealingExecutor *WorkStealingExecutor::tls_executor = nullptr;
+thread_local size_t WorkStealingExecutor::tls_index = 0;
+
+std::shared_ptr<Executor>
+createWorkStealingExecutor(int num_threads, bool caller_participates,
+                           const ThreadAffinity &affinity) {
+    return std::make_shared<WorkStealingExecutor>(
+        num_threads, caller_participates, affinity);
 }
 
 } // namespace kun
\ No newline at end of file
@@ -0,0 +1,217 @@
+#pragma once
+
+#include <Kun/CrossSectional.hpp>
+#include <Kun/Rank.hpp>
+
+namespace kun {
+namespace ops {
+
+// The stocks of a time step partitioned by the group ids, which is built once
+// for each time step instead of visiting the stocks for each group. The group
+// ids are non-negative integers stored as floating point numbers. The stocks
+// with NaN or negative group ids are not in any group
+struct GroupIndex {
+    // the (group id, stock index) pairs sorted by the group ids. The stocks of
+    // a group are in the ascending order of the stock indices
+    std::vector<RankPair<uint32_t>> stocks;
+    std::vector<RankPair<uint32_t>> tmp;
+
+    template <typename T>
+    static bool toGroupId(T v, uint32_t &group) {
+        if (!(v >= 0 && v < T(4294967296.0))) {
+            return false;
+        }
+        group = uint32_t(v);
+        return true;
+    }
+    // Partition the stocks by one pass of the counting sort if there are less
+    // than 256 groups. The radix sort is stable
+    void sort() {
+        if (stocks.empty()) {
+            return;
+        }
+        tmp.resize(stocks.size());
+        radixSortPairs(stocks.data(), tmp.data(), stocks.size());
+    }
+    // the end of the group starting at stocks[begin]
+    size_t groupEnd(size_t begin) const {
+        auto end = begin + 1;
+        while (end < stocks.size() &&
+               stocks[end].first == stocks[begin].first) {
+            end++;
+        }
+        return end;
+    }
+};
+
+// The sums of the absolute values of the valid stocks in the groups
+struct GroupScaleKernel {
+    template <typename IN, typename OUT>
+    void operator()(const GroupIndex &index, const IN &in, const OUT &out) {
+        using T = typename IN::T;
+        auto &stocks = index.stocks;
+        for (size_t begin = 0; begin < stocks.size();) {
+            auto end = index.groupEnd(begin);
+            T sum = 0;
+            for (size_t i = begin; i < end; i++) {
+                T v = in[stocks[i].second];
+                if (!std::isnan(v)) {
+                    sum += std::abs(v);
+                }
+            }
+            for (size_t i = begin; i < end; i++) {
+                out[stocks[i].second] = in[stocks[i].second] / sum;
+            }
+            begin = end;
+        }
+    }
+};
+
+// The means of the valid stocks in the groups
+struct GroupDemeanKernel {
+    template <typename IN, typename OUT>
+    void operator()(const GroupIndex &index, const IN &in, const OUT &out) {
+        using T = typename IN::T;
+        auto &stocks = index.stocks;
+        for (size_t begin = 0; begin < stocks.size();) {
+            auto end = index.groupEnd(begin);
+            T sum = 0;
+            size_t count = 0;
+            for (size_t i = begin; i < end; i++) {
+                T v = in[stocks[i].second];
+                if (!std::isnan(v)) {
+                    sum += v;
+                    count++;
+                }
+            }
+            T mean = sum / T(count);
+            for (size_t i = begin; i < end; i++) {
+                out[stocks[i].second] = in[stocks[i].second] - mean;
+            }
+            begin = end;
+        }
+    }
+};
+
+// The stocks are sorted by the values once, and then partitioned by the groups
+// by the stable GroupIndex::sort(). The stocks of each group are in the order
+// of the values
+template <typename T>
+struct GroupRankKernel {
+    using K = typename RadixKey<T>::type;
+    // the (key, stock index) pairs of the valid stocks
+    std::vector<RankPair<K>> data;
+    std::vector<RankPair<K>> tmp;
+    // the (group id, position in data) pairs of the valid stocks
+    GroupIndex sorted;
+    std::vector<uint32_t> group_of;
+
+    template <typename IN, typename OUT>
+    void operator()(const GroupIndex &index, const IN &in, const OUT &out) {
+        group_of.resize(in.num_stocks);
+        data.clear();
+        for (auto &s : index.stocks) {
+            T v = in[s.second];
+            if (std::isnan(v)) {
+                out[s.second] = NAN;
+                continue;
+            }
+            group_of[s.second] = s.first;
+            data.emplace_back(toRadixKey(v), s.second);
+        }
+        sortRankPairs(data.data(), data.size(), tmp);
+        sorted.stocks.clear();
+        for (size_t i = 0; i < data.size(); i++) {
+            sorted.stocks.emplace_back(group_of[data[i].second], uint32_t(i));
+        }
+        sorted.sort();
+        // the pairs of a group in data, reusing the scratch of the sorting
+        auto &group = tmp;
+        for (size_t begin = 0; begin < sorted.stocks.size();) {
+            auto end = sorted.groupEnd(begin);
+            group.clear();
+            for (size_t i = begin; i < end; i++) {
+                group.push_back(data[sorted.stocks[i].second]);
+            }
+            writeRanks<typename OUT::Mapper>(
+                out.buf, group.data(), group.size(), 0, group.size(), out.t,
+                out.num_time, out.num_stocks, OUT::Mapper::lanes);
+            begin = end;
+        }
+    }
+};
+
+// Runs a group KERNEL on the time steps of a task. The first input is the
+// values and the second input is the group ids. The stages of the group ops
+// are not split by stocks
+template <typename INPUT, typename GROUP, typename OUTPUT, typename KERNEL>
+void groupStocks(RuntimeStage *stage, size_t time_idx, size_t __total_time,
+                 size_t __start, size_t __length, KERNEL &kernel) {
+    using T = typename INPUT::value_type;
+    auto num_stocks = stage->ctx->stock_count;
+    auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
+    auto in_num_time = inbuf.num_time;
+    auto in_base_time = (in_num_time == __total_time) ? 0 : __start;
+    const T *input =
+        INPUT::getInput(&inbuf, stage->stage->in_buffers[0], num_stocks);
+    auto &groupbuf = stage->ctx->buffers[stage->stage->in_buffers[1]->id];
+    auto group_num_time = groupbuf.num_time;
+    auto group_base_time = (group_num_time == __total_time) ? 0 : __start;
+    const T *groups =
+        GROUP::getInput(&groupbuf, stage->stage->in_buffers[1], num_stocks);
+    auto outinfo = stage->stage->out_buffers[0];
+    auto simd_len = stage->ctx->simd_len;
+    T *output = OUTPUT::getOutput(&stage->ctx->buffers[outinfo->id], outinfo,
+                                  num_stocks, simd_len);
+    auto time_stride = stage->time_stride;
+    auto time_end =
+        std::min(__start + (time_idx + 1) * time_stride, __start + __length);
+    GroupIndex index;
+    index.stocks.reserve(num_stocks);
+    for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
+        CrossSectionalRow<INPUT, const T *> in{input, t - in_base_time,
+                                               in_num_time, num_stocks};
+        CrossSectionalRow<GROUP, const T *> group{groups, t - group_base_time,
+                                                  group_num_time, num_stocks};
+        CrossSectionalRow<OUTPUT, T *> out{output, t - __start, __length,
+                                           num_stocks};
+        index.stocks.clear();
+        for (size_t i = 0; i < num_stocks; i++) {
+            uint32_t g;
+            if (GroupIndex::toGroupId(group[i], g)) {
+                index.stocks.emplace_back(g, uint32_t(i));
+            } else {
+                out[i] = NAN;
+            }
+        }
+        index.sort();
+        kernel(index, in, out);
+    }
+}
+
+template <typename INPUT, typename GROUP, typename OUTPUT>
+void GroupRankStocks(RuntimeStage *stage, size_t time_idx, size_t __total_time,
+                     size_t __start, size_t __length) {
+    GroupRankKernel<typename INPUT::value_type> kernel;
+    groupStocks<INPUT, GROUP, OUTPUT>(stage, time_idx, __total_time, __start,
+                                      __length, kernel);
+}
+
+template <typename INPUT, typename GROUP, typename OUTPUT>
+void GroupScaleStocks(RuntimeStage *stage, size_t time_idx, size_t __total_time,
+                      size_t __start, size_t __length) {
+    GroupScaleKernel kernel;
+    groupStocks<INPUT, GROUP, OUTPUT>(stage, time_idx, __total_time, __start,
+                                      __length, kernel);
+}
+
+template <typename INPUT, typename GROUP, typename OUTPUT>
+void GroupDemeanStocks(RuntimeStage *stage, size_t time_idx,
+                       size_t __total_time, size_t __start, size_t __length) {
+    GroupDemeanKernel kernel;
+    groupStocks<INPUT, GROUP, OUTPUT>(stage, time_idx, __total_time, __start,
+                                      __length, kernel);
+}
+
+} // namespace ops
+} // namespace kun
@@ -8,6 +8,8 @@ namespace ops {
 
 template <typename T, size_t simd_len>
 struct KUN_TEMPLATE_ARG MapperSTs {
+    using value_type = T;
+    static constexpr size_t lanes = simd_len;
     static const T *getInput(Buffer *b, BufferInfo *info, size_t num_stock) {
         return b->getPtr<T>();
     }
@@ -15,6 +17,9 @@ struct KUN_TEMPLATE_ARG MapperSTs {
                         size_t simd_len2) {
         return b->getPtr<T>();
     }
+    static T *getWrittenOutput(Buffer *b, BufferInfo *info, size_t num_stock) {
+        return b->getPtr<T>();
+    }
     static size_t call(size_t stockid, size_t t, size_t num_time,
                        size_t num_stock, size_t simd_len2) {
         auto S = stockid / simd_len;
@@ -24,6 +29,8 @@ struct KUN_TEMPLATE_ARG MapperSTs {
 
 template <typename T, size_t simd_len>
 struct KUN_TEMPLATE_ARG MapperTS {
+    using value_type = T;
+    static constexpr size_t lanes = simd_len;
     static const T *getInput(Buffer *b, BufferInfo *info, size_t num_stock) {
         return b->getPtr<T>();
     }
@@ -31,6 +38,9 @@ struct KUN_TEMPLATE_ARG MapperTS {
                         size_t simd_len2) {
         return b->getPtr<T>();
     }
+    static T *getWrittenOutput(Buffer *b, BufferInfo *info, size_t num_stock) {
+        return b->getPtr<T>();
+    }
     static size_t call(size_t stockid, size_t t, size_t num_time,
                        size_t num_stock, size_t simd_len2) {
         return t * num_stock + stockid;
@@ -39,12 +49,23 @@ struct KUN_TEMPLATE_ARG MapperTS {
 
 template <typename T, size_t simd_len>
 struct KUN_TEMPLATE_ARG MapperSTREAM {
+    using value_type = T;
+    static constexpr size_t lanes = simd_len;
     static const T *getInput(Buffer *b, BufferInfo *info, size_t num_stock) {
-        return b->stream_buf->getCurrentBufferPtr(num_stock, info->window);
+        return b->getPtr<StreamBuffer<T>>()->getCurrentBufferPtr(
+            StreamBuffer<T>::getPaddedStockCount(num_stock, simd_len),
+            info->window);
     }
     static T *getOutput(Buffer *b, BufferInfo *info, size_t num_stock,
                         size_t simd_len2) {
-        return b->stream_buf->pushData(num_stock, info->window, simd_len);
+        return b->getPtr<StreamBuffer<T>>()->pushData(
+            StreamBuffer<T>::getPaddedStockCount(num_stock, simd_len),
+            info->window, simd_len);
+    }
+    // the output after getOutput() is called by another task of the stage.
+    // The slot is not pushed again
+    static T *getWrittenOutput(Buffer *b, BufferInfo *info, size_t num_stock) {
+        return const_cast<T *>(getInput(b, info, num_stock));
     }
     static size_t call(size_t stockid, size_t t, size_t num_time,
                        size_t num_stock, size_t simd_len2) {
@@ -24,6 +24,13 @@ struct Module {
     size_t blocking_len;
     Datatype dtype;
     size_t aligned;
+    // the number of slots in the arena of the temp buffers, planned by the
+    // compiler. The temp buffers sharing a slot are never alive at the same
+    // time. 0 if the temp buffers are allocated separately in each run
+    size_t num_temp_slots;
+    // 1 if an op depends on the whole history of the inputs without a bounded
+    // window, e.g. ExpMovingAvg. Such a module cannot be run in time chunks
+    size_t unbounded_window;
 };
 
 struct Library {
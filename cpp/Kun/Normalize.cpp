@@ -0,0 +1,33 @@
+#include "Normalize.hpp"
+
+namespace kun {
+namespace ops {
+#define DEF_INSTANCE(NAME, ...)                                                \
+    template KUN_TEMPLATE_EXPORT void NAME##Stocks<__VA_ARGS__>(               \
+        RuntimeStage * stage, size_t time_idx, size_t __total_time,            \
+        size_t __start, size_t __length);
+#define DEF_WINSORIZE_INSTANCE(...)                                            \
+    template KUN_TEMPLATE_EXPORT void WinsorizeStocks<__VA_ARGS__>(            \
+        RuntimeStage * stage, size_t time_idx, size_t __total_time,            \
+        size_t __start, size_t __length, float sigma);
+
+DEF_INSTANCE(Demean, MapperSTs<float, 8>, MapperSTs<float, 8>)
+DEF_INSTANCE(Demean, MapperSTs<float, 8>, MapperTS<float, 8>)
+DEF_INSTANCE(Demean, MapperTS<float, 8>, MapperTS<float, 8>)
+DEF_INSTANCE(Demean, MapperTS<float, 8>, MapperSTs<float, 8>)
+DEF_INSTANCE(Demean, MapperSTREAM<float, 8>, MapperSTREAM<float, 8>)
+
+DEF_INSTANCE(ZScore, MapperSTs<float, 8>, MapperSTs<float, 8>)
+DEF_INSTANCE(ZScore, MapperSTs<float, 8>, MapperTS<float, 8>)
+DEF_INSTANCE(ZScore, MapperTS<float, 8>, MapperTS<float, 8>)
+DEF_INSTANCE(ZScore, MapperTS<float, 8>, MapperSTs<float, 8>)
+DEF_INSTANCE(ZScore, MapperSTREAM<float, 8>, MapperSTREAM<float, 8>)
+
+DEF_WINSORIZE_INSTANCE(MapperSTs<float, 8>, MapperSTs<float, 8>)
+DEF_WINSORIZE_INSTANCE(MapperSTs<float, 8>, MapperTS<float, 8>)
+DEF_WINSORIZE_INSTANCE(MapperTS<float, 8>, MapperTS<float, 8>)
+DEF_WINSORIZE_INSTANCE(MapperTS<float, 8>, MapperSTs<float, 8>)
+DEF_WINSORIZE_INSTANCE(MapperSTREAM<float, 8>, MapperSTREAM<float, 8>)
+
+} // namespace ops
+} // namespace kun
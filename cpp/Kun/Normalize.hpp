@@ -0,0 +1,193 @@
+#pragma once
+
+#include <Kun/CrossSectional.hpp>
+
+namespace kun {
+namespace ops {
+
+// The count, mean and sum of squared deviations of the valid stocks. The
+// statistics of a range of stocks are computed in two passes, and the ranges
+// are merged by the parallel algorithm of Chan et al.
+template <typename T, size_t lanes>
+struct MomentsKernel {
+    using simd_t = kun_simd::vec<T, lanes>;
+    struct Stats {
+        T count;
+        T mean;
+        T m2;
+        // the sample variance. NaN if there are fewer than 2 valid stocks
+        T variance() const { return count < 2 ? NAN : m2 / (count - 1); }
+    };
+    template <typename IN>
+    Stats reduce(const IN &in, size_t begin, size_t end) const {
+        simd_t sum = 0;
+        simd_t count = 0;
+        for (size_t b = begin; b < end; b++) {
+            auto v = in.load(b);
+            auto isnan = kun_simd::sc_isnan(v);
+            sum = sum + kun_simd::sc_select(isnan, simd_t(0), v);
+            count = count + kun_simd::sc_select(isnan, simd_t(0), simd_t(1));
+        }
+        Stats ret;
+        ret.count = horizontalSum(count);
+        ret.mean = horizontalSum(sum) / ret.count;
+        simd_t m2 = 0;
+        simd_t mean = ret.mean;
+        for (size_t b = begin; b < end; b++) {
+            auto v = in.load(b);
+            auto diff = v - mean;
+            m2 = m2 + kun_simd::sc_select(kun_simd::sc_isnan(v), simd_t(0),
+                                          diff * diff);
+        }
+        ret.m2 = horizontalSum(m2);
+        return ret;
+    }
+    static void merge(Stats &a, const Stats &b) {
+        if (b.count == 0) {
+            return;
+        }
+        if (a.count == 0) {
+            a = b;
+            return;
+        }
+        T count = a.count + b.count;
+        T delta = b.mean - a.mean;
+        a.mean += delta * b.count / count;
+        a.m2 += b.m2 + delta * delta * a.count * b.count / count;
+        a.count = count;
+    }
+};
+
+template <typename T, size_t lanes>
+struct DemeanKernel : MomentsKernel<T, lanes> {
+    using simd_t = kun_simd::vec<T, lanes>;
+    using Stats = typename MomentsKernel<T, lanes>::Stats;
+    template <typename IN, typename OUT>
+    void map(const IN &in, const OUT &out, size_t begin, size_t end,
+             const Stats &stats) const {
+        simd_t mean = stats.mean;
+        for (size_t b = begin; b < end; b++) {
+            out.store(b, in.load(b) - mean);
+        }
+    }
+};
+
+template <typename T, size_t lanes>
+struct ZScoreKernel : MomentsKernel<T, lanes> {
+    using simd_t = kun_simd::vec<T, lanes>;
+    using Stats = typename MomentsKernel<T, lanes>::Stats;
+    template <typename IN, typename OUT>
+    void map(const IN &in, const OUT &out, size_t begin, size_t end,
+             const Stats &stats) const {
+        simd_t mean = stats.mean;
+        simd_t stddev = std::sqrt(stats.variance());
+        for (size_t b = begin; b < end; b++) {
+            out.store(b, (in.load(b) - mean) / stddev);
+        }
+    }
+};
+
+template <typename T, size_t lanes>
+struct WinsorizeKernel : MomentsKernel<T, lanes> {
+    using simd_t = kun_simd::vec<T, lanes>;
+    using Stats = typename MomentsKernel<T, lanes>::Stats;
+    T sigma;
+    WinsorizeKernel(T sigma) : sigma{sigma} {}
+    template <typename IN, typename OUT>
+    void map(const IN &in, const OUT &out, size_t begin, size_t end,
+             const Stats &stats) const {
+        T stddev = std::sqrt(stats.variance());
+        simd_t lower = -std::numeric_limits<T>::infinity();
+        simd_t upper = std::numeric_limits<T>::infinity();
+        if (!std::isnan(stddev)) {
+            lower = stats.mean - sigma * stddev;
+            upper = stats.mean + sigma * stddev;
+        }
+        for (size_t b = begin; b < end; b++) {
+            auto v = in.load(b);
+            auto clipped = kun_simd::sc_min(kun_simd::sc_max(v, lower), upper);
+            out.store(b,
+                      kun_simd::sc_select(kun_simd::sc_isnan(v), v, clipped));
+        }
+    }
+};
+
+template <typename INPUT, typename OUTPUT>
+KUN_TEMPLATE_EXPORT void DemeanStocks(RuntimeStage *stage, size_t time_idx,
+                                      size_t __total_time, size_t __start,
+                                      size_t __length) {
+    crossSectionalStocks<INPUT, OUTPUT>(
+        stage, time_idx, __total_time, __start, __length,
+        DemeanKernel<typename INPUT::value_type, INPUT::lanes>{});
+}
+
+template <typename INPUT, typename OUTPUT>
+KUN_TEMPLATE_EXPORT void ZScoreStocks(RuntimeStage *stage, size_t time_idx,
+                                      size_t __total_time, size_t __start,
+                                      size_t __length) {
+    crossSectionalStocks<INPUT, OUTPUT>(
+        stage, time_idx, __total_time, __start, __length,
+        ZScoreKernel<typename INPUT::value_type, INPUT::lanes>{});
+}
+
+template <typename INPUT, typename OUTPUT>
+KUN_TEMPLATE_EXPORT void WinsorizeStocks(RuntimeStage *stage, size_t time_idx,
+                                         size_t __total_time, size_t __start,
+                                         size_t __length,
+                                         typename INPUT::value_type sigma) {
+    crossSectionalStocks<INPUT, OUTPUT>(
+        stage, time_idx, __total_time, __start, __length,
+        WinsorizeKernel<typename INPUT::value_type, INPUT::lanes>{sigma});
+}
+
+extern template void DemeanStocks<MapperSTs<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void DemeanStocks<MapperSTs<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void DemeanStocks<MapperTS<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void DemeanStocks<MapperTS<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void
+DemeanStocks<MapperSTREAM<float, 8>, MapperSTREAM<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void ZScoreStocks<MapperSTs<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void ZScoreStocks<MapperSTs<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void ZScoreStocks<MapperTS<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void ZScoreStocks<MapperTS<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void
+ZScoreStocks<MapperSTREAM<float, 8>, MapperSTREAM<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length);
+extern template void WinsorizeStocks<MapperSTs<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length, float sigma);
+extern template void WinsorizeStocks<MapperSTs<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length, float sigma);
+extern template void WinsorizeStocks<MapperTS<float, 8>, MapperTS<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length, float sigma);
+extern template void WinsorizeStocks<MapperTS<float, 8>, MapperSTs<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length, float sigma);
+extern template void
+WinsorizeStocks<MapperSTREAM<float, 8>, MapperSTREAM<float, 8>>(
+    RuntimeStage *stage, size_t time_idx, size_t __total_time, size_t __start,
+    size_t __length, float sigma);
+
+} // namespace ops
+} // namespace kun
@@ -5,6 +5,7 @@
 #include "StreamBuffer.hpp"
 #include <cmath>
 #include <limits>
+#include <new>
 #include <stdint.h>
 #include <type_traits>
 
@@ -206,9 +207,15 @@ struct StreamWindow : DataSource<true> {
     size_t num_stock;
     // window slots of floatx8
     T *buf;
+    // num_stock is the real stock count. The rows of the buffer are padded to
+    // whole SIMD vectors
     StreamWindow(StreamBuffer<T> *buf, size_t stock_idx, size_t num_stock)
-        : pos{*buf->getPos(stock_idx, num_stock, window)}, stock_idx{stock_idx},
-          num_stock{num_stock}, buf{buf->getBuffer()} {}
+        : pos{*buf->getPos(
+              stock_idx,
+              StreamBuffer<T>::getPaddedStockCount(num_stock, stride), window)},
+          stock_idx{stock_idx},
+          num_stock{StreamBuffer<T>::getPaddedStockCount(num_stock, stride)},
+          buf{buf->getBuffer()} {}
     void store(size_t index, const simd_t &in) {
         simd_t::store(in, &buf[pos * num_stock + stock_idx * stride]);
         pos += 1;
@@ -254,6 +261,27 @@ struct StreamWindow<T, stride, 1ul> : DataSource<true> {
     // }
 };
 
+// Get the state of a stateful op (e.g. FastWindowedSum) of the SIMD group of
+// stocks in stream mode. The state is kept in a stream buffer across the ticks.
+// The window of the buffer is the number of SIMD vectors in the state. The
+// position of the buffer marks whether the state is initialized
+template <typename State, int stride, size_t window, typename T>
+State &getStreamState(StreamBuffer<T> *buf, size_t stock_idx,
+                      size_t num_stock) {
+    static_assert(sizeof(State) <= sizeof(T) * stride * window,
+                  "The stream buffer is too small for the state");
+    auto &initialized = *buf->getPos(
+        stock_idx, StreamBuffer<T>::getPaddedStockCount(num_stock, stride),
+        window);
+    auto state = reinterpret_cast<State *>(buf->getBuffer() +
+                                           stock_idx * stride * window);
+    if (!initialized) {
+        new (state) State{};
+        initialized = 1;
+    }
+    return *state;
+}
+
 template <typename TInput>
 struct RequireWindow {
     static_assert(TInput::containsWindow, "This stage needs window data");
@@ -334,6 +362,286 @@ struct ExpMovingAvg {
     }
 };
 
+// The min or max of a rolling window by a monotonic deque for each SIMD lane.
+// The deque holds the (value, step) entries which may be the min or max of
+// the current or a future window. Each step pushes and pops amortized O(1)
+// entries, instead of visiting the whole window. Among the equal values, the
+// oldest one is at the front of the deque. Like pandas, the output is NaN if
+// the window is not full or contains NaN, so the deque is cleared on NaN. If
+// is_arg, the output is the offset of the oldest min or max from the current
+// step, the same as ReduceArgMin and ReduceArgMax
+template <typename T, int stride, int window, bool is_max, bool is_arg>
+struct MonotonicDeque {
+    using simd_t = kun_simd::vec<T, stride>;
+    T values[stride][window] = {};
+    uint32_t steps[stride][window] = {};
+    uint32_t head[stride] = {};
+    uint32_t size[stride] = {};
+    // the number of the successive non-NaN values till the current step, at
+    // most window
+    uint32_t valid_count[stride] = {};
+    // the current step. The differences of the steps are correct after the
+    // wrap around
+    uint32_t cur_step = 0;
+
+    simd_t step(simd_t cur, size_t index) {
+        alignas(alignof(simd_t)) T out[stride];
+        for (int lane = 0; lane < stride; lane++) {
+            T v = cur.raw[lane];
+            auto &h = head[lane];
+            auto &n = size[lane];
+            if (std::isnan(v)) {
+                n = 0;
+                valid_count[lane] = 0;
+                out[lane] = NAN;
+                continue;
+            }
+            if (valid_count[lane] < window) {
+                valid_count[lane]++;
+            }
+            // at most one entry expires in each step
+            if (n && cur_step - steps[lane][h] >= uint32_t(window)) {
+                h = (h + 1 == window) ? 0 : h + 1;
+                n--;
+            }
+            while (n) {
+                auto back = h + n - 1;
+                back = back >= window ? back - window : back;
+                T old = values[lane][back];
+                if (is_max ? !(old < v) : !(old > v)) {
+                    break;
+                }
+                n--;
+            }
+            auto back = h + n;
+            back = back >= window ? back - window : back;
+            values[lane][back] = v;
+            steps[lane][back] = cur_step;
+            n++;
+            if (valid_count[lane] < window) {
+                out[lane] = NAN;
+            } else {
+                out[lane] =
+                    is_arg ? T(cur_step - steps[lane][h]) : values[lane][h];
+            }
+        }
+        cur_step++;
+        return simd_t::load_aligned(out);
+    }
+};
+
+template <typename T, int stride, int window>
+using FastWindowedMin = MonotonicDeque<T, stride, window, false, false>;
+template <typename T, int stride, int window>
+using FastWindowedMax = MonotonicDeque<T, stride, window, true, false>;
+template <typename T, int stride, int window>
+using FastWindowedArgMin = MonotonicDeque<T, stride, window, false, true>;
+template <typename T, int stride, int window>
+using FastWindowedArgMax = MonotonicDeque<T, stride, window, true, true>;
+
+// A sum with the Kahan compensation. The values are skipped on the lanes of
+// the mask
+template <typename T, int stride>
+struct KahanSum {
+    using simd_t = kun_simd::vec<T, stride>;
+    simd_t sum = 0;
+    simd_t compensation = 0;
+    template <typename Mask>
+    void add(Mask skip, simd_t v) {
+        sum = sc_select(skip, sum, kahanAdd(skip, sum, v, compensation));
+    }
+    template <typename Mask>
+    void clear(Mask mask) {
+        sum = sc_select(mask, T(0), sum);
+        compensation = sc_select(mask, T(0), compensation);
+    }
+};
+
+// The running sums of the powers of the non-NaN values in a rolling window,
+// shifted by a value close to the window to avoid the catastrophic
+// cancellation. Each step adds the current value and subtracts the value
+// leaving the window with the Kahan compensation like FastWindowedSum, instead
+// of the two passes over the window. Once every window steps, the shift is set
+// to the current value and the sums are recomputed from the window, so that
+// the shift follows the trend of the data. It is still O(1) amortized. If the
+// last window values of a lane are all equal, the sums are set to the exact
+// zeros
+template <typename T, int stride, int window>
+struct RunningMoments {
+    using simd_t = kun_simd::vec<T, stride>;
+    simd_t shift = 0;
+    simd_t count = 0;
+    KahanSum<T, stride> sum;
+    KahanSum<T, stride> sum_sqr;
+    // the number of the successive time steps with the value equal to last
+    simd_t num_same = 0;
+    simd_t last = NAN;
+    uint32_t steps_to_recompute = 0;
+
+    template <typename Mask>
+    void update(Mask skip, simd_t v, T sign) {
+        auto d = v - shift;
+        count = sc_select(skip, count, count + sign);
+        sum.add(skip, d * sign);
+        sum_sqr.add(skip, d * d * sign);
+    }
+
+    template <typename TInput>
+    void step(TInput &input, simd_t cur, size_t index) {
+        RequireWindow<TInput>{};
+        auto cur_is_nan = sc_isnan(cur);
+        if (steps_to_recompute == 0) {
+            shift = sc_select(cur_is_nan, shift, cur);
+            count = 0;
+            sum = KahanSum<T, stride>{};
+            sum_sqr = KahanSum<T, stride>{};
+            for (int j = 1; j < window; j++) {
+                auto v = input.getWindow(index, j);
+                update(sc_isnan(v), v, T(1));
+            }
+            steps_to_recompute = window;
+        } else {
+            auto old = input.getWindow(index, window);
+            update(sc_isnan(old), old, T(-1));
+        }
+        update(cur_is_nan, cur, T(1));
+        steps_to_recompute--;
+        num_same = sc_select(cur == last, num_same + T(1), simd_t(T(1)));
+        last = cur;
+        auto is_const = num_same >= T(window);
+        shift = sc_select(is_const, cur, shift);
+        sum.clear(is_const);
+        sum_sqr.clear(is_const);
+    }
+
+    // the sum of squared deviations from the mean
+    simd_t m2() const {
+        auto ret = sum_sqr.sum - sum.sum * sum.sum / count;
+        return sc_max(ret, simd_t(T(0)));
+    }
+};
+
+// The running sums of the pairs of non-NaN values in the rolling windows of
+// two inputs, in the same way as RunningMoments
+template <typename T, int stride, int window>
+struct RunningComoments {
+    using simd_t = kun_simd::vec<T, stride>;
+    simd_t shift_x = 0;
+    simd_t shift_y = 0;
+    simd_t count = 0;
+    KahanSum<T, stride> sum_x;
+    KahanSum<T, stride> sum_y;
+    KahanSum<T, stride> sum_xx;
+    KahanSum<T, stride> sum_yy;
+    KahanSum<T, stride> sum_xy;
+    simd_t num_same_x = 0;
+    simd_t last_x = NAN;
+    simd_t num_same_y = 0;
+    simd_t last_y = NAN;
+    uint32_t steps_to_recompute = 0;
+
+    void update(simd_t x, simd_t y, T sign) {
+        auto skip = sc_isnan(x, y);
+        auto dx = x - shift_x;
+        auto dy = y - shift_y;
+        count = sc_select(skip, count, count + sign);
+        sum_x.add(skip, dx * sign);
+        sum_y.add(skip, dy * sign);
+        sum_xx.add(skip, dx * dx * sign);
+        sum_yy.add(skip, dy * dy * sign);
+        sum_xy.add(skip, dx * dy * sign);
+    }
+
+    template <typename TInputX, typename TInputY>
+    void step(TInputX &input_x, TInputY &input_y, simd_t x, simd_t y,
+              size_t index) {
+        RequireWindow<TInputX>{};
+        RequireWindow<TInputY>{};
+        if (steps_to_recompute == 0) {
+            shift_x = sc_select(sc_isnan(x), shift_x, x);
+            shift_y = sc_select(sc_isnan(y), shift_y, y);
+            count = 0;
+            sum_x = sum_y = sum_xx = sum_yy = sum_xy = KahanSum<T, stride>{};
+            for (int j = 1; j < window; j++) {
+                update(input_x.getWindow(index, j), input_y.getWindow(index, j),
+                       T(1));
+            }
+            steps_to_recompute = window;
+        } else {
+            update(input_x.getWindow(index, window),
+                   input_y.getWindow(index, window), T(-1));
+        }
+        update(x, y, T(1));
+        steps_to_recompute--;
+        num_same_x = sc_select(x == last_x, num_same_x + T(1), simd_t(T(1)));
+        last_x = x;
+        num_same_y = sc_select(y == last_y, num_same_y + T(1), simd_t(T(1)));
+        last_y = y;
+        auto is_const_x = num_same_x >= T(window);
+        shift_x = sc_select(is_const_x, x, shift_x);
+        sum_x.clear(is_const_x);
+        sum_xx.clear(is_const_x);
+        sum_xy.clear(is_const_x);
+        auto is_const_y = num_same_y >= T(window);
+        shift_y = sc_select(is_const_y, y, shift_y);
+        sum_y.clear(is_const_y);
+        sum_yy.clear(is_const_y);
+        sum_xy.clear(is_const_y);
+    }
+
+    // the sums of (x-mean_x)^2, (y-mean_y)^2 and (x-mean_x)*(y-mean_y)
+    simd_t m2X() const {
+        auto ret = sum_xx.sum - sum_x.sum * sum_x.sum / count;
+        return sc_max(ret, simd_t(T(0)));
+    }
+    simd_t m2Y() const {
+        auto ret = sum_yy.sum - sum_y.sum * sum_y.sum / count;
+        return sc_max(ret, simd_t(T(0)));
+    }
+    simd_t comomentXY() const {
+        return sum_xy.sum - sum_x.sum * sum_y.sum / count;
+    }
+};
+
+template <typename T, int stride, int window>
+struct FastWindowedStddev : RunningMoments<T, stride, window> {
+    using simd_t = kun_simd::vec<T, stride>;
+    template <typename TInput>
+    simd_t step(TInput &input, simd_t cur, size_t index) {
+        RunningMoments<T, stride, window>::step(input, cur, index);
+        // NaN if the window is not full or contains NaN
+        return sc_select(this->count == T(window),
+                         sc_sqrt(this->m2() / T(window - 1)), simd_t(NAN));
+    }
+};
+
+template <typename T, int stride, int window>
+struct FastWindowedCovariance : RunningComoments<T, stride, window> {
+    using simd_t = kun_simd::vec<T, stride>;
+    template <typename TInputX, typename TInputY>
+    simd_t step(TInputX &input_x, TInputY &input_y, simd_t x, simd_t y,
+                size_t index) {
+        RunningComoments<T, stride, window>::step(input_x, input_y, x, y,
+                                                  index);
+        return sc_select(this->count == T(window),
+                         this->comomentXY() / T(window - 1), simd_t(NAN));
+    }
+};
+
+template <typename T, int stride, int window>
+struct FastWindowedCorrelation : RunningComoments<T, stride, window> {
+    using simd_t = kun_simd::vec<T, stride>;
+    template <typename TInputX, typename TInputY>
+    simd_t step(TInputX &input_x, TInputY &input_y, simd_t x, simd_t y,
+                size_t index) {
+        RunningComoments<T, stride, window>::step(input_x, input_y, x, y,
+                                                  index);
+        auto denom = sc_sqrt(this->m2X()) * sc_sqrt(this->m2Y());
+        return sc_select(this->count == T(window), this->comomentXY() / denom,
+                         simd_t(NAN));
+    }
+};
+
 template <typename T, int stride, int window>
 struct WindowedLinearRegression {
     using simd_t = kun_simd::vec<T, stride>;
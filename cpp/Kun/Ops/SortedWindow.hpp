@@ -0,0 +1,106 @@
+#pragma once
+
+#include <Kun/Ops.hpp>
+#include <Kun/Ops/Quantile.hpp>
+#include <algorithm>
+#include <string.h>
+
+namespace kun {
+namespace ops {
+
+// The sorted non-NaN values of a rolling window for each SIMD lane. Each step
+// replaces the value leaving the window by the current value and moves it to
+// its sorted position, instead of sorting or visiting the whole window. The
+// values before the first time step are regarded as NaN
+template <typename T, int stride, int window>
+struct SortedWindow {
+    using simd_t = kun_simd::vec<T, stride>;
+    T sorted[stride][window] = {};
+    // the number of the non-NaN values in the window
+    uint32_t count[stride] = {};
+
+    // Updates the window of a lane. Returns the position of the current value
+    // v in the sorted values, which is after the other values equal to v. -1
+    // if v is NaN
+    int updateLane(int lane, T old, T v) {
+        T *s = sorted[lane];
+        auto &n = count[lane];
+        bool new_valid = !std::isnan(v);
+        if (!std::isnan(old)) {
+            int pos = std::lower_bound(s, s + n, old) - s;
+            if (!new_valid) {
+                memmove(s + pos, s + pos + 1, (n - pos - 1) * sizeof(T));
+                n--;
+                return -1;
+            }
+            if (v >= old) {
+                for (; pos + 1 < int(n) && s[pos + 1] <= v; pos++) {
+                    s[pos] = s[pos + 1];
+                }
+            } else {
+                for (; pos > 0 && s[pos - 1] > v; pos--) {
+                    s[pos] = s[pos - 1];
+                }
+            }
+            s[pos] = v;
+            return pos;
+        }
+        if (!new_valid) {
+            return -1;
+        }
+        int pos = std::upper_bound(s, s + n, v) - s;
+        memmove(s + pos + 1, s + pos, (n - pos) * sizeof(T));
+        s[pos] = v;
+        n++;
+        return pos;
+    }
+};
+
+// The same as ReduceRank in a loop. The output is NaN if the window contains
+// NaN
+template <typename T, int stride, int window>
+struct FastWindowedRank : SortedWindow<T, stride, window> {
+    using simd_t = kun_simd::vec<T, stride>;
+    template <typename TInput>
+    simd_t step(TInput &input, simd_t cur, size_t index) {
+        RequireWindow<TInput>{};
+        alignas(alignof(simd_t)) T out[stride];
+        for (int lane = 0; lane < stride; lane++) {
+            T v = cur.raw[lane];
+            int pos = this->updateLane(
+                lane, input.getWindowLane(index, window, lane), v);
+            if (this->count[lane] < uint32_t(window)) {
+                out[lane] = NAN;
+                continue;
+            }
+            // the number of the values equal to v, including v
+            T *s = this->sorted[lane];
+            int eq = 1;
+            for (; pos - eq >= 0 && s[pos - eq] == v; eq++) {
+            }
+            out[lane] = T(pos - eq + 1) + T(eq + 1) / T(2.0);
+        }
+        return simd_t::load_aligned(out);
+    }
+};
+
+// The same as windowedQuantile. The NaN values are skipped
+template <typename T, int stride, int window>
+struct FastWindowedQuantile : SortedWindow<T, stride, window> {
+    using simd_t = kun_simd::vec<T, stride>;
+    template <typename TInput>
+    simd_t step(TInput &input, simd_t cur, size_t index, T q) {
+        RequireWindow<TInput>{};
+        alignas(alignof(simd_t)) T out[stride];
+        for (int lane = 0; lane < stride; lane++) {
+            this->updateLane(lane, input.getWindowLane(index, window, lane),
+                             cur.raw[lane]);
+            auto n = this->count[lane];
+            out[lane] = n ? quantile::call<T>(this->sorted[lane], n, q) : NAN;
+        }
+        return simd_t::load_aligned(out);
+    }
+};
+
+} // namespace ops
+} // namespace kun
@@ -6,14 +6,273 @@
 #include <Kun/Ops.hpp>
 #include <algorithm>
 #include <cmath>
+#include <cstdint>
+#include <cstring>
+#include <utility>
 #include <vector>
 
 namespace kun {
 namespace ops {
+
+// The unsigned integer key of a floating point number, whose order is the
+// same as the order of the numbers (NaN excluded). -0.0 and 0.0 have the same
+// key
+template <typename T>
+struct RadixKey;
+template <>
+struct RadixKey<float> {
+    using type = uint32_t;
+};
+template <>
+struct RadixKey<double> {
+    using type = uint64_t;
+};
+
+template <typename T>
+typename RadixKey<T>::type toRadixKey(T v) {
+    using K = typename RadixKey<T>::type;
+    K bits;
+    std::memcpy(&bits, &v, sizeof(T));
+    constexpr K sign = K(1) << (sizeof(K) * 8 - 1);
+    if (bits == sign) {
+        // -0.0
+        bits = 0;
+    }
+    return (bits & sign) ? ~bits : (bits | sign);
+}
+
+template <typename K>
+using RankPair = std::pair<K, uint32_t>;
+
+// Sort the (key, stock index) pairs by the LSD radix sort on 8-bit digits.
+// The passes on the digits shared by all keys are skipped. tmp is the scratch
+// buffer of n pairs
+template <typename K>
+void radixSortPairs(RankPair<K> *data, RankPair<K> *tmp, size_t n) {
+    constexpr int num_digits = sizeof(K);
+    size_t count[num_digits][256] = {};
+    for (size_t i = 0; i < n; i++) {
+        for (int d = 0; d < num_digits; d++) {
+            count[d][(data[i].first >> (8 * d)) & 255]++;
+        }
+    }
+    auto *src = data;
+    auto *dst = tmp;
+    for (int d = 0; d < num_digits; d++) {
+        auto &cnt = count[d];
+        if (cnt[(src[0].first >> (8 * d)) & 255] == n) {
+            continue;
+        }
+        size_t offset = 0;
+        for (int i = 0; i < 256; i++) {
+            auto c = cnt[i];
+            cnt[i] = offset;
+            offset += c;
+        }
+        for (size_t i = 0; i < n; i++) {
+            dst[cnt[(src[i].first >> (8 * d)) & 255]++] = src[i];
+        }
+        std::swap(src, dst);
+    }
+    if (src != data) {
+        std::copy(src, src + n, data);
+    }
+}
+
+// the min number of valid stocks to use the radix sort in RankStocks
+constexpr size_t rank_radix_threshold = 256;
+
+// sort the (key, stock index) pairs by the keys
+template <typename K>
+void sortRankPairs(RankPair<K> *data, size_t n, std::vector<RankPair<K>> &tmp) {
+    if (n >= rank_radix_threshold) {
+        tmp.resize(n);
+        radixSortPairs(data, tmp.data(), n);
+    } else {
+        std::sort(data, data + n,
+                  [](const RankPair<K> &a, const RankPair<K> &b) {
+                      return a.first < b.first;
+                  });
+    }
+}
+
+// Write the ranks of the sorted pairs of a time step. The equal values are
+// adjacent after sorting. They share the average of their ranks. base is the
+// number of the valid values less than data[0] and n is the number of all
+// valid values
+template <typename OUTPUT, typename T, typename K>
+void writeRanks(T *output, const RankPair<K> *data, size_t count, size_t base,
+                size_t n, size_t t, size_t __length, size_t num_stocks,
+                size_t simd_len) {
+    for (size_t cur = 0; cur < count;) {
+        size_t next = cur + 1;
+        while (next < count && data[next].first == data[cur].first) {
+            next++;
+        }
+        auto start = base + cur;
+        auto end = base + next;
+        auto sum = (start + end + 1) * (end - start) / 2;
+        T out = T(sum) / T(end - start) / T(n);
+        for (size_t j = cur; j < next; j++) {
+            output[OUTPUT::call(data[j].second, t, __length, num_stocks,
+                                simd_len)] = out;
+        }
+        cur = next;
+    }
+}
+
+// The tasks of RankStocks in the stock-parallel mode. In phase 0, each task
+// sorts the (key, stock index) pairs of its part of stocks in the scratch
+// memory. The NaN values have the max key and are sorted after the valid
+// values. In phase 1, the range of the keys is split by the splitters sampled
+// from the sorted parts. Each task gathers and sorts the keys in its range of
+// all parts, and counts the keys below the range for the ranks. The equal
+// keys are always in the same range
+template <typename INPUT, typename OUTPUT>
+void rankStocksPart(RuntimeStage *stage, size_t task_idx, size_t __total_time,
+                    size_t __start, size_t __length) {
+    auto num_stocks = stage->ctx->stock_count;
+    auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
+    auto in_num_time = inbuf.num_time;
+    auto in_base_time = (in_num_time == __total_time) ? 0 : __start;
+    const auto *input =
+        INPUT::getInput(&inbuf, stage->stage->in_buffers[0], num_stocks);
+    using T = typename std::decay<decltype(*input)>::type;
+    using K = typename RadixKey<T>::type;
+    constexpr K invalid_key = ~K(0);
+    auto outinfo = stage->stage->out_buffers[0];
+    auto &outbuf = stage->ctx->buffers[outinfo->id];
+    auto simd_len = stage->ctx->simd_len;
+    auto num_parts = stage->num_parts;
+    auto time_idx = task_idx / num_parts;
+    auto part = task_idx % num_parts;
+    auto time_stride = stage->time_stride;
+    auto time_end =
+        std::min(__start + (time_idx + 1) * time_stride, __start + __length);
+    auto part_begin = [&](size_t p) { return p * num_stocks / num_parts; };
+    auto key_less = [](const RankPair<K> &a, K key) { return a.first < key; };
+    std::vector<RankPair<K>> data;
+    std::vector<RankPair<K>> tmp;
+    std::vector<K> samples;
+    std::vector<size_t> num_valid(num_parts);
+    if (stage->phase == 0 && task_idx == 0) {
+        // push the output slot in stream mode once
+        OUTPUT::getOutput(&outbuf, outinfo, num_stocks, simd_len);
+    }
+    T *output = stage->phase == 0
+                    ? nullptr
+                    : OUTPUT::getWrittenOutput(&outbuf, outinfo, num_stocks);
+    for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
+        auto row = reinterpret_cast<RankPair<K> *>(stage->scratch.data()) +
+                   (t - __start) * num_stocks;
+        if (stage->phase == 0) {
+            for (size_t i = part_begin(part); i < part_begin(part + 1); i++) {
+                T in = input[INPUT::call(i, t - in_base_time, in_num_time,
+                                         num_stocks, simd_len)];
+                row[i] = {std::isnan(in) ? invalid_key : toRadixKey(in),
+                          uint32_t(i)};
+            }
+            sortRankPairs(row + part_begin(part),
+                          part_begin(part + 1) - part_begin(part), tmp);
+            continue;
+        }
+        // sample num_parts keys from each sorted part
+        size_t n = 0;
+        samples.clear();
+        for (size_t p = 0; p < num_parts; p++) {
+            auto begin = row + part_begin(p);
+            auto end = row + part_begin(p + 1);
+            auto valid =
+                std::lower_bound(begin, end, invalid_key, key_less) - begin;
+            num_valid[p] = valid;
+            n += valid;
+            for (size_t j = 0; valid && j < num_parts; j++) {
+                samples.push_back(begin[j * valid / num_parts].first);
+            }
+        }
+        if (n) {
+            std::sort(samples.begin(), samples.end());
+            auto num_samples = samples.size();
+            K lo_key = part == 0 ? 0 : samples[part * num_samples / num_parts];
+            K hi_key = part + 1 == num_parts
+                           ? invalid_key
+                           : samples[(part + 1) * num_samples / num_parts];
+            // gather the keys in [lo_key, hi_key) of all parts
+            size_t base = 0;
+            data.clear();
+            for (size_t p = 0; p < num_parts; p++) {
+                auto begin = row + part_begin(p);
+                auto end = begin + num_valid[p];
+                auto first = std::lower_bound(begin, end, lo_key, key_less);
+                auto last = std::lower_bound(first, end, hi_key, key_less);
+                base += first - begin;
+                data.insert(data.end(), first, last);
+            }
+            sortRankPairs(data.data(), data.size(), tmp);
+            writeRanks<OUTPUT>(output, data.data(), data.size(), base, n,
+                               t - __start, __length, num_stocks, simd_len);
+        }
+        for (size_t i = part_begin(part) + num_valid[part];
+             i < part_begin(part + 1); i++) {
+            output[OUTPUT::call(row[i].second, t - __start, __length,
+                                num_stocks, simd_len)] = NAN;
+        }
+    }
+}
+
 template <typename INPUT, typename OUTPUT>
 void KUN_TEMPLATE_EXPORT RankStocks(RuntimeStage *stage, size_t time_idx,
                                     size_t __total_time, size_t __start,
                                     size_t __length) {
+    if (stage->num_parts > 1) {
+        rankStocksPart<INPUT, OUTPUT>(stage, time_idx, __total_time, __start,
+                                      __length);
+        return;
+    }
+    auto num_stocks = stage->ctx->stock_count;
+    auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
+    auto in_num_time = inbuf.num_time;
+    auto in_base_time = (in_num_time == __total_time) ? 0 : __start;
+    const auto *input =
+        INPUT::getInput(&inbuf, stage->stage->in_buffers[0], num_stocks);
+    using T = typename std::decay<decltype(*input)>::type;
+    using K = typename RadixKey<T>::type;
+    auto outinfo = stage->stage->out_buffers[0];
+    auto simd_len = stage->ctx->simd_len;
+    T *output = OUTPUT::getOutput(&stage->ctx->buffers[outinfo->id], outinfo,
+                                  num_stocks, simd_len);
+    auto time_stride = stage->time_stride;
+    auto time_end =
+        std::min(__start + (time_idx + 1) * time_stride, __start + __length);
+    // the (key, stock index) pairs of the valid stocks
+    std::vector<RankPair<K>> data;
+    std::vector<RankPair<K>> tmp;
+    data.reserve(num_stocks);
+    for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
+        for (size_t i = 0; i < num_stocks; i++) {
+            T in = input[INPUT::call(i, t - in_base_time, in_num_time,
+                                     num_stocks, simd_len)];
+            if (!std::isnan(in)) {
+                data.emplace_back(toRadixKey(in), uint32_t(i));
+            } else {
+                output[OUTPUT::call(i, t - __start, __length, num_stocks,
+                                    simd_len)] = NAN;
+            }
+        }
+        sortRankPairs(data.data(), data.size(), tmp);
+        writeRanks<OUTPUT>(output, data.data(), data.size(), 0, data.size(),
+                           t - __start, __length, num_stocks, simd_len);
+        data.clear();
+    }
+}
+
+// The rank kernel before RankStocks sorted the (key, stock index) pairs. It
+// sorts the valid values and finds the range of each value by a binary
+// search. It is kept as the baseline of tests/bench_rank.py and is not used
+// by the Rank op
+template <typename INPUT, typename OUTPUT>
+void RankReferenceStocks(RuntimeStage *stage, size_t time_idx,
+                         size_t __total_time, size_t __start, size_t __length) {
     auto num_stocks = stage->ctx->stock_count;
     auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
     auto in_num_time = inbuf.num_time;
@@ -25,13 +284,13 @@ void KUN_TEMPLATE_EXPORT RankStocks(RuntimeStage *stage, size_t time_idx,
     auto simd_len = stage->ctx->simd_len;
     T *output = OUTPUT::getOutput(&stage->ctx->buffers[outinfo->id], outinfo,
                                   num_stocks, simd_len);
+    auto time_stride = stage->time_stride;
     auto time_end =
         std::min(__start + (time_idx + 1) * time_stride, __start + __length);
     std::vector<T> data;
     data.reserve(num_stocks);
     for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
         for (size_t i = 0; i < num_stocks; i++) {
-            auto S = i / simd_len;
             T in = input[INPUT::call(i, t - in_base_time, in_num_time,
                                      num_stocks, simd_len)];
             if (!std::isnan(in)) {
@@ -40,7 +299,6 @@ void KUN_TEMPLATE_EXPORT RankStocks(RuntimeStage *stage, size_t time_idx,
         }
         std::sort(data.begin(), data.end());
         for (size_t i = 0; i < num_stocks; i++) {
-            auto S = i / simd_len;
             T in = input[INPUT::call(i, t - in_base_time, in_num_time,
                                      num_stocks, simd_len)];
             T out;
@@ -50,7 +308,6 @@ void KUN_TEMPLATE_EXPORT RankStocks(RuntimeStage *stage, size_t time_idx,
                 auto end = pos.second - data.begin();
                 auto sum = (start + end + 1) * (end - start) / 2;
                 out = T(sum) / T(end - start) / T(data.size());
-                // out = ((start + end - 1) / T{2.0} + T{1.0}) / data.size();
             } else {
                 out = NAN;
             }
@@ -2,6 +2,7 @@
 
 #include "Context.hpp"
 #include "Module.hpp"
+#include <iosfwd>
 #include <unordered_map>
 #include <string>
 #include <vector>
@@ -12,6 +13,21 @@ KUN_API void runGraph(std::shared_ptr<Executor> exec, const Module *m,
                       size_t num_stocks, size_t total_time, size_t cur_time,
                       size_t length);
 
+// Run the graph in batch mode like runGraph, but walk the time range in chunks
+// of chunk_size time steps, so that the temp buffers only hold
+// O(chunk_size) time steps for long histories. Each chunk is started earlier
+// by the max unreliable count of the outputs to refill the windows of the
+// windowed ops. The results equal those of runGraph up to rounding: the
+// running sums of the ops like FastWindowedSum and FastWindowedStddev are
+// rounded differently when they start from another time step. Throws if an op
+// of the module depends on the whole history like ExpMovingAvg, which cannot
+// be restarted in a chunk. chunk_size = 0 runs the whole range at once
+KUN_API void runGraphChunked(std::shared_ptr<Executor> exec, const Module *m,
+                             std::unordered_map<std::string, float *> &buffers,
+                             size_t num_stocks, size_t total_time,
+                             size_t cur_time, size_t length,
+                             size_t chunk_size);
+
 struct AlignedPtr {
     void* ptr;
 #if CHECKED_PTR
@@ -36,15 +52,77 @@ struct KUN_API StreamContext {
     // query the buffer handle of a named buffer
     size_t queryBufferHandle(const char *name) const;
     // get the current readable position of the named buffer. The returned
-    // buffer length should be num_stocks.
+    // buffer length should be num_stocks. If the dtype of the module is double,
+    // the buffer holds double values
     const float *getCurrentBufferPtr(size_t handle) const;
     // push new data on the named buffer and move forward the internal data
-    // position register.
+    // position register. If the dtype of the module is double, data should
+    // point to double values
     void pushData(size_t handle, const float *data);
+    // get the slot of the next data of the named buffer, for writing the data
+    // in place instead of pushData(). The buffer length should be num_stocks.
+    // The data is pushed after commitData() is called. If the dtype of the
+    // module is double, the buffer holds double values
+    float *getNextBufferPtr(size_t handle);
+    // push the data written in the slot of getNextBufferPtr() and move forward
+    // the internal data position register.
+    void commitData(size_t handle);
     void run();
+    // run num_ticks ticks one after another in one call. It is the same as
+    // pushData(), run() and copying the outputs for each tick, and each tick is
+    // still a separate run of the stages on the executor. It only saves the
+    // per-tick calls and buffer lookups of the caller. The buffers map the
+    // names of all inputs to [num_ticks, num_stocks] arrays to push, and the
+    // names of the outputs to [num_ticks, num_stocks] arrays to fill. The
+    // outputs not in the map are skipped
+    void runTicks(std::unordered_map<std::string, float *> &buffers,
+                  size_t num_ticks);
+    // save the state of the stream, i.e. the windows of all buffers, to a
+    // binary file. It can be loaded by a stream of the same module and the
+    // same number of stocks, to restart without replaying the history
+    void saveState(const char *path) const;
+    void saveState(std::ostream &os) const;
+    // load the state saved by saveState(). The state is unchanged if the data
+    // does not match the module
+    void loadState(const char *path);
+    void loadState(std::istream &is);
     StreamContext(const StreamContext&) = delete;
     StreamContext& operator=(const StreamContext&) = delete;
     ~StreamContext();
+
+  private:
+    // the stock count of the rows in the stream buffers, padded to whole SIMD
+    // vectors
+    size_t padded_stocks;
+    // the size in bytes of the StreamBuffer of the buffer
+    size_t getBufferSize(size_t handle) const;
+};
+
+// A prepared execution of a batch mode module, for running the same module
+// many times with the same shapes, e.g. backtests on rolling windows. The
+// buffer names are resolved, and the runtime stages and temp buffers are
+// created once in the constructor. The temp buffers are kept in an arena during
+// the lifetime of the plan, instead of being allocated and freed in each run.
+// The parameters of the constructor are the same as runGraph
+struct KUN_API Plan {
+    AlignedPtr temp_arena{nullptr, 0};
+    Context ctx;
+    const Module *m;
+    Plan(std::shared_ptr<Executor> exec, const Module *m,
+         std::unordered_map<std::string, float *> &buffers, size_t num_stocks,
+         size_t total_time, size_t cur_time, size_t length);
+    // query the handle of a named input/output buffer
+    size_t queryBufferHandle(const char *name) const;
+    // bind an input/output buffer of the same shape to the handle for the
+    // next runs
+    void setBuffer(size_t handle, float *ptr);
+    // set the start time of the next runs. cur_time + length should not be
+    // greater than total_time
+    void setStart(size_t cur_time);
+    void run();
+    Plan(const Plan &) = delete;
+    Plan &operator=(const Plan &) = delete;
+    ~Plan();
 };
 
 } // namespace kun
\ No newline at end of file
@@ -3,6 +3,7 @@
 #include "RunGraph.hpp"
 #include <algorithm>
 #include <cstdio>
+#include <fstream>
 #include <list>
 #include <stdexcept>
 #include <string.h>
@@ -71,11 +72,14 @@ void checkedDealloc(void *ptr, size_t sz) {
 #endif
 
 namespace kun {
-static const uint64_t VERSION = 0x64100003;
+static const uint64_t VERSION = 0x64100009;
 
-void Buffer::alloc(size_t count, size_t use_count, size_t elem_size) {
+void Buffer::alloc(size_t count, size_t use_count, size_t elem_size,
+                   BufferPool *pool) {
     if (!ptr) {
-        ptr = (float *)kunAlignedAlloc(64, count * elem_size);
+        ptr = (float *)(pool ? pool->alloc(count * elem_size)
+                             : kunAlignedAlloc(64, count * elem_size));
+        this->pool = pool;
         refcount = (int)use_count;
 #if CHECKED_PTR
         size = count * elem_size;
@@ -89,35 +93,176 @@ void Buffer::deref() {
     }
     auto new_cnt = --refcount;
     if (new_cnt == 0) {
-        kunAlignedFree(ptr);
+        if (pool) {
+            pool->dealloc(ptr);
+        } else {
+            kunAlignedFree(ptr);
+        }
         ptr = nullptr;
     }
 }
 
+size_t BufferPool::roundSize(size_t size) {
+    if (size <= 4096) {
+        return (size + 63) / 64 * 64;
+    }
+    size_t pow2 = 4096;
+    while (pow2 * 2 <= size) {
+        pow2 *= 2;
+    }
+    size_t step = pow2 / 4;
+    return (size + step - 1) / step * step;
+}
+
+void *BufferPool::alloc(size_t size) {
+    size = roundSize(size);
+    void *ret = nullptr;
+    {
+        std::lock_guard<std::mutex> guard{lock};
+        auto itr = free_blocks.find(size);
+        if (itr != free_blocks.end() && !itr->second.empty()) {
+            ret = itr->second.back();
+            itr->second.pop_back();
+            stats.cached_bytes -= size;
+            stats.reuse_hits++;
+        } else {
+            stats.allocations++;
+        }
+        stats.in_use_bytes += size;
+        stats.peak_bytes = std::max(stats.peak_bytes, stats.in_use_bytes);
+    }
+    if (!ret) {
+        ret = kunAlignedAlloc(64, size);
+    }
+    std::lock_guard<std::mutex> guard{lock};
+    in_use[ret] = size;
+    return ret;
+}
+
+void BufferPool::dealloc(void *ptr) {
+    std::lock_guard<std::mutex> guard{lock};
+    auto itr = in_use.find(ptr);
+    if (itr == in_use.end()) {
+        throw std::runtime_error("Freeing a block not allocated by the pool");
+    }
+    auto size = itr->second;
+    in_use.erase(itr);
+    free_blocks[size].push_back(ptr);
+    stats.in_use_bytes -= size;
+    stats.cached_bytes += size;
+}
+
+void BufferPool::trim() {
+    std::lock_guard<std::mutex> guard{lock};
+    for (auto &kv : free_blocks) {
+#if CHECKED_PTR
+        size_t size = kv.first;
+#endif
+        for (auto ptr : kv.second) {
+            kunAlignedFree(ptr);
+        }
+    }
+    free_blocks.clear();
+    stats.cached_bytes = 0;
+}
+
+BufferPoolStats BufferPool::getStats() {
+    std::lock_guard<std::mutex> guard{lock};
+    return stats;
+}
+
+BufferPool::~BufferPool() { trim(); }
+
+// a buffer still owned by the Context on destruction, e.g. when a stage of
+// the run throws, is returned to the pool it is allocated from
 Buffer::~Buffer() {
     if (ptr && refcount.load() >= 0) {
-        free(ptr);
+        if (pool) {
+            pool->dealloc(ptr);
+        } else {
+            kunAlignedFree(ptr);
+        }
     }
 }
 
 size_t RuntimeStage::getNumTasks() const {
     return stage->kind == TaskExecKind::SLICE_BY_STOCK
                ? divideAndCeil(ctx->stock_count, ctx->simd_len)
-               : divideAndCeil(ctx->length, time_stride);
+               : divideAndCeil(ctx->length, time_stride) * num_parts;
 }
 
-bool RuntimeStage::doJob() {
+void RuntimeStage::reset(Context *ctx) {
+    pending = stage->orig_pending;
+    doing_index = 0;
+    time_stride = std::max(ctx->executor->time_stride, size_t(1));
+    num_parts = 1;
+    num_phases = 1;
+    phase = 0;
+    if (stage->kind == TaskExecKind::SLICE_BY_TIME) {
+        auto num_time_tasks = divideAndCeil(ctx->length, time_stride);
+        auto num_threads = ctx->executor->numThreads();
+        auto min_stocks = ctx->executor->parallel_cs_min_stocks;
+        if (stage->split_stocks && min_stocks && num_time_tasks < num_threads) {
+            num_parts = std::min(num_threads / num_time_tasks,
+                                 ctx->stock_count / min_stocks);
+            num_parts = std::max(std::min(num_parts, max_parts), size_t(1));
+        }
+        if (num_parts > 1) {
+            num_phases = 2;
+            scratch.resize(ctx->length *
+                           std::max(ctx->stock_count * scratch_per_stock,
+                                    num_parts * scratch_per_part));
+        }
+    }
+    auto num_tasks = getNumTasks();
+    done_count = num_tasks;
+    num_slices = 1;
+    if (stage->kind == TaskExecKind::SLICE_BY_STOCK) {
+        num_slices = std::min(std::min(ctx->executor->numSlices(), max_slices),
+                              num_tasks);
+        num_slices = std::max(num_slices, size_t(1));
+    }
+    for (size_t i = 0; i < num_slices; i++) {
+        slice_index[i] = i * num_tasks / num_slices;
+    }
+}
+
+void RuntimeStage::runTask(size_t idx) {
+    if (stage->kind == TaskExecKind::SLICE_BY_STOCK) {
+        stage->f.f(ctx, idx, ctx->total_time, ctx->start, ctx->length);
+    } else {
+        stage->f.rankf(this, idx, ctx->total_time, ctx->start, ctx->length);
+    }
+}
+
+bool RuntimeStage::doJob(size_t slice_hint) {
+    if (num_slices > 1) {
+        // take the tasks of the slice of the current node first, and then
+        // help the other nodes. doing_index counts the claimed tasks of all
+        // slices for hasJobToDo()
+        for (size_t i = 0; i < num_slices; i++) {
+            size_t slice = (slice_hint + i) % num_slices;
+            auto &index = slice_index[slice];
+            auto end = sliceEnd(slice);
+            auto cur_idx = index.load();
+            while (cur_idx < end) {
+                if (index.compare_exchange_strong(cur_idx, cur_idx + 1)) {
+                    ++doing_index;
+                    runTask(cur_idx);
+                    if (!onDone(1)) {
+                        return false;
+                    }
+                    cur_idx = index.load();
+                }
+            }
+        }
+        return false;
+    }
     auto cur_idx = doing_index.load();
     auto num_tasks = getNumTasks();
     while (cur_idx < num_tasks) {
         if (doing_index.compare_exchange_strong(cur_idx, cur_idx + 1)) {
-            if (stage->kind == TaskExecKind::SLICE_BY_STOCK) {
-                stage->f.f(ctx, cur_idx, ctx->total_time, ctx->start,
-                           ctx->length);
-            } else {
-                stage->f.rankf(this, cur_idx, ctx->total_time, ctx->start,
-                               ctx->length);
-            }
+            runTask(cur_idx);
             if (!onDone(1)) {
                 return false;
             }
@@ -138,14 +283,32 @@ void RuntimeStage::enqueue() {
     for (size_t i = 0; i < stage->num_out_buffers; i++) {
         auto buf_id = stage->out_buffers[i];
         ctx->buffers[buf_id->id].alloc(ctx->buffer_len,
-                                       stage->out_buffers[i]->num_users, sz);
+                                       stage->out_buffers[i]->num_users, sz,
+                                       ctx->executor->buffer_pool.get());
     }
     ctx->executor->enqueue(this);
 }
 
+bool RuntimeStage::nextPhase() {
+    phase++;
+    // the extra count keeps the stage from being done by other threads before
+    // it is enqueued for the new phase
+    done_count = getNumTasks() + 1;
+    doing_index = 0;
+    // the executors may drop the entries of the stages without tasks to claim.
+    // Enqueue the stage again for the tasks of the new phase and remove the
+    // entry of the last phase
+    ctx->executor->enqueue(this);
+    ctx->executor->dequeue(this);
+    return onDone(1);
+}
+
 bool RuntimeStage::onDone(size_t cnt) {
     auto newdone = --done_count;
     if (newdone == 0) {
+        if (phase + 1 < num_phases) {
+            return nextPhase();
+        }
         // current stage is done
         for (size_t i = 0; i < stage->num_dependers; i++) {
             auto id = stage->dependers[i]->id;
@@ -165,10 +328,11 @@ bool RuntimeStage::onDone(size_t cnt) {
     return true;
 }
 
-void runGraph(std::shared_ptr<Executor> exec, const Module *m,
-              std::unordered_map<std::string, float *> &buffers,
-              size_t num_stocks, size_t total_time, size_t cur_time,
-              size_t length) {
+static Context
+makeBatchContext(std::shared_ptr<Executor> exec, const Module *m,
+                 std::unordered_map<std::string, float *> &buffers,
+                 size_t num_stocks, size_t total_time, size_t cur_time,
+                 size_t length) {
     if (m->required_version != VERSION) {
         throw std::runtime_error("The required version in the module does not "
                                  "match the runtime version");
@@ -192,30 +356,197 @@ void runGraph(std::shared_ptr<Executor> exec, const Module *m,
             rtlbuffers.emplace_back(length);
         }
     }
-    Context ctx{std::move(rtlbuffers),
-                {},
-                exec,
-                divideAndCeil(num_stocks, m->blocking_len) * m->blocking_len * length,
-                num_stocks,
-                total_time,
-                cur_time,
-                length,
-                m->blocking_len,
-                m->dtype,
-                false};
+    return Context{std::move(rtlbuffers),
+                   {},
+                   exec,
+                   divideAndCeil(num_stocks, m->blocking_len) *
+                       m->blocking_len * length,
+                   num_stocks,
+                   total_time,
+                   cur_time,
+                   length,
+                   m->blocking_len,
+                   m->dtype,
+                   false};
+}
+
+static void createStages(Context &ctx, const Module *m) {
     std::vector<RuntimeStage> &stages = ctx.stages;
+    stages.clear();
     stages.reserve(m->num_stages);
     for (size_t i = 0; i < m->num_stages; i++) {
         auto &stage = m->stages[i];
         stages.emplace_back(&stage, &ctx);
     }
+}
+
+static void runStages(Context &ctx, const Module *m) {
     for (size_t i = 0; i < m->num_stages; i++) {
         auto &stage = m->stages[i];
         if (stage.orig_pending == 0) {
-            stages[i].enqueue();
+            ctx.stages[i].enqueue();
+        }
+    }
+    ctx.executor->runUntilDone();
+}
+
+// the size of a temp buffer in the arena, aligned to 64 bytes
+static size_t getTempSlotSize(const Context &ctx) {
+    return divideAndCeil(ctx.buffer_len * getSizeofDtype(ctx.dtype), 64) * 64;
+}
+
+// the number of slots in the arena of the temp buffers. Without a memory plan
+// of the compiler, each temp buffer has its own slot
+static size_t getNumTempSlots(const Module *m) {
+    if (m->num_temp_slots) {
+        return m->num_temp_slots;
+    }
+    size_t ret = 0;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        if (m->buffers[i].kind == BufferKind::TEMP) {
+            ret++;
+        }
+    }
+    return ret;
+}
+
+// bind the temp buffers to their slots in the arena
+static void bindTempArena(Context &ctx, const Module *m, char *arena) {
+    size_t slot_size = getTempSlotSize(ctx);
+    size_t idx = 0;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        auto &buf = m->buffers[i];
+        if (buf.kind == BufferKind::TEMP) {
+            size_t slot = m->num_temp_slots ? buf.temp_slot : idx;
+            idx++;
+            ctx.buffers[i].raw = arena + slot * slot_size;
+            // a negative refcount marks the buffer not owned by the Context.
+            // It is neither allocated nor freed by the stages
+            ctx.buffers[i].refcount = -1000;
+        }
+    }
+}
+
+void runGraph(std::shared_ptr<Executor> exec, const Module *m,
+              std::unordered_map<std::string, float *> &buffers,
+              size_t num_stocks, size_t total_time, size_t cur_time,
+              size_t length) {
+    Context ctx = makeBatchContext(exec, m, buffers, num_stocks, total_time,
+                                   cur_time, length);
+    // with a memory plan, allocate all temp buffers at once. Otherwise, they
+    // are allocated and freed by the stages, to keep the peak memory low
+    char *arena = nullptr;
+    auto pool = exec->buffer_pool.get();
+    size_t size = m->num_temp_slots * getTempSlotSize(ctx);
+    if (size) {
+        arena = (char *)(pool ? pool->alloc(size) : kunAlignedAlloc(64, size));
+        bindTempArena(ctx, m, arena);
+    }
+    auto free_arena = [&]() {
+        if (!arena) {
+            return;
+        }
+        if (pool) {
+            pool->dealloc(arena);
+        } else {
+            kunAlignedFree(arena);
+        }
+    };
+    try {
+        createStages(ctx, m);
+        runStages(ctx, m);
+    } catch (...) {
+        free_arena();
+        throw;
+    }
+    free_arena();
+}
+
+void runGraphChunked(std::shared_ptr<Executor> exec, const Module *m,
+                     std::unordered_map<std::string, float *> &buffers,
+                     size_t num_stocks, size_t total_time, size_t cur_time,
+                     size_t length, size_t chunk_size) {
+    if (chunk_size == 0 || chunk_size >= length) {
+        runGraph(exec, m, buffers, num_stocks, total_time, cur_time, length);
+        return;
+    }
+    if (m->unbounded_window) {
+        throw std::runtime_error("Cannot run the module in time chunks, "
+                                 "because an op depends on the whole history, "
+                                 "e.g. ExpMovingAvg");
+    }
+    // the windowed ops of a run start from empty windows. Each chunk starts
+    // earlier by the max unreliable count of the outputs to fill the windows
+    size_t warmup = 0;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        auto &buf = m->buffers[i];
+        if (buf.kind == BufferKind::OUTPUT) {
+            warmup = std::max(warmup, (size_t)buf.unreliable_count);
+        }
+    }
+    std::unordered_map<std::string, float *> chunk_buffers = buffers;
+    std::vector<std::pair<const char *, char *>> outputs;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        auto &buf = m->buffers[i];
+        if (buf.kind == BufferKind::OUTPUT) {
+            auto itr = buffers.find(buf.name);
+            if (itr == buffers.end()) {
+                throw std::runtime_error("Buffer name not found: " +
+                                         std::string(buf.name));
+            }
+            outputs.emplace_back(buf.name, (char *)itr->second);
+        }
+    }
+    size_t elem_size = getSizeofDtype(m->dtype);
+    size_t num_chunks = divideAndCeil(length, chunk_size);
+    if (m->output_layout == MemoryLayout::TS) {
+        // the time steps of an output are contiguous in TS layout, so a chunk
+        // writes to the outputs in place. The chunks are run backwards: the
+        // warmup steps of a chunk are written in the range of the previous
+        // chunks, which are overwritten by the correct results later
+        for (size_t i = num_chunks; i-- > 0;) {
+            size_t begin = i * chunk_size;
+            size_t end = std::min(begin + chunk_size, length);
+            size_t run_begin = begin > warmup ? begin - warmup : 0;
+            for (auto &out : outputs) {
+                chunk_buffers[out.first] =
+                    (float *)(out.second + run_begin * num_stocks * elem_size);
+            }
+            runGraph(exec, m, chunk_buffers, num_stocks, total_time,
+                     cur_time + run_begin, end - run_begin);
+        }
+        return;
+    }
+    // in STs layout, the time dimension of an output is the length of the run.
+    // Each chunk is computed in a scratch buffer and copied to the output
+    size_t simd_len = m->blocking_len;
+    size_t num_blocks = divideAndCeil(num_stocks, simd_len);
+    size_t max_run_len = std::min(chunk_size + warmup, length);
+    size_t scratch_size = num_blocks * max_run_len * simd_len * elem_size;
+    std::vector<AlignedPtr> scratches;
+    scratches.reserve(outputs.size());
+    for (auto &out : outputs) {
+        scratches.emplace_back(kunAlignedAlloc(64, scratch_size), scratch_size);
+        chunk_buffers[out.first] = (float *)scratches.back().get();
+    }
+    size_t block_bytes = simd_len * elem_size;
+    for (size_t i = 0; i < num_chunks; i++) {
+        size_t begin = i * chunk_size;
+        size_t end = std::min(begin + chunk_size, length);
+        size_t run_begin = begin > warmup ? begin - warmup : 0;
+        size_t run_len = end - run_begin;
+        runGraph(exec, m, chunk_buffers, num_stocks, total_time,
+                 cur_time + run_begin, run_len);
+        for (size_t j = 0; j < outputs.size(); j++) {
+            char *src = scratches[j].get();
+            char *dst = outputs[j].second;
+            for (size_t b = 0; b < num_blocks; b++) {
+                memcpy(dst + (b * length + begin) * block_bytes,
+                       src + (b * run_len + begin - run_begin) * block_bytes,
+                       (end - begin) * block_bytes);
+            }
         }
     }
-    exec->runUntilDone();
 }
 
 AlignedPtr::AlignedPtr(void *ptr, size_t size) noexcept {
@@ -261,7 +592,7 @@ char *StreamBuffer<T>::make(size_t stock_count, size_t window_size,
         64, StreamBuffer::getBufferSize(stock_count, window_size, simd_len));
     auto buf = (StreamBuffer *)ret;
     for (size_t i = 0; i < stock_count * window_size; i++) {
-        buf->getBuffer()[i] = NAN;
+        buf->getBuffer()[i] = T(NAN);
     }
     for (size_t i = 0; i < stock_count / simd_len; i++) {
         *buf->getPos(i, stock_count, window_size) = 0;
@@ -274,7 +605,8 @@ template struct StreamBuffer<double>;
 
 StreamContext::StreamContext(std::shared_ptr<Executor> exec, const Module *m,
                              size_t num_stocks)
-    : m{m} {
+    : m{m}, padded_stocks{StreamBuffer<float>::getPaddedStockCount(
+                num_stocks, m->blocking_len)} {
     if (m->required_version != VERSION) {
         throw std::runtime_error("The required version in the module does not "
                                  "match the runtime version");
@@ -283,19 +615,28 @@ StreamContext::StreamContext(std::shared_ptr<Executor> exec, const Module *m,
         throw std::runtime_error(
             "Cannot run batch mode module via StreamContext");
     }
-    if (m->dtype != Datatype::Float) {
-        throw std::runtime_error(
-            "Stream mode currently does not support double type yet");
+    if (m->aligned && num_stocks % m->blocking_len) {
+        throw std::runtime_error("num_stocks must be a multiple of the "
+                                 "blocking_len of an aligned module");
     }
     std::vector<Buffer> rtlbuffers;
     rtlbuffers.reserve(m->num_buffers);
     buffers.reserve(m->num_buffers);
     for (size_t i = 0; i < m->num_buffers; i++) {
         auto &buf = m->buffers[i];
-        buffers.emplace_back(
-            StreamBuffer<float>::make(num_stocks, buf.window, m->blocking_len),
-            StreamBuffer<float>::getBufferSize(num_stocks, buf.window,
-                                               m->blocking_len));
+        if (m->dtype == Datatype::Float) {
+            buffers.emplace_back(
+                StreamBuffer<float>::make(padded_stocks, buf.window,
+                                          m->blocking_len),
+                StreamBuffer<float>::getBufferSize(padded_stocks, buf.window,
+                                                   m->blocking_len));
+        } else {
+            buffers.emplace_back(
+                StreamBuffer<double>::make(padded_stocks, buf.window,
+                                           m->blocking_len),
+                StreamBuffer<double>::getBufferSize(padded_stocks, buf.window,
+                                                    m->blocking_len));
+        }
         rtlbuffers.emplace_back((float *)buffers.back().get(), 1);
     }
     ctx.buffers = std::move(rtlbuffers);
@@ -308,6 +649,7 @@ StreamContext::StreamContext(std::shared_ptr<Executor> exec, const Module *m,
     ctx.dtype = m->dtype;
     ctx.is_stream = true;
     ctx.simd_len = m->blocking_len;
+    createStages(ctx, m);
 }
 
 size_t StreamContext::queryBufferHandle(const char *name) const {
@@ -321,33 +663,264 @@ size_t StreamContext::queryBufferHandle(const char *name) const {
 }
 
 const float *StreamContext::getCurrentBufferPtr(size_t handle) const {
+    if (m->dtype == Datatype::Double) {
+        auto buf = (StreamBuffer<double> *)buffers.at(handle).get();
+        return (const float *)buf->getCurrentBufferPtr(
+            padded_stocks, m->buffers[handle].window);
+    }
     auto buf = (StreamBuffer<float> *)buffers.at(handle).get();
-    return buf->getCurrentBufferPtr(ctx.stock_count, m->buffers[handle].window);
+    return buf->getCurrentBufferPtr(padded_stocks, m->buffers[handle].window);
 }
 
-void StreamContext::pushData(size_t handle, const float *data) {
+float *StreamContext::getNextBufferPtr(size_t handle) {
+    if (m->dtype == Datatype::Double) {
+        auto buf = (StreamBuffer<double> *)buffers.at(handle).get();
+        return (float *)buf->getNextBufferPtr(padded_stocks,
+                                              m->buffers[handle].window);
+    }
     auto buf = (StreamBuffer<float> *)buffers.at(handle).get();
-    float *ptr = buf->pushData(ctx.stock_count, m->buffers[handle].window,
-                               m->blocking_len);
-    memcpy(ptr, data, ctx.stock_count * sizeof(float));
+    return buf->getNextBufferPtr(padded_stocks, m->buffers[handle].window);
+}
+
+void StreamContext::commitData(size_t handle) {
+    if (m->dtype == Datatype::Double) {
+        auto buf = (StreamBuffer<double> *)buffers.at(handle).get();
+        buf->commit(padded_stocks, m->buffers[handle].window, m->blocking_len);
+    } else {
+        auto buf = (StreamBuffer<float> *)buffers.at(handle).get();
+        buf->commit(padded_stocks, m->buffers[handle].window, m->blocking_len);
+    }
+}
+
+void StreamContext::pushData(size_t handle, const float *data) {
+    memcpy(getNextBufferPtr(handle), data,
+           ctx.stock_count * getSizeofDtype(m->dtype));
+    commitData(handle);
 }
 
 void StreamContext::run() {
-    std::vector<RuntimeStage> &stages = ctx.stages;
-    stages.clear();
-    stages.reserve(m->num_stages);
-    for (size_t i = 0; i < m->num_stages; i++) {
-        auto &stage = m->stages[i];
-        stages.emplace_back(&stage, &ctx);
+    for (auto &stage : ctx.stages) {
+        stage.reset(&ctx);
     }
-    for (size_t i = 0; i < m->num_stages; i++) {
-        auto &stage = m->stages[i];
-        if (stage.orig_pending == 0) {
-            stages[i].enqueue();
+    runStages(ctx, m);
+}
+
+void StreamContext::runTicks(std::unordered_map<std::string, float *> &buffers,
+                             size_t num_ticks) {
+    std::vector<std::pair<size_t, const char *>> inputs;
+    std::vector<std::pair<size_t, char *>> outputs;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        auto &buf = m->buffers[i];
+        if (buf.kind == BufferKind::TEMP) {
+            continue;
+        }
+        auto itr = buffers.find(buf.name);
+        if (itr != buffers.end()) {
+            if (buf.kind == BufferKind::INPUT) {
+                inputs.emplace_back(i, (const char *)itr->second);
+            } else {
+                outputs.emplace_back(i, (char *)itr->second);
+            }
+        } else if (buf.kind == BufferKind::INPUT) {
+            throw std::runtime_error("Buffer name not found: " +
+                                     std::string(buf.name));
         }
     }
-    ctx.executor->runUntilDone();
+    size_t row_size = ctx.stock_count * getSizeofDtype(m->dtype);
+    for (size_t t = 0; t < num_ticks; t++) {
+        for (auto &in : inputs) {
+            pushData(in.first, (const float *)(in.second + t * row_size));
+        }
+        run();
+        for (auto &out : outputs) {
+            memcpy(out.second + t * row_size, getCurrentBufferPtr(out.first),
+                   row_size);
+        }
+    }
+}
+
+namespace {
+// The header of the stream state file. It is followed by the window and the
+// size in bytes of each buffer (2 uint64_t each), and then the images of the
+// buffers. The header and each image are padded to 64 bytes, so that the
+// images in a mapped file are aligned like the buffers of the StreamContext.
+// The integers are in the native byte order
+struct StreamStateHeader {
+    char magic[8];
+    uint64_t version;
+    uint64_t dtype;
+    uint64_t num_stocks;
+    uint64_t blocking_len;
+    uint64_t num_buffers;
+    // FNV-1a hash of the buffer names, to detect the state of another module
+    uint64_t names_hash;
+};
+} // namespace
+
+static const char stream_state_magic[8] = {'K', 'U', 'N', 'S',
+                                           'T', 'A', 'T', 'E'};
+
+static size_t alignTo64(size_t v) { return divideAndCeil(v, 64) * 64; }
+
+static StreamStateHeader makeStreamStateHeader(const Module *m,
+                                               size_t num_stocks) {
+    StreamStateHeader ret;
+    memcpy(ret.magic, stream_state_magic, sizeof(ret.magic));
+    ret.version = VERSION;
+    ret.dtype = (uint64_t)m->dtype;
+    ret.num_stocks = num_stocks;
+    ret.blocking_len = m->blocking_len;
+    ret.num_buffers = m->num_buffers;
+    uint64_t hash = 14695981039346656037ull;
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        // include the terminating zero as the separator
+        for (const char *p = m->buffers[i].name;; p++) {
+            hash = (hash ^ (unsigned char)*p) * 1099511628211ull;
+            if (!*p) {
+                break;
+            }
+        }
+    }
+    ret.names_hash = hash;
+    return ret;
+}
+
+size_t StreamContext::getBufferSize(size_t handle) const {
+    auto &buf = m->buffers[handle];
+    if (m->dtype == Datatype::Double) {
+        return StreamBuffer<double>::getBufferSize(padded_stocks, buf.window,
+                                                   m->blocking_len);
+    }
+    return StreamBuffer<float>::getBufferSize(padded_stocks, buf.window,
+                                              m->blocking_len);
+}
+
+void StreamContext::saveState(std::ostream &os) const {
+    static const char padding[64] = {0};
+    auto header = makeStreamStateHeader(m, ctx.stock_count);
+    os.write((const char *)&header, sizeof(header));
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        uint64_t entry[2] = {m->buffers[i].window, getBufferSize(i)};
+        os.write((const char *)entry, sizeof(entry));
+    }
+    size_t offset = sizeof(header) + m->num_buffers * sizeof(uint64_t) * 2;
+    os.write(padding, alignTo64(offset) - offset);
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        size_t size = getBufferSize(i);
+        os.write(buffers[i].get(), size);
+        os.write(padding, alignTo64(size) - size);
+    }
+    if (!os) {
+        throw std::runtime_error("Failed to write the stream state");
+    }
+}
+
+void StreamContext::loadState(std::istream &is) {
+    StreamStateHeader header;
+    auto expected = makeStreamStateHeader(m, ctx.stock_count);
+    if (!is.read((char *)&header, sizeof(header)) ||
+        memcmp(header.magic, expected.magic, sizeof(header.magic))) {
+        throw std::runtime_error("Bad stream state file");
+    }
+    if (header.version != expected.version || header.dtype != expected.dtype ||
+        header.num_stocks != expected.num_stocks ||
+        header.blocking_len != expected.blocking_len ||
+        header.num_buffers != expected.num_buffers ||
+        header.names_hash != expected.names_hash) {
+        throw std::runtime_error(
+            "The stream state does not match the module or the stock count");
+    }
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        uint64_t entry[2];
+        if (!is.read((char *)entry, sizeof(entry)) ||
+            entry[0] != m->buffers[i].window || entry[1] != getBufferSize(i)) {
+            throw std::runtime_error(
+                "The stream state does not match the module windows");
+        }
+    }
+    size_t offset = sizeof(header) + m->num_buffers * sizeof(uint64_t) * 2;
+    is.ignore(alignTo64(offset) - offset);
+    // read into a copy first, to keep the state unchanged on failure
+    std::vector<std::vector<char>> images(m->num_buffers);
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        size_t size = getBufferSize(i);
+        images[i].resize(size);
+        if (!is.read(images[i].data(), size)) {
+            throw std::runtime_error("The stream state file is truncated");
+        }
+        is.ignore(alignTo64(size) - size);
+    }
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        memcpy(buffers[i].get(), images[i].data(), images[i].size());
+    }
+}
+
+void StreamContext::saveState(const char *path) const {
+    std::ofstream os{path, std::ios::binary | std::ios::trunc};
+    if (!os) {
+        throw std::runtime_error("Cannot open the file: " + std::string(path));
+    }
+    saveState(os);
+}
+
+void StreamContext::loadState(const char *path) {
+    std::ifstream is{path, std::ios::binary};
+    if (!is) {
+        throw std::runtime_error("Cannot open the file: " + std::string(path));
+    }
+    loadState(is);
 }
 
 StreamContext::~StreamContext() = default;
+
+Plan::Plan(std::shared_ptr<Executor> exec, const Module *m,
+           std::unordered_map<std::string, float *> &buffers, size_t num_stocks,
+           size_t total_time, size_t cur_time, size_t length)
+    : ctx{makeBatchContext(exec, m, buffers, num_stocks, total_time, cur_time,
+                           length)},
+      m{m} {
+    if (cur_time + length > total_time) {
+        throw std::runtime_error("Bad time range of the plan");
+    }
+    size_t size = getNumTempSlots(m) * getTempSlotSize(ctx);
+    if (size) {
+        temp_arena = AlignedPtr{kunAlignedAlloc(64, size), size};
+        bindTempArena(ctx, m, temp_arena.get());
+    }
+    createStages(ctx, m);
+}
+
+size_t Plan::queryBufferHandle(const char *name) const {
+    for (size_t i = 0; i < m->num_buffers; i++) {
+        auto &buf = m->buffers[i];
+        if (buf.kind != BufferKind::TEMP && !strcmp(buf.name, name)) {
+            return i;
+        }
+    }
+    throw std::runtime_error("Cannot find the buffer name");
+}
+
+void Plan::setBuffer(size_t handle, float *ptr) {
+    if (handle >= m->num_buffers ||
+        m->buffers[handle].kind == BufferKind::TEMP) {
+        throw std::runtime_error("Bad buffer handle");
+    }
+    ctx.buffers[handle].ptr = ptr;
+}
+
+void Plan::setStart(size_t cur_time) {
+    if (cur_time + ctx.length > ctx.total_time) {
+        throw std::runtime_error("Bad start time of the plan");
+    }
+    ctx.start = cur_time;
+}
+
+void Plan::run() {
+    for (auto &stage : ctx.stages) {
+        stage.reset(&ctx);
+    }
+    runStages(ctx, m);
+}
+
+Plan::~Plan() = default;
 } // namespace kun
@@ -1,50 +1,44 @@
 #pragma once
 
-#include <Kun/Context.hpp>
-#include <Kun/LayoutMappers.hpp>
-#include <Kun/Module.hpp>
-#include <Kun/Ops.hpp>
-#include <algorithm>
-#include <cmath>
-#include <vector>
+#include <Kun/CrossSectional.hpp>
 
 namespace kun {
 namespace ops {
 
+// The sums of the absolute values of the valid stocks
+template <typename T, size_t lanes>
+struct ScaleKernel {
+    using simd_t = kun_simd::vec<T, lanes>;
+    using Stats = T;
+    template <typename IN>
+    Stats reduce(const IN &in, size_t begin, size_t end) const {
+        simd_t sum = 0;
+        for (size_t b = begin; b < end; b++) {
+            auto v = in.load(b);
+            sum = sum + kun_simd::sc_select(kun_simd::sc_isnan(v), simd_t(0),
+                                            kun_simd::sc_abs(v));
+        }
+        return horizontalSum(sum);
+    }
+    static void merge(Stats &a, const Stats &b) { a += b; }
+    template <typename IN, typename OUT>
+    void map(const IN &in, const OUT &out, size_t begin, size_t end,
+             const Stats &sum) const {
+        // all outputs are NaN if the sum is 0, since 0 / 0 is NaN
+        simd_t vsum = sum;
+        for (size_t b = begin; b < end; b++) {
+            out.store(b, in.load(b) / vsum);
+        }
+    }
+};
+
 template <typename INPUT, typename OUTPUT>
 KUN_TEMPLATE_EXPORT void ScaleStocks(RuntimeStage *stage, size_t time_idx,
                                      size_t __total_time, size_t __start,
                                      size_t __length) {
-    auto num_stocks = stage->ctx->stock_count;
-    auto &inbuf = stage->ctx->buffers[stage->stage->in_buffers[0]->id];
-    auto in_num_time = inbuf.num_time;
-    auto in_base_time = (in_num_time == __total_time) ? 0 : __start;
-    const auto *input =
-        INPUT::getInput(&inbuf, stage->stage->in_buffers[0], num_stocks);
-    using T = typename std::decay<decltype(*input)>::type;
-    auto outinfo = stage->stage->out_buffers[0];
-    auto simd_len = stage->ctx->simd_len;
-    T *output = OUTPUT::getOutput(&stage->ctx->buffers[outinfo->id], outinfo,
-                                  num_stocks, simd_len);
-    auto time_end =
-        std::min(__start + (time_idx + 1) * time_stride, __start + __length);
-    for (size_t t = __start + time_idx * time_stride; t < time_end; t++) {
-        T sum = 0;
-        for (size_t i = 0; i < num_stocks; i++) {
-            T in = input[INPUT::call(i, t - in_base_time, in_num_time,
-                                     num_stocks, simd_len)];
-            if (!std::isnan(in)) {
-                sum += std::abs(in);
-            }
-        }
-        for (size_t i = 0; i < num_stocks; i++) {
-            T in = input[INPUT::call(i, t - in_base_time, in_num_time,
-                                     num_stocks, simd_len)];
-            T out = (in == 0 && sum == 0) ? NAN : (in / sum);
-            output[OUTPUT::call(i, t - __start, __length, num_stocks,
-                                simd_len)] = out;
-        }
-    }
+    crossSectionalStocks<INPUT, OUTPUT>(
+        stage, time_idx, __total_time, __start, __length,
+        ScaleKernel<typename INPUT::value_type, INPUT::lanes>{});
 }
 
 extern template void ScaleStocks<MapperSTs<float, 8>, MapperSTs<float, 8>>(
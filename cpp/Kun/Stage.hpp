@@ -31,6 +31,9 @@ struct BufferInfo {
     uint32_t unreliable_count;
     // the max window size of the ops depending on this buffer
     uint32_t window;
+    // the index of the slot in the arena of the temp buffers, if the module
+    // has a memory plan
+    uint32_t temp_slot;
 };
 
 enum class TaskExecKind {
@@ -64,6 +67,12 @@ struct Stage {
     size_t orig_pending;
     TaskExecKind kind;
     size_t id;
+    // the estimated cost of the longest path from this stage to the end of
+    // the graph. The executors prefer the ready stages of higher priority
+    size_t priority;
+    // if the stocks of a SLICE_BY_TIME stage can be split into parts for a
+    // short run, see RuntimeStage::num_parts
+    bool split_stocks;
     // Stage(FuncType f, Stage **dependers, size_t num_dependers,
     //       size_t *in_buffers, size_t num_in_buffers, size_t *out_buffers,
     //       size_t num_out_buffers, size_t orig_pending)
@@ -5,14 +5,14 @@
 namespace kun {
 template<typename T>
 struct StreamBuffer {
-    // [#stock_count of float data]
-    // [#stock_count of float data]
+    // [#stock_count of T data]
+    // [#stock_count of T data]
     //   ... total window_size rows
-    // [#stock_count of float data]
+    // [#stock_count of T data]
     // [stock_count/simd_len of Buffer positions (size_t)]
 
     alignas(32) char buf[0];
-    float *getBuffer() const { return (float *)(buf); }
+    T *getBuffer() const { return (T *)(buf); }
     size_t *getPos(size_t idx, size_t stock_count, size_t window_size) const {
         return (size_t *)(buf + sizeof(T) * stock_count * window_size +
                           idx * sizeof(size_t));
@@ -22,24 +22,39 @@ struct StreamBuffer {
         return sizeof(T) * stock_count * window_size +
                stock_count / simd_len * sizeof(size_t);
     }
+    // the stock count of a row in the buffer. The rows are padded to whole
+    // SIMD vectors, so that the tail of an unaligned stock count can be loaded
+    // and stored without masks. All stock_count parameters of the functions
+    // of StreamBuffer are the padded counts
+    static size_t getPaddedStockCount(size_t num_stock, size_t simd_len) {
+        return (num_stock + simd_len - 1) / simd_len * simd_len;
+    }
     static char *make(size_t stock_count, size_t window_size, size_t simd_len);
-    const float *getCurrentBufferPtr(size_t stock_count,
-                                     size_t window_size) const {
+    const T *getCurrentBufferPtr(size_t stock_count, size_t window_size) const {
         size_t pos = *getPos(0, stock_count, window_size);
         size_t offset = 1;
         auto idx =
             pos >= offset ? (pos - offset) : (pos + window_size - offset);
         return getBuffer() + idx * stock_count;
     }
-    float *pushData(size_t stock_count, size_t window_size, size_t simd_len) {
+    // the slot of the next data to push
+    T *getNextBufferPtr(size_t stock_count, size_t window_size) const {
+        size_t pos = *getPos(0, stock_count, window_size);
+        return getBuffer() + pos * stock_count;
+    }
+    // move forward the position after the next slot is written
+    void commit(size_t stock_count, size_t window_size, size_t simd_len) {
         size_t pos = *getPos(0, stock_count, window_size);
-        auto ret = getBuffer() + pos * stock_count;
         pos += 1;
         pos = (pos >= window_size) ? 0 : pos;
         size_t *posbase = getPos(0, stock_count, window_size);
         for (int i = 0; i < stock_count / simd_len; i++) {
             posbase[i] = pos;
         }
+    }
+    T *pushData(size_t stock_count, size_t window_size, size_t simd_len) {
+        auto ret = getNextBufferPtr(stock_count, window_size);
+        commit(stock_count, window_size, simd_len);
         return ret;
     }
 };
@@ -47,13 +47,226 @@ static void expectContiguousShape(kun::Datatype dtype,
     }
 }
 
+// the input and output buffers of runGraph, checked against the module
+struct BatchBuffers {
+    std::unordered_map<std::string, float *> bufs;
+    // the output arrays
+    py::dict outputs;
+    py::ssize_t num_stocks;
+    py::ssize_t total_time;
+};
+
+static BatchBuffers prepareBatchBuffers(const kun::Module *mod,
+                                        const py::dict inputs, size_t length,
+                                        const py::object outputs,
+                                        bool skip_check,
+                                        py::ssize_t num_stocks) {
+    std::unordered_map<std::string, float *> bufs;
+    py::ssize_t known_S = 0;
+    py::ssize_t known_T = 0;
+    py::ssize_t knownNumStocks = 0;
+    py::ssize_t simd_len = mod->blocking_len;
+    for (auto kv : inputs) {
+        auto name = py::cast<std::string>(kv.first);
+        auto buf_obj = py::cast<py::buffer>(kv.second);
+        auto info = buf_obj.request();
+        bufs[name] = (float *)info.ptr;
+        if (skip_check) {
+            if (known_S == 0) {
+                if (mod->input_layout == kun::MemoryLayout::STs) {
+                    auto S = info.shape[0];
+                    auto T = info.shape[1];
+                    known_S = S;
+                    known_T = T;
+                } else if (mod->input_layout == kun::MemoryLayout::TS) {
+                    auto S = info.shape[1];
+                    auto T = info.shape[0];
+                    known_S = S / simd_len;
+                    known_T = T;
+                }
+            }
+            continue;
+        }
+        if (mod->dtype == kun::Datatype::Float) {
+            if (info.format != py::format_descriptor<float>::format())
+                throw std::runtime_error("Expecting float buffer at " + name);
+        } else if (info.format != py::format_descriptor<double>::format()) {
+            throw std::runtime_error("Expecting double buffer at " + name);
+        }
+        if (mod->input_layout == kun::MemoryLayout::STs) {
+            // ST8t layout
+            if (info.ndim != 3) {
+                throw std::runtime_error("Bad STs shape at " + name);
+            }
+            auto S = info.shape[0];
+            auto T = info.shape[1];
+            if (known_S == 0) {
+                known_S = S;
+                known_T = T;
+                knownNumStocks = known_S * simd_len;
+            }
+            expectContiguousShape(
+                mod->dtype, info, name.c_str(),
+                {known_S, known_T, (py::ssize_t)mod->blocking_len});
+        } else if (mod->input_layout == kun::MemoryLayout::TS) {
+            // TS layout
+            if (info.ndim != 2) {
+                throw std::runtime_error("Bad TS shape at " + name);
+            }
+            auto S = info.shape[1];
+            auto T = info.shape[0];
+            if (known_S == 0) {
+                known_S = S / simd_len;
+                known_T = T;
+                knownNumStocks = S;
+                if (mod->aligned) {
+                    if (knownNumStocks % simd_len != 0) {
+                        throw std::runtime_error("Bad shape at " + name);
+                    }
+                }
+            }
+            expectContiguousShape(mod->dtype, info, name.c_str(),
+                                  {known_T, knownNumStocks});
+        } else {
+            throw std::runtime_error("Unknown layout at " + name);
+        }
+    }
+    if (num_stocks < 0) {
+        num_stocks = knownNumStocks;
+    }
+    if (!skip_check) {
+        if ((py::ssize_t)length > known_T) {
+            throw std::runtime_error("Bad parameter: length");
+        }
+        if (mod->input_layout == kun::MemoryLayout::STs) {
+            if (num_stocks > knownNumStocks ||
+                knownNumStocks <= knownNumStocks - simd_len) {
+                throw std::runtime_error(
+                    "num_stocks does not match the shape of inputs");
+            }
+        } else {
+            if (num_stocks != knownNumStocks) {
+                throw std::runtime_error(
+                    "num_stocks does not match the shape of inputs");
+            }
+        }
+    }
+    py::dict ret{};
+    py::array::ShapeContainer expected_out_shape;
+    if (mod->output_layout == kun::MemoryLayout::STs) {
+        expected_out_shape = {known_S, (py::ssize_t)length, simd_len};
+    } else {
+        expected_out_shape = {(py::ssize_t)length, num_stocks};
+    }
+    for (size_t i = 0; i < mod->num_buffers; i++) {
+        auto &buf = mod->buffers[i];
+        if (buf.kind == kun::BufferKind::OUTPUT) {
+            py::array outbuffer;
+            if (!outputs.is_none() && outputs.contains(buf.name)) {
+                py::array v;
+                outbuffer = outputs[buf.name].cast<py::buffer>();
+                auto info = outbuffer.request(true);
+                if (!skip_check) {
+                    expectContiguousShape(mod->dtype, info, buf.name,
+                                          *expected_out_shape);
+                }
+                bufs[buf.name] = (float *)info.ptr;
+            } else {
+                if (mod->dtype == kun::Datatype::Float) {
+                    outbuffer = py::array_t<float, py::array::c_style>{
+                        expected_out_shape};
+                } else {
+                    outbuffer = py::array_t<double, py::array::c_style>{
+                        expected_out_shape};
+                }
+                bufs[buf.name] = (float *)outbuffer.request().ptr;
+            }
+            ret[buf.name] = outbuffer;
+        }
+    }
+    return BatchBuffers{std::move(bufs), std::move(ret), num_stocks, known_T};
+}
+
+// kun::Plan with the numpy arrays bound to it, to keep them alive
+struct PyPlan {
+    std::unique_ptr<kun::Plan> plan;
+    // the input and output arrays by the names
+    py::dict arrays;
+    py::dict outputs;
+};
+
+static kun::ThreadAffinity makeAffinity(int num_threads,
+                                        const std::vector<int> &cpus,
+                                        const std::vector<int> &numa_nodes) {
+    if (!cpus.empty() && !numa_nodes.empty()) {
+        throw std::runtime_error(
+            "Cannot set both cpus and numa_nodes of the executor");
+    }
+    if (!numa_nodes.empty()) {
+        return kun::ThreadAffinity::fromNumaNodes(numa_nodes, num_threads);
+    }
+    return kun::ThreadAffinity::fromCpus(cpus);
+}
+
 PYBIND11_MODULE(KunRunner, m) {
     m.attr("__name__") = "KunQuant.runner.KunRunner";
     m.doc() = R"(Code Runner for KunQuant generated code)";
 
-    py::class_<kun::Executor, std::shared_ptr<kun::Executor>>(m, "Executor");
+    py::class_<kun::Executor, std::shared_ptr<kun::Executor>>(m, "Executor")
+        .def("getBufferPoolStats",
+             [](kun::Executor &ths) {
+                 py::dict ret;
+                 if (!ths.buffer_pool) {
+                     return ret;
+                 }
+                 auto stats = ths.buffer_pool->getStats();
+                 ret["peak_bytes"] = stats.peak_bytes;
+                 ret["in_use_bytes"] = stats.in_use_bytes;
+                 ret["cached_bytes"] = stats.cached_bytes;
+                 ret["reuse_hits"] = stats.reuse_hits;
+                 ret["allocations"] = stats.allocations;
+                 return ret;
+             })
+        .def("trimBufferPool",
+             [](kun::Executor &ths) {
+                 if (ths.buffer_pool) {
+                     ths.buffer_pool->trim();
+                 }
+             })
+        .def_property(
+            "time_stride", [](kun::Executor &ths) { return ths.time_stride; },
+            [](kun::Executor &ths, size_t v) {
+                if (v == 0) {
+                    throw std::runtime_error("time_stride should be positive");
+                }
+                ths.time_stride = v;
+            })
+        .def_readwrite("parallel_cs_min_stocks",
+                       &kun::Executor::parallel_cs_min_stocks)
+        .def_property_readonly("num_threads", &kun::Executor::numThreads);
     m.def("createSingleThreadExecutor", &kun::createSingleThreadExecutor);
-    m.def("createMultiThreadExecutor", &kun::createMultiThreadExecutor);
+    m.def(
+        "createMultiThreadExecutor",
+        [](int num_threads, bool caller_participates,
+           const std::vector<int> &cpus, const std::vector<int> &numa_nodes) {
+            return kun::createMultiThreadExecutor(
+                num_threads, caller_participates,
+                makeAffinity(num_threads, cpus, numa_nodes));
+        },
+        py::arg("num_threads"), py::arg("caller_participates") = true,
+        py::arg("cpus") = std::vector<int>{},
+        py::arg("numa_nodes") = std::vector<int>{});
+    m.def(
+        "createWorkStealingExecutor",
+        [](int num_threads, bool caller_participates,
+           const std::vector<int> &cpus, const std::vector<int> &numa_nodes) {
+            return kun::createWorkStealingExecutor(
+                num_threads, caller_participates,
+                makeAffinity(num_threads, cpus, numa_nodes));
+        },
+        py::arg("num_threads"), py::arg("caller_participates") = true,
+        py::arg("cpus") = std::vector<int>{},
+        py::arg("numa_nodes") = std::vector<int>{});
     m.def("getRuntimePath", []() -> std::string {
 #ifdef _WIN32
     char path[MAX_PATH];
@@ -95,6 +308,23 @@ PYBIND11_MODULE(KunRunner, m) {
                                    return "?";
                                })
         .def_readonly("blocking_len", &kun::Module::blocking_len)
+        .def_readonly("num_temp_slots", &kun::Module::num_temp_slots)
+        .def_property_readonly("unbounded_window",
+                               [](kun::Module &mod) {
+                                   return mod.unbounded_window != 0;
+                               })
+        .def_property_readonly("num_temp_buffers",
+                               [](kun::Module &mod) {
+                                   size_t ret = 0;
+                                   for (size_t i = 0; i < mod.num_buffers;
+                                        i++) {
+                                       if (mod.buffers[i].kind ==
+                                           kun::BufferKind::TEMP) {
+                                           ret++;
+                                       }
+                                   }
+                                   return ret;
+                               })
         .def("getOutputNames",
              [](kun::Module &mod) {
                  std::vector<std::string> ret;
@@ -129,161 +359,172 @@ PYBIND11_MODULE(KunRunner, m) {
         "runGraph",
         [](std::shared_ptr<kun::Executor> exec, const kun::Module *mod,
            const py::dict inputs, size_t cur_time, size_t length,
-           const py::object outputs, bool skip_check, py::ssize_t num_stocks) {
-            std::unordered_map<std::string, float *> bufs;
-            py::ssize_t known_S = 0;
-            py::ssize_t known_T = 0;
-            py::ssize_t knownNumStocks = 0;
-            py::ssize_t simd_len = mod->blocking_len;
-            for (auto kv : inputs) {
-                auto name = py::cast<std::string>(kv.first);
-                auto buf_obj = py::cast<py::buffer>(kv.second);
-                auto info = buf_obj.request();
-                bufs[name] = (float *)info.ptr;
-                if (skip_check) {
-                    if (known_S == 0) {
-                        if (mod->input_layout == kun::MemoryLayout::STs) {
-                            auto S = info.shape[0];
-                            auto T = info.shape[1];
-                            known_S = S;
-                            known_T = T;
-                        } else if (mod->input_layout == kun::MemoryLayout::TS) {
-                            auto S = info.shape[1];
-                            auto T = info.shape[0];
-                            known_S = S / simd_len;
-                            known_T = T;
-                        }
-                    }
-                    continue;
-                }
-                if (mod->dtype == kun::Datatype::Float) {
-                    if (info.format != py::format_descriptor<float>::format())
-                        throw std::runtime_error("Expecting float buffer at " +
-                                                 name);
-                } else if (info.format !=
-                           py::format_descriptor<double>::format()) {
-                    throw std::runtime_error("Expecting double buffer at " +
-                                             name);
-                }
-                if (mod->input_layout == kun::MemoryLayout::STs) {
-                    // ST8t layout
-                    if (info.ndim != 3) {
-                        throw std::runtime_error("Bad STs shape at " + name);
-                    }
-                    auto S = info.shape[0];
-                    auto T = info.shape[1];
-                    if (known_S == 0) {
-                        known_S = S;
-                        known_T = T;
-                        knownNumStocks = known_S * simd_len;
-                    }
-                    expectContiguousShape(
-                        mod->dtype, info, name.c_str(),
-                        {known_S, known_T, (py::ssize_t)mod->blocking_len});
-                } else if (mod->input_layout == kun::MemoryLayout::TS) {
-                    // TS layout
-                    if (info.ndim != 2) {
-                        throw std::runtime_error("Bad TS shape at " + name);
-                    }
-                    auto S = info.shape[1];
-                    auto T = info.shape[0];
-                    if (known_S == 0) {
-                        known_S = S / simd_len;
-                        known_T = T;
-                        knownNumStocks = S;
-                        if (mod->aligned) {
-                            if (knownNumStocks % simd_len != 0) {
-                                throw std::runtime_error("Bad shape at " +
-                                                         name);
-                            }
-                        }
-                    }
-                    expectContiguousShape(mod->dtype, info, name.c_str(),
-                                          {known_T, knownNumStocks});
-                } else {
-                    throw std::runtime_error("Unknown layout at " + name);
-                }
-            }
-            if (num_stocks < 0) {
-                num_stocks = knownNumStocks;
-            }
-            if (!skip_check) {
-                if ((py::ssize_t)length > known_T) {
-                    throw std::runtime_error("Bad parameter: length");
-                }
-                if (mod->input_layout == kun::MemoryLayout::STs) {
-                    if (num_stocks > knownNumStocks ||
-                        knownNumStocks <= knownNumStocks - simd_len) {
-                        throw std::runtime_error(
-                            "num_stocks does not match the shape of inputs");
-                    }
-                } else {
-                    if (num_stocks != knownNumStocks) {
-                        throw std::runtime_error(
-                            "num_stocks does not match the shape of inputs");
-                    }
-                }
-            }
-            py::dict ret{};
-            py::array::ShapeContainer expected_out_shape;
-            if (mod->output_layout == kun::MemoryLayout::STs) {
-                expected_out_shape = {known_S, (py::ssize_t)length, simd_len};
-            } else {
-                expected_out_shape = {(py::ssize_t)length, num_stocks};
-            }
-            for (size_t i = 0; i < mod->num_buffers; i++) {
-                auto &buf = mod->buffers[i];
-                if (buf.kind == kun::BufferKind::OUTPUT) {
-                    py::array outbuffer;
-                    if (!outputs.is_none() && outputs.contains(buf.name)) {
-                        py::array v;
-                        outbuffer = outputs[buf.name].cast<py::buffer>();
-                        auto info = outbuffer.request(true);
-                        if (!skip_check) {
-                            expectContiguousShape(mod->dtype, info, buf.name,
-                                                  *expected_out_shape);
-                        }
-                        bufs[buf.name] = (float *)info.ptr;
-                    } else {
-                        if (mod->dtype == kun::Datatype::Float) {
-                            outbuffer = py::array_t<float, py::array::c_style>{
-                                expected_out_shape};
-                        } else {
-                            outbuffer = py::array_t<double, py::array::c_style>{
-                                expected_out_shape};
-                        }
-                        bufs[buf.name] = (float *)outbuffer.request().ptr;
-                    }
-                    ret[buf.name] = outbuffer;
-                }
-            }
-            kun::runGraph(exec, mod, bufs, num_stocks, known_T, cur_time,
-                          length);
-            return ret;
+           const py::object outputs, bool skip_check, py::ssize_t num_stocks,
+           size_t chunk_size) {
+            auto bufs = prepareBatchBuffers(mod, inputs, length, outputs,
+                                            skip_check, num_stocks);
+            kun::runGraphChunked(exec, mod, bufs.bufs, bufs.num_stocks,
+                                 bufs.total_time, cur_time, length, chunk_size);
+            return bufs.outputs;
         },
         py::arg("exec"), py::arg("mod"), py::arg("inputs"), py::arg("cur_time"),
         py::arg("length"), py::arg("outputs") = py::dict(),
-        py::arg("skip_check") = false, py::arg("num_stocks") = -1);
+        py::arg("skip_check") = false, py::arg("num_stocks") = -1,
+        py::arg("chunk_size") = 0);
 
     py::class_<kun::StreamContext>(m, "StreamContext")
         .def(py::init<std::shared_ptr<kun::Executor>, const kun::Module *,
                       size_t>())
         .def("queryBufferHandle", &kun::StreamContext::queryBufferHandle)
         .def("getCurrentBuffer",
-             [](kun::StreamContext &ths, size_t handle) {
+             [](kun::StreamContext &ths, size_t handle) -> py::array {
                  auto buf = ths.getCurrentBufferPtr(handle);
+                 if (ths.m->dtype == kun::Datatype::Double) {
+                     return py::array_t<double, py::array::c_style>{
+                         (py::ssize_t)ths.ctx.stock_count, (const double *)buf};
+                 }
                  return py::array_t<float, py::array::c_style>{
                      (py::ssize_t)ths.ctx.stock_count, buf};
              })
         .def("pushData",
-             [](kun::StreamContext &ths, size_t handle,
-                py::array_t<float, py::array::c_style> data) {
+             [](kun::StreamContext &ths, size_t handle, py::array data) {
+                 // converted to the dtype of the module if needed
+                 if (ths.m->dtype == kun::Datatype::Double) {
+                     data = py::array_t<double, py::array::c_style |
+                                                    py::array::forcecast>(data);
+                 } else {
+                     data = py::array_t<float, py::array::c_style |
+                                                   py::array::forcecast>(data);
+                 }
                  auto info = data.request();
-                 if (info.shape.size() != 1 &&
-                     info.shape[0] != ths.ctx.stock_count) {
+                 if (info.ndim != 1 ||
+                     info.shape[0] != (py::ssize_t)ths.ctx.stock_count) {
                      throw std::runtime_error("Bad input data to push");
                  }
                  ths.pushData(handle, (float *)info.ptr);
              })
-        .def("run", &kun::StreamContext::run);
+        .def("getNextBuffer",
+             [](kun::StreamContext &ths, size_t handle) -> py::array {
+                 auto buf = ths.getNextBufferPtr(handle);
+                 // a writable view of the slot. It keeps the stream alive
+                 auto base = py::cast(&ths, py::return_value_policy::reference);
+                 if (ths.m->dtype == kun::Datatype::Double) {
+                     return py::array_t<double, py::array::c_style>{
+                         (py::ssize_t)ths.ctx.stock_count, (double *)buf, base};
+                 }
+                 return py::array_t<float, py::array::c_style>{
+                     (py::ssize_t)ths.ctx.stock_count, buf, base};
+             })
+        .def("commitData", &kun::StreamContext::commitData)
+        .def("saveState",
+             [](kun::StreamContext &ths, const std::string &path) {
+                 ths.saveState(path.c_str());
+             })
+        .def("loadState",
+             [](kun::StreamContext &ths, const std::string &path) {
+                 ths.loadState(path.c_str());
+             })
+        .def("run", &kun::StreamContext::run)
+        .def(
+            "runTicks",
+            [](kun::StreamContext &ths, const py::dict inputs,
+               const py::object outputs) {
+                auto num_stocks = (py::ssize_t)ths.ctx.stock_count;
+                py::ssize_t num_ticks = -1;
+                std::unordered_map<std::string, float *> bufs;
+                py::dict ret;
+                for (auto kv : inputs) {
+                    auto name = py::cast<std::string>(kv.first);
+                    auto info = py::cast<py::buffer>(kv.second).request();
+                    if (info.ndim != 2) {
+                        throw std::runtime_error("Bad shape at " + name);
+                    }
+                    if (num_ticks < 0) {
+                        num_ticks = info.shape[0];
+                    }
+                    expectContiguousShape(ths.m->dtype, info, name.c_str(),
+                                          {num_ticks, num_stocks});
+                    bufs[name] = (float *)info.ptr;
+                }
+                if (num_ticks < 0) {
+                    throw std::runtime_error("No input is given");
+                }
+                for (size_t i = 0; i < ths.m->num_buffers; i++) {
+                    auto &buf = ths.m->buffers[i];
+                    if (buf.kind != kun::BufferKind::OUTPUT) {
+                        continue;
+                    }
+                    py::array outbuffer;
+                    if (!outputs.is_none() && outputs.contains(buf.name)) {
+                        outbuffer = outputs[buf.name].cast<py::array>();
+                        expectContiguousShape(ths.m->dtype, outbuffer.request(),
+                                              buf.name,
+                                              {num_ticks, num_stocks});
+                    } else if (ths.m->dtype == kun::Datatype::Float) {
+                        outbuffer = py::array_t<float, py::array::c_style>{
+                            {num_ticks, num_stocks}};
+                    } else {
+                        outbuffer = py::array_t<double, py::array::c_style>{
+                            {num_ticks, num_stocks}};
+                    }
+                    bufs[buf.name] = (float *)outbuffer.request().ptr;
+                    ret[buf.name] = outbuffer;
+                }
+                ths.runTicks(bufs, num_ticks);
+                return ret;
+            },
+            py::arg("inputs"), py::arg("outputs") = py::dict());
+    py::class_<PyPlan>(m, "Plan")
+        .def(py::init([](std::shared_ptr<kun::Executor> exec,
+                         const kun::Module *mod, const py::dict inputs,
+                         size_t cur_time, size_t length,
+                         const py::object outputs, py::ssize_t num_stocks) {
+                 auto bufs = prepareBatchBuffers(mod, inputs, length, outputs,
+                                                 false, num_stocks);
+                 auto ret = std::unique_ptr<PyPlan>(new PyPlan);
+                 ret->plan = std::unique_ptr<kun::Plan>(new kun::Plan(
+                     exec, mod, bufs.bufs, bufs.num_stocks, bufs.total_time,
+                     cur_time, length));
+                 for (auto kv : inputs) {
+                     ret->arrays[kv.first] = kv.second;
+                 }
+                 for (auto kv : bufs.outputs) {
+                     ret->arrays[kv.first] = kv.second;
+                 }
+                 ret->outputs = bufs.outputs;
+                 return ret;
+             }),
+             py::arg("exec"), py::arg("mod"), py::arg("inputs"),
+             py::arg("cur_time"), py::arg("length"),
+             py::arg("outputs") = py::dict(), py::arg("num_stocks") = -1)
+        .def("run",
+             [](PyPlan &ths) {
+                 ths.plan->run();
+                 return ths.outputs;
+             })
+        .def("setStart",
+             [](PyPlan &ths, size_t cur_time) {
+                 ths.plan->setStart(cur_time);
+             })
+        .def("setBuffer",
+             [](PyPlan &ths, const std::string &name, py::buffer buffer) {
+                 auto key = py::str(name);
+                 if (!ths.arrays.contains(key)) {
+                     throw std::runtime_error("Cannot find the buffer name " +
+                                              name);
+                 }
+                 auto old = ths.arrays[key].cast<py::buffer>().request();
+                 auto info = buffer.request(ths.outputs.contains(key));
+                 expectContiguousShape(ths.plan->m->dtype, info, name.c_str(),
+                                       old.shape);
+                 ths.plan->setBuffer(
+                     ths.plan->queryBufferHandle(name.c_str()),
+                     (float *)info.ptr);
+                 ths.arrays[key] = buffer;
+                 if (ths.outputs.contains(key)) {
+                     ths.outputs[key] = buffer;
+                 }
+             })
+        .def_property_readonly("outputs",
+                               [](PyPlan &ths) { return ths.outputs; });
 }
\ No newline at end of file
@@ -0,0 +1,60 @@
+import argparse
+import time
+import numpy as np
+from KunQuant.Driver import KunCompilerConfig
+from KunQuant.jit import cfake
+from KunQuant.Op import Builder, Input, Output
+from KunQuant.Stage import Function
+from KunQuant.predefined.Alpha101 import AllData, all_alpha
+from KunQuant.runner import KunRunner as kr
+from KunTestUtil import gen_data
+
+# Compares the compile time and the execution time of Alpha101 under different compiler configs
+
+def build_alpha101():
+    builder = Builder()
+    with builder:
+        all_data = AllData(low=Input("low"),high=Input("high"),close=Input("close"),open=Input("open"), amount=Input("amount"), volume=Input("volume"))
+        for f in all_alpha:
+            out = f(all_data)
+            Output(out, f.__name__)
+    return Function(builder.ops)
+
+def make_input(num_stock: int, num_time: int):
+    dopen, dclose, dhigh, dlow, dvol, damount = gen_data.gen_stock_data2(0.5, 100, num_stock, num_time, 0.03, "float32")
+    return {"open": dopen.T, "close": dclose.T, "high": dhigh.T, "low": dlow.T, "volume": dvol.T, "amount": damount.T}
+
+profiles = {
+    "default": lambda: (cfake.CppCompilerConfig(), dict()),
+    "fast": lambda: (cfake.fast_compile_config(), dict()),
+    "fast_nopch": lambda: (cfake.fast_compile_config(pch=False), dict()),
+    # one translation unit per stage. The precompiled header avoids parsing the headers for each of them
+    "split_nopch": lambda: (cfake.CppCompilerConfig(), dict(split_source=-1)),
+    "split_pch": lambda: (cfake.CppCompilerConfig(pch=True), dict(split_source=-1)),
+}
+
+def bench(name: str, num_stock: int, num_time: int, repeat: int):
+    compiler, extra = profiles[name]()
+    cfg = KunCompilerConfig(input_layout="TS", output_layout="TS", options={"opt_reduce": True, "fast_log": True}, **extra)
+    start = time.time()
+    lib = cfake.compileit([("alpha_101", build_alpha101(), cfg)], "bench_" + name, compiler)
+    compile_time = time.time() - start
+    modu = lib.getModule("alpha_101")
+    inputs = dict([(k, np.ascontiguousarray(v)) for k, v in make_input(num_stock, num_time).items()])
+    executor = kr.createSingleThreadExecutor()
+    kr.runGraph(executor, modu, inputs, 0, num_time)
+    start = time.time()
+    for _ in range(repeat):
+        kr.runGraph(executor, modu, inputs, 0, num_time)
+    exec_time = (time.time() - start) / repeat
+    print(f"{name:>12}: compile {compile_time:8.3f} s, exec {exec_time * 1000:8.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compile time and execution time of Alpha101")
+    parser.add_argument("--profiles", type=str, default=",".join(profiles.keys()), help="comma-separated profile names: " + ",".join(profiles.keys()))
+    parser.add_argument("--stocks", type=int, default=256)
+    parser.add_argument("--time", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for name in args.profiles.split(","):
+        bench(name, args.stocks, args.time, args.repeat)
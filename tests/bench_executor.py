@@ -0,0 +1,41 @@
+import argparse
+import time
+import numpy as np
+from KunQuant.Driver import KunCompilerConfig
+from KunQuant.jit import cfake
+from KunQuant.jit.cache import JitCache
+from KunQuant.runner import KunRunner as kr
+from bench_compile import build_alpha101, make_input
+
+# Compares the execution time of Alpha101 under different executors
+
+executors = {
+    "single": lambda n: kr.createSingleThreadExecutor(),
+    "multi": lambda n: kr.createMultiThreadExecutor(n),
+    "stealing": lambda n: kr.createWorkStealingExecutor(n),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the executors on Alpha101")
+    parser.add_argument("--executors", type=str, default=",".join(executors.keys()), help="comma-separated executor names: " + ",".join(executors.keys()))
+    parser.add_argument("--threads", type=str, default="4", help="comma-separated numbers of threads")
+    parser.add_argument("--stocks", type=int, default=512)
+    parser.add_argument("--time", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--partition_factor", type=int, default=3)
+    args = parser.parse_args()
+    cfg = KunCompilerConfig(input_layout="TS", output_layout="TS", partition_factor=args.partition_factor, options={"opt_reduce": True, "fast_log": True})
+    lib = cfake.compileit([("alpha_101", build_alpha101(), cfg)], "bench_executor", cfake.CppCompilerConfig(cache=JitCache()))
+    modu = lib.getModule("alpha_101")
+    inputs = dict([(k, np.ascontiguousarray(v)) for k, v in make_input(args.stocks, args.time).items()])
+    for name in args.executors.split(","):
+        for num_threads in [int(v) for v in args.threads.split(",")]:
+            executor = executors[name](num_threads)
+            kr.runGraph(executor, modu, inputs, 0, args.time)
+            start = time.time()
+            for _ in range(args.repeat):
+                kr.runGraph(executor, modu, inputs, 0, args.time)
+            exec_time = (time.time() - start) / args.repeat
+            print(f"{name:>10} threads={num_threads:<3}: {exec_time * 1000:8.3f} ms")
+            if name == "single":
+                break
@@ -0,0 +1,76 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from KunQuant.Driver import KunCompilerConfig
+from KunQuant.jit import cfake
+from KunQuant.jit.cache import JitCache
+from KunQuant.Op import Builder, Input, Output, Rank, CrossSectionalOp, NoStockSplitTrait
+from KunQuant.Stage import Function
+from KunQuant.runner import KunRunner as kr
+
+# Measures the execution time of the cross-sectional Rank kernel under different numbers of stocks, compared with
+# the previous kernel (std::sort + std::equal_range for each stock) and pandas
+
+class RankReference(CrossSectionalOp, NoStockSplitTrait):
+    '''
+    The same as Rank, computed by the previous rank kernel RankReferenceStocks in Kun/Rank.hpp
+    '''
+    pass
+
+def build_rank(dtype: str, reference: bool):
+    builder = Builder()
+    with builder:
+        Output((RankReference if reference else Rank)(Input("a")), "ou")
+    f = Function(builder.ops)
+    name = f"rank_ref_{dtype}" if reference else f"rank_{dtype}"
+    return (name, f, KunCompilerConfig(input_layout="TS", output_layout="TS", dtype=dtype))
+
+def make_input(num_stock: int, num_time: int, dtype: str, ties: bool):
+    data = np.random.rand(num_time, num_stock)
+    if ties:
+        # many equal values in each time step
+        data = np.round(data * 100)
+    # some missing values
+    data[np.random.rand(num_time, num_stock) < 0.05] = np.nan
+    return data.astype("float32" if dtype == "float" else "float64")
+
+def time_module(executor, modu, inp, num_time: int, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        kr.runGraph(executor, modu, {"a": inp}, 0, num_time)
+    return (time.perf_counter() - start) / repeat
+
+def bench(modu, ref_modu, dtype: str, num_stock: int, num_time: int, repeat: int, ties: bool):
+    inp = make_input(num_stock, num_time, dtype, ties)
+    executor = kr.createSingleThreadExecutor()
+    expected = pd.DataFrame(inp).rank(pct=True, axis=1).to_numpy()
+    for m in [modu, ref_modu]:
+        out = kr.runGraph(executor, m, {"a": inp}, 0, num_time)["ou"]
+        np.testing.assert_allclose(out, expected, rtol=1e-5, equal_nan=True)
+    exec_time = time_module(executor, modu, inp, num_time, repeat)
+    ref_time = time_module(executor, ref_modu, inp, num_time, repeat)
+    df = pd.DataFrame(inp)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        df.rank(pct=True, axis=1)
+    pd_time = (time.perf_counter() - start) / repeat
+    print(f"{dtype:>6} stocks={num_stock:<6} ties={ties!s:<5}: {exec_time / num_time * 1e6:9.2f} us/step, "
+          f"previous {ref_time / num_time * 1e6:9.2f} us/step, pandas {pd_time / num_time * 1e6:9.2f} us/step")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cross-sectional Rank kernel")
+    parser.add_argument("--stocks", type=str, default="500,5000,20000", help="comma-separated numbers of stocks")
+    parser.add_argument("--dtypes", type=str, default="float,double")
+    parser.add_argument("--time", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    dtypes = args.dtypes.split(",")
+    funcs = [build_rank(dtype, reference) for dtype in dtypes for reference in [False, True]]
+    lib = cfake.compileit(funcs, "bench_rank", cfake.CppCompilerConfig(cache=JitCache()))
+    for dtype in dtypes:
+        modu = lib.getModule(f"rank_{dtype}")
+        ref_modu = lib.getModule(f"rank_ref_{dtype}")
+        for num_stock in [int(v) for v in args.stocks.split(",")]:
+            for ties in [False, True]:
+                bench(modu, ref_modu, dtype, num_stock, args.time, args.repeat, ties)
@@ -0,0 +1,54 @@
+import argparse
+import time
+import numpy as np
+from KunQuant.Driver import KunCompilerConfig
+from KunQuant.jit import cfake
+from KunQuant.jit.cache import JitCache
+from KunQuant.runner import KunRunner as kr
+from bench_compile import build_alpha101, make_input
+
+# Measures the latency of each tick and the CPU usage of Alpha101 in streaming mode under different executors
+
+executors = {
+    "single": lambda n: kr.createSingleThreadExecutor(),
+    "multi": lambda n: kr.createMultiThreadExecutor(n),
+    "multi_wait": lambda n: kr.createMultiThreadExecutor(n, caller_participates=False),
+    "stealing": lambda n: kr.createWorkStealingExecutor(n),
+    "stealing_wait": lambda n: kr.createWorkStealingExecutor(n, caller_participates=False),
+}
+
+def bench(modu, name: str, num_threads: int, inputs: dict, num_stock: int, num_ticks: int):
+    executor = executors[name](num_threads)
+    stream = kr.StreamContext(executor, modu, num_stock)
+    handles = dict([(k, stream.queryBufferHandle(k)) for k in inputs])
+    latency = np.empty((num_ticks,))
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for t in range(num_ticks):
+        for k, v in inputs.items():
+            stream.pushData(handles[k], v[t])
+        start = time.perf_counter()
+        stream.run()
+        latency[t] = time.perf_counter() - start
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    latency *= 1e6
+    print(f"{name:>14} threads={num_threads:<3}: mean {latency.mean():9.1f} us, p50 {np.percentile(latency, 50):9.1f} us, "
+          f"p99 {np.percentile(latency, 99):9.1f} us, CPU usage {cpu / wall * 100:6.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the executors on Alpha101 in streaming mode")
+    parser.add_argument("--executors", type=str, default=",".join(executors.keys()), help="comma-separated executor names: " + ",".join(executors.keys()))
+    parser.add_argument("--threads", type=str, default="4", help="comma-separated numbers of threads")
+    parser.add_argument("--stocks", type=int, default=512)
+    parser.add_argument("--ticks", type=int, default=2000)
+    args = parser.parse_args()
+    cfg = KunCompilerConfig(partition_factor=8, output_layout="STREAM", options={"fast_log": True})
+    lib = cfake.compileit([("alpha_101_stream", build_alpha101(), cfg)], "bench_stream", cfake.CppCompilerConfig(cache=JitCache()))
+    modu = lib.getModule("alpha_101_stream")
+    inputs = dict([(k, np.ascontiguousarray(v)) for k, v in make_input(args.stocks, args.ticks).items()])
+    for name in args.executors.split(","):
+        for num_threads in [int(v) for v in args.threads.split(",")]:
+            bench(modu, name, num_threads, inputs, args.stocks, args.ticks)
+            if name == "single":
+                break
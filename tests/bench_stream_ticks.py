@@ -0,0 +1,72 @@
+import argparse
+import time
+import numpy as np
+from KunQuant.Driver import KunCompilerConfig
+from KunQuant.jit import cfake
+from KunQuant.jit.cache import JitCache
+from KunQuant.Op import Builder, Input, Output, Rank
+from KunQuant.ops import WindowedAvg, WindowedSum, WindowedStddev
+from KunQuant.Stage import Function
+from KunQuant.runner import KunRunner as kr
+
+# Measures what StreamContext.runTicks saves compared with calling pushData, run and getCurrentBuffer from Python for
+# each tick. Both run the ticks one after another on the executor. The batch mode run of the same factors on the same
+# data is printed as the reference of a single pass over all ticks
+
+def build(output_layout: str):
+    builder = Builder()
+    with builder:
+        inp = Input("a")
+        Output(WindowedAvg(inp, 10), "avg")
+        Output(WindowedStddev(inp, 20), "stddev")
+        Output(Rank(WindowedSum(inp * 2, 5)), "rank")
+    f = Function(builder.ops)
+    return (f"stream_{output_layout}", f, KunCompilerConfig(input_layout="TS", output_layout=output_layout))
+
+def python_loop(executor, modu, inp: np.ndarray) -> dict:
+    num_ticks, num_stock = inp.shape
+    stream = kr.StreamContext(executor, modu, num_stock)
+    handle = stream.queryBufferHandle("a")
+    outnames = ["avg", "stddev", "rank"]
+    out_handles = [stream.queryBufferHandle(name) for name in outnames]
+    ret = dict([(name, np.empty((num_ticks, num_stock), dtype="float32")) for name in outnames])
+    for t in range(num_ticks):
+        stream.pushData(handle, inp[t])
+        stream.run()
+        for name, h in zip(outnames, out_handles):
+            ret[name][t] = stream.getCurrentBuffer(h)
+    return ret
+
+def run_ticks(executor, modu, inp: np.ndarray) -> dict:
+    return kr.StreamContext(executor, modu, inp.shape[1]).runTicks({"a": inp})
+
+def measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def bench(modu, batch_modu, num_stock: int, num_ticks: int, repeat: int):
+    inp = np.random.rand(num_ticks, num_stock).astype("float32")
+    executor = kr.createSingleThreadExecutor()
+    expected = python_loop(executor, modu, inp)
+    out = run_ticks(executor, modu, inp)
+    for k, v in expected.items():
+        np.testing.assert_equal(out[k], v)
+    loop_time = measure(lambda: python_loop(executor, modu, inp), repeat)
+    ticks_time = measure(lambda: run_ticks(executor, modu, inp), repeat)
+    batch_time = measure(lambda: kr.runGraph(executor, batch_modu, {"a": inp}, 0, num_ticks), repeat)
+    print(f"stocks={num_stock:<6}: python loop {loop_time / num_ticks * 1e6:9.2f} us/tick, "
+          f"runTicks {ticks_time / num_ticks * 1e6:9.2f} us/tick, batch mode {batch_time / num_ticks * 1e6:9.2f} us/tick")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark StreamContext.runTicks")
+    parser.add_argument("--stocks", type=str, default="16,512,8192", help="comma-separated numbers of stocks")
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    lib = cfake.compileit([build("STREAM"), build("TS")], "bench_stream_ticks", cfake.CppCompilerConfig(cache=JitCache()))
+    modu = lib.getModule("stream_STREAM")
+    batch_modu = lib.getModule("stream_TS")
+    for num_stock in [int(v) for v in args.stocks.split(",")]:
+        bench(modu, batch_modu, num_stock, args.ticks, args.repeat)
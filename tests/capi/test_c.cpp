@@ -51,6 +51,59 @@ static int testBatch(const char *libpath) {
     return 0;
 }
 
+static int testPlan(const char *libpath) {
+    const size_t num_stocks = 24;
+    const size_t num_time = 10;
+    float *inputs = new float[num_stocks * num_time];
+    float *inputs2 = new float[num_stocks * num_time];
+    for (size_t i = 0; i < num_stocks * num_time; i++) {
+        inputs[i] = float(rand()) / RAND_MAX;
+        inputs2[i] = float(rand()) / RAND_MAX;
+    }
+    float *outputs = new float[num_stocks * num_time];
+
+    KunExecutorHandle exec = kunCreateMultiThreadExecutor(2);
+    CHECK(exec);
+    KunLibraryHandle lib = kunLoadLibrary(libpath);
+    CHECK(lib);
+    KunModuleHandle modu = kunGetModuleFromLibrary(lib, "testRuntimeModule");
+    CHECK(modu);
+    KunBufferNameMapHandle bufs = kunCreateBufferNameMap();
+    CHECK(bufs);
+    kunSetBufferNameMap(bufs, "input", inputs);
+    kunSetBufferNameMap(bufs, "output", outputs);
+    KunPlanHandle plan =
+        kunCreatePlan(exec, modu, bufs, num_stocks, num_time, 0, num_time);
+    CHECK(plan);
+    // the map is not needed after the plan is created
+    kunDestoryBufferNameMap(bufs);
+    size_t handleInput = kunPlanQueryBufferHandle(plan, "input");
+
+    for (int iter = 0; iter < 3; iter++) {
+        float *cur_inputs = iter == 2 ? inputs2 : inputs;
+        if (iter == 2) {
+            kunPlanSetBuffer(plan, handleInput, inputs2);
+        }
+        kunPlanRun(plan);
+        for (size_t i = 0; i < num_stocks * num_time; i++) {
+            if (std::abs(outputs[i] - cur_inputs[i] * 3) > 1e-5) {
+                printf("Output error at %zu => %f, %f\n", i, outputs[i],
+                       cur_inputs[i]);
+                return 4;
+            }
+        }
+    }
+
+    delete[] inputs;
+    delete[] inputs2;
+    delete[] outputs;
+    kunDestoryPlan(plan);
+    kunUnloadLibrary(lib);
+    kunDestoryExecutor(exec);
+    printf("Test done: plan\n");
+    return 0;
+}
+
 // check alpha101 = (self.close - self.open) /((self.high - self.low) + 0.001)
 static int testStream(const char *libpath) {
     // prepare inputs
@@ -94,7 +147,10 @@ static int testStream(const char *libpath) {
     kunStreamPushData(ctx, handleHigh, datahigh);
     kunStreamPushData(ctx, handleLow, datalow);
     kunStreamPushData(ctx, handleVol, datavol);
-    kunStreamPushData(ctx, handleAmount, dataamount);
+    // write the data in place
+    memcpy(kunStreamGetNextBuffer(ctx, handleAmount), dataamount,
+           sizeof(float) * num_stocks);
+    kunStreamCommitData(ctx, handleAmount);
 
     kunStreamRun(ctx);
     memcpy(alpha101, kunStreamGetCurrentBuffer(ctx, handleAlpha101),
@@ -109,6 +165,42 @@ static int testStream(const char *libpath) {
         }
     }
 
+    // restore the state in another stream
+    const char *state_path = "kun_stream_state.bin";
+    CHECK(kunStreamSaveState(ctx, state_path) == 0);
+    KunStreamContextHandle ctx2 = kunCreateStream(exec, modu, num_stocks);
+    CHECK(ctx2);
+    CHECK(kunStreamLoadState(ctx2, state_path) == 0);
+    remove(state_path);
+    CHECK(kunStreamLoadState(ctx2, state_path) != 0);
+    CHECK(!memcmp(kunStreamGetCurrentBuffer(ctx, handleAlpha101),
+                  kunStreamGetCurrentBuffer(ctx2, handleAlpha101),
+                  sizeof(float) * num_stocks));
+    kunDestoryStream(ctx2);
+
+    // run the next tick with the same data by kunStreamRunTicks
+    KunBufferNameMapHandle bufs = kunCreateBufferNameMap();
+    CHECK(bufs);
+    kunSetBufferNameMap(bufs, "close", dataclose);
+    kunSetBufferNameMap(bufs, "open", dataopen);
+    kunSetBufferNameMap(bufs, "high", datahigh);
+    kunSetBufferNameMap(bufs, "low", datalow);
+    kunSetBufferNameMap(bufs, "volume", datavol);
+    kunSetBufferNameMap(bufs, "amount", dataamount);
+    memset(alpha101, 0, sizeof(float) * num_stocks);
+    kunSetBufferNameMap(bufs, "alpha101", alpha101);
+    kunStreamRunTicks(ctx, bufs, 1);
+    kunDestoryBufferNameMap(bufs);
+    for (size_t i = 0; i < num_stocks; i++) {
+        float expected =
+            (dataclose[i] - dataopen[i]) / (datahigh[i] - datalow[i] + 0.001);
+        if (std::abs(alpha101[i] - expected) > 1e-5) {
+            printf("Batch output error at %zu => %f, %f\n", i, alpha101[i],
+                   expected);
+            return 4;
+        }
+    }
+
     delete[] dataclose;
     delete[] dataopen;
     delete[] datahigh;
@@ -131,6 +223,10 @@ int main(int args, char **argv) {
     if (ret) {
         return ret;
     }
+    ret = testPlan(argv[1]);
+    if (ret) {
+        return ret;
+    }
     ret = testStream(argv[2]);
     if (ret) {
         return ret;
@@ -1,6 +1,7 @@
 #include <Kun/Context.hpp>
 #include <Kun/Module.hpp>
 #include <KunSIMD/cpu/Math.hpp>
+#include <stdexcept>
 
 using namespace kun;
 
@@ -71,15 +72,18 @@ static Stage stages[] = {
     {/*f*/ stage1, /*dependers*/ stage1_dep, /*num_dependers*/ stage1_num_dep,
      /*in_buffers*/ stage1_in_buf, /*num_in_buffers*/ 1,
      /*out_buffers*/ stage1_out_buf, /*num_out_buffers*/ 1, /*pending_out*/ 0,
-     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 0},
+     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 0,
+     /*priority*/ 3},
     {/*f*/ stage2, /*dependers*/ stage2_dep, /*num_dependers*/ stage2_num_dep,
      /*in_buffers*/ stage2_in_buf, /*num_in_buffers*/ 1,
      /*out_buffers*/ stage2_out_buf, /*num_out_buffers*/ 1, /*pending_out*/ 1,
-     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 1},
+     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 1,
+     /*priority*/ 2},
     {/*f*/ stage3, /*dependers*/ nullptr, /*num_dependers*/ 0,
      /*in_buffers*/ stage3_in_buf, /*num_in_buffers*/ 2,
      /*out_buffers*/ stage3_out_buf, /*num_out_buffers*/ 1, /*pending_out*/ 2,
-     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 2},
+     /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 2,
+     /*priority*/ 1},
 };
 
 namespace {
@@ -88,7 +92,7 @@ Stage *stage2_dep[] = {&stages[2]};
 } // namespace
 
 KUN_EXPORT Module testRuntimeModule{
-    0x64100003,
+    0x64100009,
     arraySize(stages),
     stages,
     arraySize(buffers),
@@ -97,4 +101,55 @@ KUN_EXPORT Module testRuntimeModule{
     MemoryLayout::STs,
     simd_len,
     Datatype::Float
-};
\ No newline at end of file
+};
+
+// a module whose second stage throws, to check that the temp buffer of the
+// aborted run is returned to the buffer pool
+static void stage_throw(Context *__ctx, size_t __stock_idx, size_t __total_time,
+                        size_t __start, size_t __length) {
+    throw std::runtime_error("Stage failed");
+}
+
+static BufferInfo abort_buffers[]{
+    {0, "input", 0, BufferKind::INPUT},
+    {1, "t1", 1, BufferKind::TEMP},
+    {2, "output", 0, BufferKind::OUTPUT},
+};
+
+namespace {
+extern Stage *abort_stage1_dep[1];
+} // namespace
+
+static BufferInfo *abort_stage1_in_buf[] = {&abort_buffers[0]};
+static BufferInfo *abort_stage1_out_buf[] = {&abort_buffers[1]};
+static BufferInfo *abort_stage2_in_buf[] = {&abort_buffers[1]};
+static BufferInfo *abort_stage2_out_buf[] = {&abort_buffers[2]};
+
+static Stage abort_stages[] = {
+    {/*f*/ stage1, /*dependers*/ abort_stage1_dep, /*num_dependers*/ 1,
+     /*in_buffers*/ abort_stage1_in_buf, /*num_in_buffers*/ 1,
+     /*out_buffers*/ abort_stage1_out_buf, /*num_out_buffers*/ 1,
+     /*pending_out*/ 0, /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 0,
+     /*priority*/ 2},
+    {/*f*/ stage_throw, /*dependers*/ nullptr, /*num_dependers*/ 0,
+     /*in_buffers*/ abort_stage2_in_buf, /*num_in_buffers*/ 1,
+     /*out_buffers*/ abort_stage2_out_buf, /*num_out_buffers*/ 1,
+     /*pending_out*/ 1, /*num_tasks*/ TaskExecKind::SLICE_BY_STOCK, /*id*/ 1,
+     /*priority*/ 1},
+};
+
+namespace {
+Stage *abort_stage1_dep[] = {&abort_stages[1]};
+} // namespace
+
+KUN_EXPORT Module testAbortModule{
+    0x64100009,
+    arraySize(abort_stages),
+    abort_stages,
+    arraySize(abort_buffers),
+    abort_buffers,
+    MemoryLayout::STs,
+    MemoryLayout::STs,
+    simd_len,
+    Datatype::Float
+};
@@ -17,7 +17,7 @@ def check_alpha101_stream():
             cnt += 1
     simd_len = 8
     f = Function(builder.ops)
-    return "alpha_101_stream", f, KunCompilerConfig(blocking_len=simd_len, partition_factor=8, output_layout="STREAM", options={"opt_reduce": False, "fast_log": True})
+    return "alpha_101_stream", f, KunCompilerConfig(blocking_len=simd_len, partition_factor=8, output_layout="STREAM", options={"fast_log": True})
 
 
 cfake.compileit([check_alpha101_stream()], "alpha101_stream", cfake.CppCompilerConfig(), tempdir=sys.argv[1], keep_files=True)
\ No newline at end of file
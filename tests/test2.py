@@ -3,6 +3,8 @@ from KunQuant.Stage import *
 from KunQuant.ops import *
 import KunQuant.passes
 from KunQuant.passes import *
+import KunQuant.Driver
+import re
 
 def optimize(f: Function):
     decompose(f)
@@ -115,6 +117,30 @@ v2 = Mul@(v0,v1)
 v3 = Output@{name:out2}(v2)''']
     check_partition(f, exp1, exp2)
 
+def test_stage_priority():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        inp2 = Input("b")
+        v1 = Mul(inp1, inp2)
+        v2 = Rank(v1)
+        v3 = Mul(v2, v1)
+        out1 = Output(v2, "out1")
+        out2 = Output(v3, "out2")
+    f = Function(builder.ops)
+    src = KunQuant.Driver.compileit(f, "test_priority", input_layout="TS", output_layout="TS")
+    priorities = dict(re.findall(r"{/\*f\*/ stage_(\w+),.*?/\*priority\*/ (\d+)", src, re.DOTALL))
+    priorities = dict([(k, int(v)) for k, v in priorities.items()])
+    # find the stage of v1 by its output buffer, which is the input of the rank stage
+    in_bufs = dict(re.findall(r"stage_(\w+)_in_buf\[\] = {(.*?)};", src))
+    out_bufs = dict(re.findall(r"stage_(\w+)_out_buf\[\] = {(.*?)};", src))
+    v1_stage = [k for k, v in out_bufs.items() if v == in_bufs["out1"]]
+    assert(len(v1_stage) == 1)
+    # the rank stage is on the critical path of the Mul stage of v1
+    if not (priorities[v1_stage[0]] > priorities["out1"] > priorities["out2"] > 0):
+        raise RuntimeError("Bad stage priorities: " + str(priorities))
+
 test_partition1()
 test_partition_cylic()
-test_partition_rank_out()
\ No newline at end of file
+test_partition_rank_out()
+test_stage_priority()
@@ -46,7 +46,7 @@ def check_alpha101_stream(avx):
             cnt += 1
     simd_len = 16 if avx == "avx512" else 8
     f = Function(builder.ops)
-    return "alpha_101_stream", f, KunCompilerConfig(blocking_len=simd_len, partition_factor=8, output_layout="STREAM", options={"opt_reduce": False, "fast_log": True})
+    return "alpha_101_stream", f, KunCompilerConfig(blocking_len=simd_len, partition_factor=8, output_layout="STREAM", options={"fast_log": True})
  
 def count_unmatched_elements(arr1: np.ndarray, arr2: np.ndarray, atol=1e-8, rtol=1e-5, equal_nan=False):
     # Check if arrays have the same shape
@@ -342,6 +342,17 @@ def test_stream(modu, executor, start_window, num_stock, num_time, my_input, ref
         outputs[name] = TS_ST(outputs[name])
     return check_result(outputs, ref, outnames, start_window, num_stock, 0, num_time)
 
+def test_stream_batch(modu, executor, start_window, num_stock, num_time, my_input, ref):
+    outnames = modu.getOutputNames()
+    stream = kr.StreamContext(executor, modu, num_stock)
+    # replay the first ticks in a batch and then run the rest one by one
+    split = num_time // 2
+    outputs = stream.runTicks(dict([(k, np.ascontiguousarray(v[:split])) for k, v in my_input.items()]))
+    rest = stream.runTicks(dict([(k, np.ascontiguousarray(v[split:])) for k, v in my_input.items()]))
+    for name in outnames:
+        outputs[name] = TS_ST(np.concatenate([outputs[name], rest[name]]))
+    return check_result(outputs, ref, outnames, start_window, num_stock, 0, num_time)
+
 def streammain():
     modu = lib.getModule("alpha_101_stream")
     start_window = modu.getOutputUnreliableCount()
@@ -355,6 +366,11 @@ def streammain():
     done = done & test_stream(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check)
     executor = kr.createMultiThreadExecutor(8)
     done = done & test_stream(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check)
+    executor = kr.createWorkStealingExecutor(8)
+    done = done & test_stream(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check)
+    executor = kr.createMultiThreadExecutor(4, caller_participates=False)
+    done = done & test_stream(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check)
+    done = done & test_stream_batch(modu, executor, start_window, num_stock, num_time, my_input, pd_ref)
     print("OK", done)
     if not done:
         exit(1)
@@ -415,6 +431,10 @@ def main(is64: bool, is_check: bool):
         done = done & testfunc(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check, 50)
         executor = kr.createMultiThreadExecutor(4)
         done = done & testfunc(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check, 0)
+        executor = kr.createWorkStealingExecutor(4)
+        done = done & testfunc(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check, 0)
+        executor = kr.createMultiThreadExecutor(4, numa_nodes=[0, 0])
+        done = done & testfunc(modu, executor, start_window, num_stock, num_time, my_input, pd_ref, is_check, 0)
     num_stock = 64
     compute()
     # skip benchmarking on unaligned mode
@@ -4,6 +4,7 @@ import pandas as pd
 import sys
 import warnings
 import os
+import tempfile
 from KunQuant.jit import cfake
 from KunQuant.Op import Input, Output, Builder
 from KunQuant.Stage import Function
@@ -29,6 +30,62 @@ def test_cfake():
     out = kr.runGraph(executor, mod, {"a": inp, "b": inp2}, 0, 10)
     np.testing.assert_allclose(inp * inp2 + 10, out["out"])
 
+def test_jit_cache():
+    from KunQuant.jit.cache import JitCache
+    def build(k):
+        builder = Builder()
+        with builder:
+            inp1 = Input("a")
+            Output(inp1 * k, "out")
+        return Function(builder.ops)
+    def run(lib, name, k):
+        mod = lib.getModule(name)
+        inp = np.random.rand(10, 24).astype("float32")
+        executor = kr.createSingleThreadExecutor()
+        out = kr.runGraph(executor, mod, {"a": inp}, 0, 10)
+        np.testing.assert_allclose(inp * k, out["out"], rtol=1e-6)
+    cfg = KunCompilerConfig(input_layout="TS", output_layout="TS")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = JitCache(tmpdir)
+        compiler = cfake.CppCompilerConfig(cache=cache, pch=True)
+        lib = cfake.compileit([("cache1", build(2), cfg), ("cache2", build(3), cfg)], "cachetest", compiler)
+        run(lib, "cache1", 2)
+        assert(cache.hits == 0)
+        # the library is reused as a whole
+        lib = cfake.compileit([("cache1", build(2), cfg), ("cache2", build(3), cfg)], "cachetest", compiler)
+        run(lib, "cache2", 3)
+        assert(cache.hits == 1)
+        # only the changed module is recompiled
+        lib = cfake.compileit([("cache1", build(2), cfg), ("cache2", build(4), cfg)], "cachetest", compiler)
+        run(lib, "cache2", 4)
+        assert(cache.hits == 2)
+        # split source mode: only the changed stage is recompiled
+        def build_split(k):
+            builder = Builder()
+            with builder:
+                inp1 = Input("a")
+                Output(WindowedMax(Rank(inp1), 3) * k, "out")
+                Output(WindowedMin(Rank(WindowedMin(inp1, 3)), 3), "out2")
+            return Function(builder.ops)
+        def run_split(lib, k):
+            mod = lib.getModule("cache_split")
+            inp = np.random.rand(10, 24).astype("float32")
+            executor = kr.createSingleThreadExecutor()
+            out = kr.runGraph(executor, mod, {"a": inp}, 0, 10)
+            expected = pd.DataFrame(inp).rank(pct=True, axis=1).rolling(3).max().to_numpy() * k
+            np.testing.assert_allclose(expected, out["out"], rtol=1e-6, equal_nan=True)
+        split_cfg = KunCompilerConfig(input_layout="TS", output_layout="TS", split_source=-1)
+        lib = cfake.compileit([("cache_split", build_split(2), split_cfg)], "cachetest", compiler)
+        run_split(lib, 2)
+        hits = cache.hits
+        lib = cfake.compileit([("cache_split", build_split(3), split_cfg)], "cachetest", compiler)
+        run_split(lib, 3)
+        # the module definition and the unchanged stage are reused
+        assert(cache.hits == hits + 2)
+        cache.max_size = 0
+        cache.evict()
+        assert(cache.size() == 0)
+
 def test_runtime(libpath):
     lib2 = kr.Library.load(libpath)
     inp = np.random.rand(3, 10, 8).astype("float32")
@@ -39,6 +96,15 @@ def test_runtime(libpath):
     expected = inp + inp * 2
     if not np.allclose(expected, out["output"]):
         raise RuntimeError("")
+    # the temp buffer of a run aborted by a stage is returned to the pool
+    modu = lib2.getModule("testAbortModule")
+    executor = kr.createSingleThreadExecutor()
+    try:
+        kr.runGraph(executor, modu, {"input": inp}, 0, 10)
+        assert(False)
+    except RuntimeError as e:
+        assert "Stage failed" in str(e)
+    assert(executor.getBufferPoolStats()["in_use_bytes"] == 0)
 
 def ST_ST8t(data: np.ndarray, blocking = 8) -> np.ndarray:
     return np.ascontiguousarray(data.reshape((-1, blocking, data.shape[1])).transpose((0, 2, 1)))
@@ -182,6 +248,11 @@ def test_rank(lib):
     check(inp, 20)
     inp[10,:] = np.nan
     check(inp, 20)
+    # more stocks than the threshold of the radix sort, with ties, negative values and signed zeros
+    inp = np.round(np.random.randn(512, 20) * 10).astype("float32")
+    inp[::7, :] = -0.0
+    inp[3::5, :] = np.nan
+    check(inp, 20)
 
 ####################################
 
@@ -365,6 +436,454 @@ def test_aligned(lib):
 
 ####################################
 
+def check_split_source():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        Output(WindowedMax(Rank(inp1), 3) * 2, "ou1")
+        Output(WindowedMin(Rank(WindowedMin(inp1, 3)), 3), "ou2")
+        Output(WindowedSum(Rank(inp1 * inp1 - 1), 5), "ou3")
+    f = Function(builder.ops)
+    return ("test_split_source", f, KunCompilerConfig(input_layout="TS", output_layout="TS", dtype="double", split_source=2))
+
+def test_split_source(lib):
+    modu = lib.getModule("test_split_source")
+    assert(modu)
+    inp = np.random.rand(20, 24)
+    df = pd.DataFrame(inp)
+    rank = lambda d: d.rank(pct=True, axis=1)
+    executors = [kr.createMultiThreadExecutor(2), kr.createWorkStealingExecutor(3),
+                 kr.createMultiThreadExecutor(2, caller_participates=False), kr.createWorkStealingExecutor(2, caller_participates=False),
+                 # NUMA node 0 listed twice, to divide the stock-sliced tasks into 2 slices on a single node machine
+                 kr.createMultiThreadExecutor(2, cpus=[0]), kr.createWorkStealingExecutor(3, caller_participates=False, numa_nodes=[0, 0])]
+    for executor in executors:
+        out = kr.runGraph(executor, modu, {"a": inp}, 0, 20)
+        np.testing.assert_allclose(out["ou1"], rank(df).rolling(3).max().to_numpy() * 2, rtol=1e-6, equal_nan=True)
+        np.testing.assert_allclose(out["ou2"], rank(df.rolling(3).min()).rolling(3).min().to_numpy(), rtol=1e-6, equal_nan=True)
+        np.testing.assert_allclose(out["ou3"], rank(df * df - 1).rolling(5).sum().to_numpy(), rtol=1e-6, equal_nan=True)
+
+def test_plan(lib):
+    modu = lib.getModule("test_split_source")
+    inp = np.random.rand(20, 24)
+    inp2 = np.random.rand(20, 24)
+    for executor in [kr.createSingleThreadExecutor(), kr.createMultiThreadExecutor(2)]:
+        plan = kr.Plan(executor, modu, {"a": inp}, 0, 10)
+        for _ in range(2):
+            out = plan.run()
+            expected = kr.runGraph(executor, modu, {"a": inp}, 0, 10)
+            for k, v in expected.items():
+                np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+        plan.setStart(10)
+        out = plan.run()
+        expected = kr.runGraph(executor, modu, {"a": inp}, 10, 10)
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+        plan.setBuffer("a", inp2)
+        newout = np.empty((10, 24))
+        plan.setBuffer("ou1", newout)
+        out = plan.run()
+        assert(out["ou1"] is newout)
+        expected = kr.runGraph(executor, modu, {"a": inp2}, 10, 10)
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+        try:
+            plan.setStart(11)
+            assert(False)
+        except RuntimeError:
+            pass
+
+def test_buffer_pool(lib):
+    modu = lib.getModule("test_split_source")
+    inp = np.random.rand(20, 24)
+    executor = kr.createSingleThreadExecutor()
+    expected = kr.runGraph(executor, modu, {"a": inp}, 0, 20)
+    stats = executor.getBufferPoolStats()
+    assert(stats["allocations"] > 0)
+    assert(stats["in_use_bytes"] == 0)
+    assert(stats["cached_bytes"] > 0 and stats["peak_bytes"] >= stats["cached_bytes"])
+    out = kr.runGraph(executor, modu, {"a": inp}, 0, 20)
+    stats2 = executor.getBufferPoolStats()
+    # all temp buffers of the second run are recycled
+    assert(stats2["allocations"] == stats["allocations"])
+    assert(stats2["reuse_hits"] >= stats["allocations"])
+    assert(stats2["peak_bytes"] == stats["peak_bytes"])
+    for k, v in expected.items():
+        np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+    executor.trimBufferPool()
+    assert(executor.getBufferPoolStats()["cached_bytes"] == 0)
+
+def check_memory_plan(memory_plan: bool):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        v = inp1
+        # a chain of stages, whose temp buffers can share the slots
+        for i in range(6):
+            v = Rank(WindowedSum(v, 3) + i)
+        Output(v, "ou1")
+        Output(Rank(inp1 * inp1), "ou2")
+    f = Function(builder.ops)
+    return (f"test_memory_plan_{memory_plan}", f, KunCompilerConfig(input_layout="TS", output_layout="TS", options={"memory_plan": memory_plan}))
+
+def test_memory_plan(lib):
+    modu = lib.getModule("test_memory_plan_True")
+    ref_modu = lib.getModule("test_memory_plan_False")
+    assert(ref_modu.num_temp_slots == 0)
+    assert(0 < modu.num_temp_slots < modu.num_temp_buffers)
+    inp = np.random.rand(30, 24).astype("float32")
+    expected = kr.runGraph(kr.createSingleThreadExecutor(), ref_modu, {"a": inp}, 0, 30)
+    for executor in [kr.createSingleThreadExecutor(), kr.createMultiThreadExecutor(3), kr.createWorkStealingExecutor(3)]:
+        out = kr.runGraph(executor, modu, {"a": inp}, 0, 30)
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+        out = kr.Plan(executor, modu, {"a": inp}, 0, 30).run()
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v, rtol=1e-6, equal_nan=True)
+
+def check_chunked_ema():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        Output(WindowedAvg(inp1, 5), "ou1")
+        Output(ExpMovingAvg(inp1, 5), "ou2")
+    f = Function(builder.ops)
+    return "test_chunked_ema", f, KunCompilerConfig(input_layout="TS", output_layout="TS")
+
+def check_chunked_sum():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        inp2 = Input("b")
+        v1 = WindowedSum(inp1, 10)
+        Output(v1, "sum")
+        Output(WindowedStddev(v1, 7), "stddev")
+        Output(WindowedCorrelation(inp1, 10, inp2), "corr")
+        Output(WindowedLinearRegressionSlope(inp2, 6), "slope")
+    f = Function(builder.ops)
+    return "test_chunked_sum", f, KunCompilerConfig(input_layout="TS", output_layout="TS", dtype="double")
+
+def test_chunked(lib):
+    executor = kr.createMultiThreadExecutor(2)
+    inp = np.random.rand(24, 64).astype("float32")
+    inp_TS = np.ascontiguousarray(inp.transpose())
+    inp_double = np.random.rand(64, 24)
+    cases = [("avg_and_stddev", ST_ST8t(inp)), ("avg_and_stddev_TS", inp_TS), ("test_split_source", inp_double)]
+    for name, data in cases:
+        modu = lib.getModule(name)
+        for cur_time, length in [(0, 64), (7, 50)]:
+            expected = kr.runGraph(executor, modu, {"a": data}, cur_time, length)
+            for chunk_size in [1, 5, 16, 49, 100]:
+                out = kr.runGraph(executor, modu, {"a": data}, cur_time, length, chunk_size=chunk_size)
+                for k, v in expected.items():
+                    np.testing.assert_allclose(out[k], v, rtol=1e-5, atol=1e-6, equal_nan=True)
+    # the running sums of the ops are rounded differently in a chunk, which starts from another time step. The
+    # results are equal up to rounding
+    modu = lib.getModule("test_chunked_sum")
+    inputs = {"a": np.random.rand(2000, 24) * 1000, "b": np.random.rand(2000, 24)}
+    inputs["a"][100:130, 3] = np.nan
+    expected = kr.runGraph(executor, modu, inputs, 0, 2000)
+    for chunk_size in [37, 300]:
+        out = kr.runGraph(executor, modu, inputs, 0, 2000, chunk_size=chunk_size)
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v, rtol=1e-9, atol=1e-9, equal_nan=True)
+    # ExpMovingAvg depends on the whole history, which cannot be restarted in a chunk
+    modu = lib.getModule("test_chunked_ema")
+    assert(modu.unbounded_window)
+    assert(not lib.getModule("avg_and_stddev_TS").unbounded_window)
+    expected = kr.runGraph(executor, modu, {"a": inp_TS}, 0, 64)
+    out = kr.runGraph(executor, modu, {"a": inp_TS}, 0, 64, chunk_size=64)
+    np.testing.assert_allclose(out["ou2"], expected["ou2"], equal_nan=True)
+    try:
+        kr.runGraph(executor, modu, {"a": inp_TS}, 0, 64, chunk_size=16)
+        assert(False)
+    except RuntimeError as e:
+        assert "time chunks" in str(e)
+
+def check_stream(dtype: str, layout: str):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        Output(WindowedAvg(inp1, 5), "ou1")
+        Output(Rank(WindowedSum(inp1 * 2, 3)), "ou2")
+        # the stateful ops keep their states across the ticks in stream mode
+        Output(ExpMovingAvg(inp1, 5), "ou3")
+        Output(WindowedLinearRegressionSlope(inp1, 6), "ou4")
+    f = Function(builder.ops)
+    return (f"test_stream_{dtype}_{layout}", f, KunCompilerConfig(input_layout="TS", output_layout=layout, dtype=dtype))
+
+def test_stream(lib):
+    # 21 stocks is not a multiple of the SIMD length
+    for dtype, num_stock in [("float", 24), ("double", 24), ("float", 21), ("double", 21)]:
+        modu = lib.getModule(f"test_stream_{dtype}_STREAM")
+        ref_modu = lib.getModule(f"test_stream_{dtype}_TS")
+        inp = np.random.rand(30, num_stock).astype("float32" if dtype == "float" else "float64")
+        executor = kr.createSingleThreadExecutor()
+        expected = kr.runGraph(executor, ref_modu, {"a": inp}, 0, 30)
+        stream = kr.StreamContext(executor, modu, num_stock)
+        outnames = ["ou1", "ou2", "ou3", "ou4"]
+        handles = dict([(k, stream.queryBufferHandle(k)) for k in ["a"] + outnames])
+        for t in range(10):
+            if t % 2:
+                stream.pushData(handles["a"], inp[t])
+            else:
+                # write the data in place
+                slot = stream.getNextBuffer(handles["a"])
+                assert(slot.dtype == inp.dtype)
+                slot[:] = inp[t]
+                stream.commitData(handles["a"])
+            stream.run()
+            for k in outnames:
+                out = stream.getCurrentBuffer(handles[k])
+                assert(out.dtype == inp.dtype)
+                np.testing.assert_allclose(out, expected[k][t], rtol=1e-5, equal_nan=True)
+        # restore the state in a new stream
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "state.bin")
+            stream.saveState(path)
+            stream2 = kr.StreamContext(executor, modu, num_stock)
+            stream2.loadState(path)
+            try:
+                kr.StreamContext(executor, modu, 16).loadState(path)
+                assert(False)
+            except RuntimeError:
+                pass
+        for s in [stream, stream2]:
+            out = s.runTicks({"a": inp[10:]})
+            for k in outnames:
+                np.testing.assert_allclose(out[k], expected[k][10:], rtol=1e-5, equal_nan=True)
+
+def check_minmax(output_layout):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        # the deques are used for the large windows only
+        for window in [5, 80]:
+            Output(WindowedMin(inp1, window), f"min{window}")
+            Output(WindowedMax(inp1, window), f"max{window}")
+            Output(TsArgMin(inp1, window), f"argmin{window}")
+            Output(TsArgMax(inp1, window), f"argmax{window}")
+    f = Function(builder.ops)
+    return f"test_minmax_{output_layout}", f, KunCompilerConfig(input_layout="TS", output_layout=output_layout)
+
+def test_minmax(lib):
+    # many ties and missing values
+    inp = np.round(np.random.randn(300, 24) * 3).astype("float32")
+    inp[::97, :] = np.nan
+    inp[50:60, 3] = np.nan
+    df = pd.DataFrame(inp)
+    executor = kr.createSingleThreadExecutor()
+    out = kr.runGraph(executor, lib.getModule("test_minmax_TS"), {"a": inp}, 0, 300)
+    for window in [5, 80]:
+        roll = df.rolling(window)
+        np.testing.assert_equal(out[f"min{window}"], roll.min().to_numpy())
+        np.testing.assert_equal(out[f"max{window}"], roll.max().to_numpy())
+        np.testing.assert_equal(out[f"argmin{window}"], roll.apply(lambda x: x.argmin() + 1, raw=True).to_numpy())
+        np.testing.assert_equal(out[f"argmax{window}"], roll.apply(lambda x: x.argmax() + 1, raw=True).to_numpy())
+    # the deques are kept in the states across the batches
+    stream = kr.StreamContext(executor, lib.getModule("test_minmax_STREAM"), 24)
+    out1 = stream.runTicks({"a": inp[:150]})
+    out2 = stream.runTicks({"a": inp[150:]})
+    for k in out:
+        np.testing.assert_equal(np.concatenate([out1[k], out2[k]]), out[k])
+
+def check_sorted_window(output_layout):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        # TsRank of the small window is not rewritten
+        for window in [5, 300]:
+            Output(TsRank(inp1, window), f"rank{window}")
+        for window in [5, 30]:
+            Output(WindowedQuantile(inp1, window, 0.25), f"quantile{window}")
+    f = Function(builder.ops)
+    return f"test_sorted_window_{output_layout}", f, KunCompilerConfig(input_layout="TS", output_layout=output_layout)
+
+def test_sorted_window(lib):
+    inp = np.round(np.random.randn(700, 24) * 3).astype("float32")
+    inp[100:110, 3] = np.nan
+    inp[500, :] = np.nan
+    df = pd.DataFrame(inp)
+    executor = kr.createSingleThreadExecutor()
+    out = kr.runGraph(executor, lib.getModule("test_sorted_window_TS"), {"a": inp}, 0, 700)
+    for window in [5, 300]:
+        np.testing.assert_allclose(out[f"rank{window}"], df.rolling(window).rank().to_numpy(), rtol=1e-6, equal_nan=True)
+    for window in [5, 30]:
+        expected = df.rolling(window, min_periods=1).quantile(0.25).to_numpy()
+        np.testing.assert_allclose(out[f"quantile{window}"], expected, rtol=1e-5, equal_nan=True)
+    # the sorted windows are kept in the states across the batches
+    stream = kr.StreamContext(executor, lib.getModule("test_sorted_window_STREAM"), 24)
+    out1 = stream.runTicks({"a": inp[:350]})
+    out2 = stream.runTicks({"a": inp[350:]})
+    for k in out:
+        np.testing.assert_equal(np.concatenate([out1[k], out2[k]]), out[k])
+
+def check_moments(dtype, output_layout, opt_reduce):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        inp2 = Input("b")
+        for window in [10, 60]:
+            Output(WindowedStddev(inp1, window), f"std{window}")
+            Output(WindowedCovariance(inp1, window, inp2), f"cov{window}")
+            Output(WindowedCorrelation(inp1, window, inp2), f"corr{window}")
+    f = Function(builder.ops)
+    return (f"test_moments_{dtype}_{output_layout}_{opt_reduce}", f,
+        KunCompilerConfig(dtype=dtype, input_layout="TS", output_layout=output_layout, options={"opt_reduce": opt_reduce}))
+
+def test_moments(lib, dtype):
+    # the running moments vs the two passes over the windows
+    num_time = 1000
+    rng = np.random.default_rng(123)
+    a = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (num_time, 24)), axis=0))
+    b = 1e6 * np.exp(np.cumsum(rng.normal(0, 0.05, (num_time, 24)), axis=0))
+    a[300:400, 2] = a[299, 2]
+    a[500:503, 3] = np.nan
+    b[700, 4] = np.nan
+    nptype = "float32" if dtype == "float" else "float64"
+    inp = {"a": a.astype(nptype), "b": b.astype(nptype)}
+    executor = kr.createSingleThreadExecutor()
+    out = kr.runGraph(executor, lib.getModule(f"test_moments_{dtype}_TS_True"), inp, 0, num_time)
+    expected = kr.runGraph(executor, lib.getModule(f"test_moments_{dtype}_TS_False"), inp, 0, num_time)
+    rtol = 1e-5 if dtype == "float" else 1e-10
+    dfa, dfb = pd.DataFrame(a), pd.DataFrame(b)
+    for window in [10, 60]:
+        np.testing.assert_allclose(out[f"std{window}"], expected[f"std{window}"], rtol=rtol * 10, equal_nan=True)
+        np.testing.assert_allclose(out[f"std{window}"], dfa.rolling(window).std(), rtol=rtol * 10, equal_nan=True)
+        # the covariance is relative to the stddev of the inputs
+        scale = np.nanmax(np.abs(expected[f"cov{window}"]))
+        np.testing.assert_allclose(out[f"cov{window}"], expected[f"cov{window}"], rtol=0, atol=scale * rtol, equal_nan=True)
+        np.testing.assert_allclose(out[f"corr{window}"], expected[f"corr{window}"], rtol=0, atol=rtol * 10, equal_nan=True)
+        # the windows of the constant values
+        assert(np.all(out[f"std{window}"][300 + window:400, 2] == 0))
+        assert(np.all(np.isnan(out[f"corr{window}"][300 + window:400, 2])))
+    # the running moments are kept in the states across the batches
+    stream = kr.StreamContext(executor, lib.getModule(f"test_moments_{dtype}_STREAM_True"), 24)
+    out1 = stream.runTicks({k: v[:450] for k, v in inp.items()})
+    out2 = stream.runTicks({k: v[450:] for k, v in inp.items()})
+    for k in out:
+        np.testing.assert_allclose(np.concatenate([out1[k], out2[k]]), out[k], rtol=rtol * 10,
+            atol=np.nanmax(np.abs(out[k])) * rtol, equal_nan=True)
+
+def check_normalize(dtype):
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        Output(ZScore(inp1), "zscore")
+        Output(Demean(inp1), "demean")
+        Output(Winsorize(inp1, 1.5), "winsorize")
+        Output(Scale(inp1), "scale")
+    f = Function(builder.ops)
+    return f"test_normalize_{dtype}", f, KunCompilerConfig(dtype=dtype, input_layout="TS", output_layout="TS")
+
+def test_normalize(lib, dtype):
+    modu = lib.getModule(f"test_normalize_{dtype}")
+    executor = kr.createSingleThreadExecutor()
+    # unaligned number of stocks
+    for num_stock in [24, 1003]:
+        inp = np.random.randn(12, num_stock).astype("float32" if dtype == "float" else "float64")
+        inp[:, ::7] = np.nan
+        inp[3, :] = np.nan
+        inp[4, 1:] = np.nan
+        inp[5, :] = 0
+        out = kr.runGraph(executor, modu, {"a": inp}, 0, 12)
+        df = pd.DataFrame(inp)
+        mean = df.mean(axis=1)
+        std = df.std(axis=1)
+        expected = {
+            "zscore": df.sub(mean, axis=0).div(std, axis=0),
+            "demean": df.sub(mean, axis=0),
+            "winsorize": df.clip(mean - 1.5 * std, mean + 1.5 * std, axis=0),
+            "scale": df.div(df.abs().sum(axis=1), axis=0),
+        }
+        for k, v in expected.items():
+            np.testing.assert_allclose(out[k], v.to_numpy(), rtol=1e-4, atol=1e-5, equal_nan=True)
+
+####################################
+
+def check_group():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        group = Input("g")
+        Output(GroupRank(inp1, group), "rank")
+        Output(GroupScale(inp1, group), "scale")
+        Output(GroupDemean(inp1 * 2, group), "demean")
+    f = Function(builder.ops)
+    return "test_group", f, KunCompilerConfig(input_layout="TS", output_layout="TS")
+
+def test_group(lib):
+    modu = lib.getModule("test_group")
+    num_time = 10
+    # unaligned number of stocks, with ties and NaN
+    inp = np.round(np.random.randn(num_time, 301) * 10).astype("float32")
+    inp[:, ::7] = np.nan
+    group = np.random.randint(0, 30, size=inp.shape).astype("float32")
+    group[:, ::11] = np.nan
+    group[2, :] = 3
+    group[:, 5] = -1
+    expected = {"rank": [], "scale": [], "demean": []}
+    for t in range(num_time):
+        s = pd.Series(inp[t])
+        g = pd.Series(group[t]).where(group[t] >= 0)
+        expected["rank"].append(s.groupby(g).rank(pct=True))
+        expected["scale"].append(s / s.abs().groupby(g).transform("sum"))
+        expected["demean"].append(s * 2 - (s * 2).groupby(g).transform("mean"))
+    out = kr.runGraph(kr.createSingleThreadExecutor(), modu, {"a": inp, "g": group}, 0, num_time)
+    for k, v in expected.items():
+        np.testing.assert_allclose(out[k], np.array(v), rtol=1e-5, equal_nan=True)
+    executor = kr.createMultiThreadExecutor(4)
+    executor.parallel_cs_min_stocks = 50
+    out2 = kr.runGraph(executor, modu, {"a": inp[:1], "g": group[:1]}, 0, 1)
+    for k in expected:
+        np.testing.assert_equal(out2[k], out[k][:1])
+
+####################################
+
+def check_cross_sectional_parallel():
+    builder = Builder()
+    with builder:
+        inp1 = Input("a")
+        Output(Rank(inp1), "ou1")
+        Output(Scale(inp1), "ou2")
+        Output(ZScore(inp1), "ou3")
+        Output(Winsorize(inp1), "ou4")
+    f = Function(builder.ops)
+    return "test_cs_parallel", f, KunCompilerConfig(input_layout="TS", output_layout="TS")
+
+def test_cross_sectional_parallel(lib):
+    modu = lib.getModule("test_cs_parallel")
+    # with ties and NaN
+    inp = np.round(np.random.randn(10, 1003) * 10).astype("float32")
+    inp[:, ::7] = np.nan
+    inp[3, :] = np.nan
+    expected = kr.runGraph(kr.createSingleThreadExecutor(), modu, {"a": inp}, 0, 10)
+    for executor in [kr.createMultiThreadExecutor(4), kr.createWorkStealingExecutor(4)]:
+        assert(executor.num_threads == 5)
+        executor.parallel_cs_min_stocks = 100
+        # the stocks are split when there are fewer tasks of time steps than the threads
+        for time_stride, length in [(8, 1), (8, 10), (4, 10), (1, 3)]:
+            executor.time_stride = time_stride
+            out = kr.runGraph(executor, modu, {"a": inp[:length]}, 0, length)
+            np.testing.assert_equal(out["ou1"], expected["ou1"][:length])
+            for k in ["ou2", "ou3", "ou4"]:
+                np.testing.assert_allclose(out[k], expected[k][:length], rtol=1e-5, atol=1e-6, equal_nan=True)
+    try:
+        executor.time_stride = 0
+        assert(False)
+    except RuntimeError:
+        pass
+    # stream mode
+    modu = lib.getModule("test_stream_float_STREAM")
+    inp = np.random.rand(20, 24).astype("float32")
+    executor = kr.createMultiThreadExecutor(3)
+    executor.parallel_cs_min_stocks = 8
+    out = kr.StreamContext(executor, modu, 24).runTicks({"a": inp})
+    expected = kr.StreamContext(kr.createSingleThreadExecutor(), modu, 24).runTicks({"a": inp})
+    for k in expected:
+        np.testing.assert_allclose(out[k], expected[k], rtol=1e-5, equal_nan=True)
+
+####################################
+
 funclist = [check_1(),
     check_TS(),
     check_rank(),
@@ -376,11 +895,35 @@ funclist = [check_1(),
     check_ema(),
     check_argmin(),
     check_aligned(),
-    check_rank_alpha029()
+    check_rank_alpha029(),
+    check_split_source(),
+    check_memory_plan(False),
+    check_memory_plan(True),
+    check_chunked_ema(),
+    check_chunked_sum(),
+    check_stream("float", "STREAM"),
+    check_stream("float", "TS"),
+    check_stream("double", "STREAM"),
+    check_stream("double", "TS"),
+    check_minmax("TS"),
+    check_minmax("STREAM"),
+    check_sorted_window("TS"),
+    check_sorted_window("STREAM"),
+    check_moments("float", "TS", True),
+    check_moments("float", "TS", False),
+    check_moments("float", "STREAM", True),
+    check_moments("double", "TS", True),
+    check_moments("double", "TS", False),
+    check_moments("double", "STREAM", True),
+    check_normalize("float"),
+    check_normalize("double"),
+    check_group(),
+    check_cross_sectional_parallel(),
     ]
 lib = cfake.compileit(funclist, "test", cfake.CppCompilerConfig())
 
 test_cfake()
+test_jit_cache()
 test_avg_stddev_TS(lib)
 kun_test_dll = os.path.join(cfake.get_runtime_path(), "KunTest.dll" if cfake.is_windows() else "libKunTest.so")
 if os.path.exists(kun_test_dll):
@@ -395,4 +938,18 @@ test_ema(lib)
 test_argmin_issue19(lib)
 test_aligned(lib)
 test_rank029(lib)
+test_split_source(lib)
+test_plan(lib)
+test_buffer_pool(lib)
+test_memory_plan(lib)
+test_chunked(lib)
+test_stream(lib)
+test_minmax(lib)
+test_sorted_window(lib)
+test_moments(lib, "float")
+test_moments(lib, "double")
+test_normalize(lib, "float")
+test_normalize(lib, "double")
+test_group(lib)
+test_cross_sectional_parallel(lib)
 print("done")